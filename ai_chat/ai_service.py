@@ -3,6 +3,7 @@ import re
 from typing import Dict, List, Tuple, Optional
 from django.db.models import Q
 from api.models import Product, ProductVariant, Brand, Category, Color, Size
+from api.keyword_matcher import BRAND_KEYWORDS, CATEGORY_KEYWORDS, INTENT_KEYWORDS, keyword_matcher
 from .models import AIKnowledgeBase, UserPreference
 import logging
 import random
@@ -13,75 +14,29 @@ logger = logging.getLogger(__name__)
 class AILanguageProcessor:
     """Xử lý ngôn ngữ tự nhiên nâng cao cho tiếng Việt"""
 
-    # Từ đồng nghĩa cho các intent
-    SEARCH_SYNONYMS = [
-        'tìm', 'search', 'tìm kiếm', 'có', 'bán', 'sản phẩm', 'hàng', 'đồ',
-        'áo', 'quần', 'giày', 'dép', 'túi', 'phụ kiện', 'mua', 'cần', 'muốn',
-        'shop', 'store', 'còn', 'bày bán', 'kinh doanh'
-    ]
-
-    SIZE_SYNONYMS = [
-        'size', 'cỡ', 'số', 'kích thước', 'vừa', 'to', 'nhỏ', 'lớn', 'bé',
-        'chọn size', 'size nào', 'đo size', 'hướng dẫn', 'bảng size'
-    ]
-
-    ORDER_SYNONYMS = [
-        'đặt hàng', 'order', 'mua', 'thanh toán', 'giỏ hàng', 'cart',
-        'checkout', 'đặt', 'giao hàng', 'ship', 'delivery'
-    ]
-
-    GREETING_SYNONYMS = [
-        'xin chào', 'hello', 'hi', 'chào', 'hey', 'good morning', 'good afternoon',
-        'chào bạn', 'chào shop', 'alo'
-    ]
-
-    PRICE_SYNONYMS = [
-        'giá', 'price', 'bao nhiêu', 'cost', 'tiền', 'phí', 'rẻ', 'đắt',
-        'khuyến mãi', 'sale', 'giảm giá', 'ưu đãi', 'discount'
-    ]
+    # Từ đồng nghĩa cho các intent (khai báo trong api.keyword_matcher)
+    SEARCH_SYNONYMS = INTENT_KEYWORDS['product_search']
+    SIZE_SYNONYMS = INTENT_KEYWORDS['size_help']
+    ORDER_SYNONYMS = INTENT_KEYWORDS['order_help']
+    GREETING_SYNONYMS = INTENT_KEYWORDS['greeting']
+    PRICE_SYNONYMS = INTENT_KEYWORDS['price_inquiry']
 
     # Thương hiệu phổ biến
-    BRAND_KEYWORDS = {
-        'nike': ['nike', 'nike air', 'air jordan'],
-        'adidas': ['adidas', 'three stripes', '3 sọc'],
-        'zara': ['zara'],
-        'h&m': ['h&m', 'hm'],
-        'uniqlo': ['uniqlo'],
-        'gucci': ['gucci'],
-        'louis vuitton': ['lv', 'louis vuitton'],
-        'chanel': ['chanel'],
-        'puma': ['puma'],
-        'converse': ['converse', 'chuck taylor']
-    }
+    BRAND_KEYWORDS = BRAND_KEYWORDS
 
     # Danh mục sản phẩm
-    CATEGORY_KEYWORDS = {
-        'áo': ['áo', 'shirt', 'top', 'áo thun', 'áo polo', 'áo khoác', 'hoodie', 'sweater'],
-        'quần': ['quần', 'pants', 'jean', 'jeans', 'quần jean', 'quần tây', 'short', 'quần short'],
-        'giày': ['giày', 'shoes', 'sneaker', 'boot', 'sandal', 'dép', 'giày thể thao'],
-        'túi': ['túi', 'bag', 'backpack', 'handbag', 'túi xách', 'balo'],
-        'phụ kiện': ['phụ kiện', 'accessory', 'mũ', 'hat', 'belt', 'thắt lưng', 'kính']
-    }
+    CATEGORY_KEYWORDS = CATEGORY_KEYWORDS
 
     @staticmethod
     def extract_intent(message: str) -> str:
         """Trích xuất intent từ tin nhắn"""
         message_lower = message.lower()
 
-        # Đếm số lượng từ khóa cho mỗi intent
-        search_count = sum(1 for word in AILanguageProcessor.SEARCH_SYNONYMS if word in message_lower)
-        size_count = sum(1 for word in AILanguageProcessor.SIZE_SYNONYMS if word in message_lower)
-        order_count = sum(1 for word in AILanguageProcessor.ORDER_SYNONYMS if word in message_lower)
-        greeting_count = sum(1 for word in AILanguageProcessor.GREETING_SYNONYMS if word in message_lower)
-        price_count = sum(1 for word in AILanguageProcessor.PRICE_SYNONYMS if word in message_lower)
-
-        # Tìm intent có điểm cao nhất
+        # Đếm số lượng từ khóa cho mỗi intent, một lượt quét duy nhất
+        hits = keyword_matcher.match(message_lower)
         intent_scores = {
-            'product_search': search_count,
-            'size_help': size_count,
-            'order_help': order_count,
-            'greeting': greeting_count,
-            'price_inquiry': price_count
+            intent: hits.count('intent', intent)
+            for intent in ('product_search', 'size_help', 'order_help', 'greeting', 'price_inquiry')
         }
 
         max_score = max(intent_scores.values())
@@ -106,35 +61,12 @@ class AILanguageProcessor:
 
         message_lower = message.lower()
 
-        # Trích xuất màu sắc nâng cao
-        color_patterns = {
-            'đỏ': ['đỏ', 'red', 'đỏ tươi', 'đỏ đậm'],
-            'xanh': ['xanh', 'blue', 'xanh dương', 'xanh da trời', 'navy'],
-            'xanh lá': ['xanh lá', 'green', 'xanh lục', 'xanh cây'],
-            'vàng': ['vàng', 'yellow', 'gold'],
-            'đen': ['đen', 'black', 'đen tuyền'],
-            'trắng': ['trắng', 'white', 'trắng tinh'],
-            'xám': ['xám', 'gray', 'grey', 'ghi'],
-            'nâu': ['nâu', 'brown', 'nâu đất'],
-            'hồng': ['hồng', 'pink', 'hồng phấn'],
-            'tím': ['tím', 'purple', 'violet'],
-            'cam': ['cam', 'orange'],
-            'be': ['be', 'beige', 'kem']
-        }
-
-        for color, patterns in color_patterns.items():
-            if any(pattern in message_lower for pattern in patterns):
-                entities['colors'].append(color)
+        hits = keyword_matcher.match(message_lower)
 
-        # Trích xuất thương hiệu
-        for brand, patterns in AILanguageProcessor.BRAND_KEYWORDS.items():
-            if any(pattern in message_lower for pattern in patterns):
-                entities['brands'].append(brand)
-
-        # Trích xuất danh mục
-        for category, patterns in AILanguageProcessor.CATEGORY_KEYWORDS.items():
-            if any(pattern in message_lower for pattern in patterns):
-                entities['categories'].append(category)
+        # Trích xuất màu sắc, thương hiệu, danh mục
+        entities['colors'] = hits.labels('color')
+        entities['brands'] = hits.labels('brand')
+        entities['categories'] = hits.labels('category')
 
         # Trích xuất size nâng cao
         size_patterns = [
@@ -156,26 +88,10 @@ class AILanguageProcessor:
                     entities['sizes'].append(size)
 
         # Trích xuất giới tính
-        if any(word in message_lower for word in ['nam', 'men', 'boy', 'male']):
-            entities['gender'] = 'nam'
-        elif any(word in message_lower for word in ['nữ', 'women', 'girl', 'female']):
-            entities['gender'] = 'nữ'
-        elif any(word in message_lower for word in ['unisex', 'cả nam và nữ']):
-            entities['gender'] = 'unisex'
+        entities['gender'] = hits.first('gender')
 
         # Trích xuất style
-        style_keywords = {
-            'basic': ['basic', 'cơ bản', 'đơn giản'],
-            'casual': ['casual', 'thường ngày', 'dạo phố'],
-            'formal': ['formal', 'công sở', 'lịch sự'],
-            'sport': ['sport', 'thể thao', 'gym', 'running'],
-            'vintage': ['vintage', 'cổ điển', 'retro'],
-            'streetwear': ['streetwear', 'đường phố', 'hip hop']
-        }
-
-        for style, patterns in style_keywords.items():
-            if any(pattern in message_lower for pattern in patterns):
-                entities['style'].append(style)
+        entities['style'] = hits.labels('style')
 
         # Trích xuất khoảng giá
         entities['price_range'] = AIProductSearchService.extract_price_range(message)
@@ -625,8 +541,8 @@ class AIResponseGenerator:
 
         if products:
             # Serialize products
-            from api.serializers import ProductSerializer
-            products_data = ProductSerializer(products, many=True).data
+            from api.serializers import ProductListSerializer, product_list_instances
+            products_data = ProductListSerializer(product_list_instances(products), many=True).data
             response['suggested_products'] = products_data
 
             # Tạo message thông minh với filter info
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from .models import AIConversation, AIMessage, AIAction, AIKnowledgeBase, UserPreference
-from api.serializers import ProductSerializer
+from api.serializers import ProductListSerializer
 from api.models import Product
 
 
@@ -52,6 +52,6 @@ class ChatResponseSerializer(serializers.Serializer):
     session_id = serializers.CharField()
     message_type = serializers.CharField()
     actions_taken = serializers.ListField(child=serializers.DictField(), required=False)
-    suggested_products = ProductSerializer(many=True, required=False)
+    suggested_products = ProductListSerializer(many=True, required=False)
     quick_replies = serializers.ListField(child=serializers.CharField(), required=False)
     metadata = serializers.JSONField(required=False, default=dict)
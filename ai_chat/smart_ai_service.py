@@ -10,8 +10,13 @@ from django.utils import timezone
 from django.contrib.auth.models import User
 import logging
 
+from api.keyword_matcher import keyword_matcher
+
 logger = logging.getLogger(__name__)
 
+# Số sản phẩm khớp từ khóa tối đa được đưa vào bộ lọc của search_products
+LEXICAL_CANDIDATES = 500
+
 
 class DatabaseReader:
     """Đọc và phân tích toàn bộ database"""
@@ -125,8 +130,11 @@ class DatabaseReader:
             from api.models import Product
             from django.db.models import Q
 
+            from api.lexical_index import get_lexical_index
+
             # Base query
             products = Product.objects.select_related('brand', 'category')
+            ranked_ids = None
 
             # Text search với từ khóa riêng lẻ
             if query:
@@ -142,15 +150,12 @@ class DatabaseReader:
                         keywords.append(word)
 
                 if keywords:
-                    search_q = Q()
-                    for keyword in keywords:
-                        search_q |= (
-                            Q(name__icontains=keyword) |
-                            Q(description__icontains=keyword) |
-                            Q(brand__title__icontains=keyword) |
-                            Q(category__title__icontains=keyword)
-                        )
-                    products = products.filter(search_q)
+                    # Xếp hạng BM25 trên index từ khóa trong bộ nhớ thay vì OR-chain icontains
+                    ranked_ids, _ = get_lexical_index().search(
+                        ' '.join(keywords), limit=LEXICAL_CANDIDATES, prefix=True
+                    )
+                    ranked_ids = ranked_ids.tolist()
+                    products = products.filter(id__in=ranked_ids)
                 else:
                     # Nếu không có keyword hợp lệ, tìm theo category chung
                     query_lower = query.lower()
@@ -176,6 +181,11 @@ class DatabaseReader:
                 if filters.get('size'):
                     products = products.filter(variants__size__name__icontains=filters['size'])
 
+            if ranked_ids is not None:
+                # Giữ thứ tự theo điểm BM25
+                rank = {product_id: position for position, product_id in enumerate(ranked_ids)}
+                products = sorted(products, key=lambda p: rank[p.id])
+
             # Serialize results
             results = []
             for p in products[:20]:  # Limit to 20 results
@@ -224,49 +234,28 @@ class SmartAIProcessor:
     
     def _is_database_query(self, message: str) -> bool:
         """Kiểm tra có phải query database không"""
-        keywords = [
-            'có bao nhiêu', 'tổng cộng', 'số lượng', 'danh sách', 'liệt kê',
-            'cho tôi biết', 'hiển thị', 'tất cả', 'toàn bộ'
-        ]
-        return any(keyword in message for keyword in keywords)
+        return keyword_matcher.match(message).has('smart_intent', 'database_query')
     
     def _is_product_search(self, message: str) -> bool:
         """Kiểm tra có phải tìm sản phẩm không"""
-        # Từ khóa tìm kiếm trực tiếp
-        search_keywords = ['tìm', 'search', 'mua', 'cần', 'muốn']
-
-        # Từ khóa sản phẩm
-        product_keywords = ['áo', 'quần', 'giày', 'dép', 'sản phẩm']
-
-        # Từ khóa hỏi về sản phẩm
-        inquiry_keywords = ['có', 'bán', 'shop']
-
-        # Từ khóa size (để nhận diện "size 42" là product search)
-        size_keywords = ['size', 'cỡ', 'kích thước']
+        hits = keyword_matcher.match(message)
 
         # Kiểm tra các pattern
-        has_search = any(keyword in message for keyword in search_keywords)
-        has_product = any(keyword in message for keyword in product_keywords)
-        has_inquiry = any(keyword in message for keyword in inquiry_keywords)
-        has_size = any(keyword in message for keyword in size_keywords)
+        has_search = hits.has('smart_intent', 'search')
+        has_product = hits.has('smart_intent', 'product')
+        has_inquiry = hits.has('smart_intent', 'inquiry')
+        has_size = hits.has('smart_intent', 'size')
 
         # Nếu có từ khóa tìm kiếm hoặc (có từ khóa hỏi + từ khóa sản phẩm) hoặc có size
         return has_search or (has_inquiry and has_product) or has_product or has_size
     
     def _is_stats_request(self, message: str) -> bool:
         """Kiểm tra có phải yêu cầu thống kê không"""
-        keywords = [
-            'thống kê', 'báo cáo', 'doanh thu', 'bán chạy', 'top', 'phổ biến',
-            'nhiều nhất', 'ít nhất', 'trung bình'
-        ]
-        return any(keyword in message for keyword in keywords)
+        return keyword_matcher.match(message).has('smart_intent', 'stats')
     
     def _is_recommendation_request(self, message: str) -> bool:
         """Kiểm tra có phải yêu cầu gợi ý không"""
-        keywords = [
-            'gợi ý', 'recommend', 'tư vấn', 'nên mua', 'phù hợp', 'đề xuất'
-        ]
-        return any(keyword in message for keyword in keywords)
+        return keyword_matcher.match(message).has('smart_intent', 'recommendation')
     
     def _handle_database_query(self, message: str) -> Dict:
         """Xử lý query database"""
@@ -404,24 +393,9 @@ class SmartAIProcessor:
                 break
         
         # Extract color với mapping chi tiết hơn
-        color_mapping = {
-            'đỏ': ['đỏ', 'red'],
-            'xanh dương': ['xanh dương', 'xanh', 'blue', 'navy'],
-            'xanh lá': ['xanh lá', 'green'],
-            'vàng': ['vàng', 'yellow'],
-            'đen': ['đen', 'black'],
-            'trắng': ['trắng', 'white'],
-            'xám': ['xám', 'gray', 'grey'],
-            'nâu': ['nâu', 'brown'],
-            'hồng': ['hồng', 'pink'],
-            'tím': ['tím', 'purple'],
-            'cam': ['cam', 'orange']
-        }
-
-        for color_name, keywords in color_mapping.items():
-            if any(keyword in message for keyword in keywords):
-                filters['color'] = color_name
-                break
+        color = keyword_matcher.match(message).first('filter_color')
+        if color:
+            filters['color'] = color
 
         # Extract size
         # Tìm size dạng số (36-43)
@@ -526,7 +500,7 @@ class SmartAIProcessor:
         """Xử lý chat chung"""
         message_lower = message.lower()
         
-        if any(word in message_lower for word in ['xin chào', 'hello', 'hi', 'chào']):
+        if keyword_matcher.match(message_lower).has('smart_intent', 'greeting'):
             return {
                 'message': 'Xin chào! 👋 Tôi là AI assistant của shop. Tôi có thể:\n\n🔍 Tìm kiếm sản phẩm\n📊 Cung cấp thống kê\n💡 Gợi ý sản phẩm\n📋 Trả lời mọi câu hỏi về database\n\nBạn cần hỗ trợ gì?',
                 'quick_replies': ['Tìm sản phẩm', 'Xem thống kê', 'Gợi ý cho tôi', 'Hỗ trợ'],
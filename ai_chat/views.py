@@ -17,7 +17,7 @@ from .serializers import (
 )
 from .ai_service import AIResponseGenerator, AIProductSearchService, AISizeRecommendationService
 from api.models import Product
-from api.serializers import ProductSerializer
+from api.serializers import ProductListSerializer, ProductSerializer, product_list_instances
 
 logger = logging.getLogger(__name__)
 
@@ -235,8 +235,8 @@ class AIChatView(APIView):
 
         if products:
             # Serialize sản phẩm
-            from api.serializers import ProductSerializer
-            products_data = ProductSerializer(products, many=True).data
+            from api.serializers import ProductListSerializer
+            products_data = ProductListSerializer(product_list_instances(products), many=True).data
 
             # Tạo message với link sản phẩm
             product_count = len(products)
@@ -373,8 +373,8 @@ class AIChatView(APIView):
     def _format_products_response(self, products, original_message):
         """Format response với sản phẩm tìm được"""
         try:
-            from api.serializers import ProductSerializer
-            products_data = ProductSerializer(products, many=True).data
+            from api.serializers import ProductListSerializer
+            products_data = ProductListSerializer(product_list_instances(products), many=True).data
 
             product_count = len(products_data)
             message_text = f"🛍️ Tôi tìm thấy **{product_count} sản phẩm** phù hợp:\n\n"
@@ -456,7 +456,7 @@ class AIChatView(APIView):
         try:
             from api.models import Product, Brand, Category
             from django.db.models import Q
-            from api.serializers import ProductSerializer
+            from api.serializers import ProductListSerializer
 
             # Extract entities từ database
             entities = self._extract_entities_from_database(message_lower)
@@ -521,7 +521,7 @@ class AIChatView(APIView):
 
             if products.exists():
                 # Serialize products
-                products_data = ProductSerializer(products, many=True).data
+                products_data = ProductListSerializer(product_list_instances(products), many=True).data
 
                 # Tạo response message
                 filter_info = []
@@ -803,7 +803,7 @@ class ProductRecommendationView(APIView):
         
         try:
             products = AIProductSearchService.search_products(query, request.user, limit)
-            serializer = ProductSerializer(products, many=True)
+            serializer = ProductListSerializer(product_list_instances(products), many=True)
             return Response({
                 'products': serializer.data,
                 'count': len(products),
@@ -1,46 +1,272 @@
 import os
-import torch
+import hashlib
+import importlib.util
+import time
 import numpy as np
 from PIL import Image
-from transformers import CLIPModel, CLIPProcessor
-from sentence_transformers import SentenceTransformer
 import pickle
 from django.conf import settings
-from .models import Product
+from django.db.models import Prefetch
+from .models import Product, ProductVariant
+from .embedding_index import EmbeddingIndex, IndexLoader, storage_report, top_k_indices
+from .ann_index import ExactSearcher, IVFIndex, IVFLoader, recall_report
+from .search_cache import ImageHashCache, QueryCache, image_signature, normalize_query
+from .search_fusion import FUSION_METHODS
+from .lexical_index import get_lexical_index
+from .catalog_filters import catalog_filters_version, get_catalog_filters
+from .keyword_matcher import SEARCH_CATEGORY_KEYWORDS, keyword_matcher
 import logging
-from django.db.models import Q
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from django.db import close_old_connections
 
 logger = logging.getLogger(__name__)
 
+CLIP_MODEL_NAME = "openai/clip-vit-base-patch32"
+TEXT_MODEL_NAME = "all-MiniLM-L6-v2"
+
+# CLIP resizes the shortest side to 224px before cropping; decoding straight to
+# that size in the worker processes keeps the pickled arrays small.
+CLIP_IMAGE_SIZE = 224
+# Seconds between checkpoint writes during a long precompute run
+CHECKPOINT_INTERVAL = 60
+# Ranking weights, overridable through settings.AI_SEARCH_SCORING: the image
+# and text branches of combined search, and the bonuses added to the cosine
+# similarity in text search for the normalised BM25 score and for each
+# primary keyword of the detected category
+DEFAULT_SCORING = {
+    'IMAGE_WEIGHT': 0.6,
+    'TEXT_WEIGHT': 0.4,
+    'LEXICAL_WEIGHT': 0.2,
+    'CATEGORY_WEIGHT': 0.1,
+}
+# Embeddings a "more like this" search can compare; combined fuses both with the weights above
+SIMILAR_KINDS = ('combined', 'image', 'text')
+# Imported on first model load, so index tooling and mocked runs work without them
+MODEL_PACKAGES = ('torch', 'transformers', 'sentence_transformers')
+
+
+def model_dependencies_available():
+    """True when the packages the CLIP and text models need are installed"""
+    return all(importlib.util.find_spec(name) is not None for name in MODEL_PACKAGES)
+
+
+def product_search_text(product):
+    """Text that is embedded and keyword-matched for a product"""
+    return f"{product.name} {product.description or ''}"
+
+
+def product_image_path(product):
+    if not product.image:
+        return None
+    return os.path.join(settings.MEDIA_ROOT, str(product.image))
+
+
+def product_variant_images(product):
+    """``(variant_id, path)`` of each distinct variant image other than the main image.
+
+    Sizes of one colour usually share a photo; the lowest variant id stands
+    for it. Expects ``variants`` prefetched in id order.
+    """
+    seen = {product_image_path(product)}
+    images = []
+    for variant in product.variants.all():
+        if not variant.image:
+            continue
+        path = os.path.join(settings.MEDIA_ROOT, str(variant.image))
+        if path not in seen:
+            seen.add(path)
+            images.append((variant.id, path))
+    return images
+
+
+def embedding_products():
+    """Products with just the fields and variant images the embedding refresh reads"""
+    return Product.objects.only('id', 'name', 'description', 'image').prefetch_related(
+        Prefetch('variants', queryset=ProductVariant.objects.only('id', 'product_id', 'image').order_by('id'))
+    )
+
+
+def filters_key(filters):
+    """Hashable, order-independent form of a catalog filter dict for cache keys.
+
+    When anything is filtered the key also carries the catalog attribute
+    version, so a stock, price or category change retires cached rankings.
+    """
+    key = tuple(sorted(
+        (name, tuple(value) if isinstance(value, (list, tuple)) else value)
+        for name, value in (filters or {}).items()
+        if value is not None
+    ))
+    if key:
+        key += (('catalog_version', catalog_filters_version()),)
+    return key
+
+
+def load_catalog_image(image_path):
+    """Decode and downscale a catalog image; runs inside the precompute process pool"""
+    try:
+        with Image.open(image_path) as image:
+            # Let the JPEG decoder skip detail we would throw away anyway
+            image.draft('RGB', (CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE))
+            image = image.convert('RGB')
+            scale = CLIP_IMAGE_SIZE / min(image.size)
+            if scale < 1:
+                image = image.resize(
+                    (max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                    Image.BICUBIC,
+                )
+            return np.asarray(image)
+    except Exception as e:
+        logger.error(f"Error loading image {image_path}: {e}")
+        return None
+
+
+def product_fingerprint(product):
+    """Hash of everything that feeds a product's embeddings.
+
+    Image files (main and distinct variant images) are identified by their
+    path, size and mtime rather than their bytes so a refresh over the whole
+    catalog only needs a ``stat`` per file.
+    """
+    digest = hashlib.sha1()
+    digest.update((product.name or '').encode('utf-8'))
+    digest.update(b'\0')
+    digest.update((product.description or '').encode('utf-8'))
+    digest.update(b'\0')
+    image_path = product_image_path(product)
+    for variant_id, path in [(None, image_path)] + product_variant_images(product):
+        if not path:
+            continue
+        if variant_id is not None:
+            digest.update(f"|{variant_id}|".encode('ascii'))
+        digest.update(path.encode('utf-8'))
+        try:
+            stat = os.stat(path)
+            digest.update(f":{stat.st_size}:{stat.st_mtime_ns}".encode('ascii'))
+        except OSError:
+            digest.update(b':missing')
+    return digest.hexdigest()
+
+
 class AISearchService:
     def __init__(self):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        # Resolved when CLIP loads, which is also when torch is first imported
+        self.device = None
         self.clip_model = None
         self.clip_processor = None
         self.text_model = None
-        self.embeddings_cache = {}
-        self.cache_dir = os.path.join(settings.BASE_DIR, 'ai_cache')
+        self.model_load_times = {}
+        self._model_locks = {'clip': threading.Lock(), 'text': threading.Lock()}
+        self.cache_dir = getattr(settings, 'AI_CACHE_DIR', os.path.join(settings.BASE_DIR, 'ai_cache'))
         os.makedirs(self.cache_dir, exist_ok=True)
+        self.index_file = os.path.join(self.cache_dir, 'product_embeddings.idx')
+        self.legacy_cache_file = os.path.join(self.cache_dir, 'product_embeddings.pkl')
+        self.index_loader = IndexLoader(self.index_file, CLIP_MODEL_NAME, TEXT_MODEL_NAME)
+        # float32, float16 or int8 (per-vector scale); see embedding_index.STORAGE_DTYPES
+        self.index_storage = getattr(settings, 'AI_SEARCH_INDEX_STORAGE', 'float32')
+        self.query_embedding_cache = QueryCache('ai-search:text-vector')
+        self.text_results_cache = QueryCache('ai-search:text-results')
+        self.cache_text_results = getattr(settings, 'AI_SEARCH_QUERY_CACHE', {}).get('CACHE_RESULTS', True)
+        self.image_embedding_cache = ImageHashCache()
+        self.image_results_cache = QueryCache('ai-search:image-ranking')
+        self.similar_results_cache = QueryCache('ai-search:similar')
+        self.ann_config = getattr(settings, 'AI_SEARCH_ANN', {})
+        self.scoring = {**DEFAULT_SCORING, **getattr(settings, 'AI_SEARCH_SCORING', {})}
+        # Runs the image and text branches of a combined search side by side;
+        # both models release the GIL during inference
+        self.branch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='ai-search-branch')
+        self.ann_loaders = {
+            kind: IVFLoader(os.path.join(self.cache_dir, f'product_embeddings.ivf-{kind}.idx'))
+            for kind in ('image', 'text')
+        }
+        # (kind, IVF index version, embedding index version) already warned about
+        self._stale_ann_warned = set()
         
     def load_models(self):
         """Load AI models"""
-        try:
-            logger.info("Loading CLIP model...")
-            self.clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32").to(self.device)
-            self.clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-            
-            logger.info("Loading text embedding model...")
-            self.text_model = SentenceTransformer('all-MiniLM-L6-v2')
-            
-            logger.info("AI models loaded successfully!")
-        except Exception as e:
-            logger.error(f"Error loading AI models: {e}")
-            raise
+        self.load_clip_model()
+        self.load_text_model()
+        logger.info("AI models loaded successfully!")
+    
+    def load_clip_model(self):
+        """Load CLIP on first use; concurrent callers wait for a single load"""
+        if self.clip_model is not None:
+            return
+        with self._model_locks['clip']:
+            if self.clip_model is not None:
+                return
+            try:
+                logger.info("Loading CLIP model...")
+                started_at = time.monotonic()
+                import torch
+                from transformers import CLIPModel, CLIPProcessor
+                self.device = "cuda" if torch.cuda.is_available() else "cpu"
+                self.clip_processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+                self.clip_model = CLIPModel.from_pretrained(CLIP_MODEL_NAME).to(self.device)
+                self.model_load_times['clip'] = round(time.monotonic() - started_at, 2)
+                logger.info(f"CLIP model loaded in {self.model_load_times['clip']}s")
+            except Exception as e:
+                logger.error(f"Error loading CLIP model: {e}")
+                raise
+    
+    def load_text_model(self):
+        """Load the sentence-transformer on first use; concurrent callers wait for a single load"""
+        if self.text_model is not None:
+            return
+        with self._model_locks['text']:
+            if self.text_model is not None:
+                return
+            try:
+                logger.info("Loading text embedding model...")
+                started_at = time.monotonic()
+                from sentence_transformers import SentenceTransformer
+                self.text_model = SentenceTransformer(TEXT_MODEL_NAME)
+                self.model_load_times['text'] = round(time.monotonic() - started_at, 2)
+                logger.info(f"Text embedding model loaded in {self.model_load_times['text']}s")
+            except Exception as e:
+                logger.error(f"Error loading text embedding model: {e}")
+                raise
+    
+    def warm_up(self, models=('clip', 'text')):
+        """Load the requested models and the embedding index before serving traffic.
+
+        Each model also runs one throwaway inference so lazy kernel/tokenizer
+        initialisation happens here rather than in the first request.
+        Returns the time spent per step in seconds.
+        """
+        timings = {}
+        started_at = time.monotonic()
+        self.load_index()
+        timings['index'] = round(time.monotonic() - started_at, 2)
+        
+        if 'clip' in models:
+            started_at = time.monotonic()
+            self.load_clip_model()
+            self.get_image_embedding(Image.new('RGB', (CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE)))
+            timings['clip'] = round(time.monotonic() - started_at, 2)
+        if 'text' in models:
+            started_at = time.monotonic()
+            self.load_text_model()
+            self.get_text_embedding('warm up')
+            timings['text'] = round(time.monotonic() - started_at, 2)
+        
+        logger.info(f"AI search warm-up finished: {timings}")
+        return timings
+    
+    def model_status(self):
+        return {
+            'device': self.device,
+            'clip_loaded': self.clip_model is not None,
+            'text_loaded': self.text_model is not None,
+            'load_seconds': dict(self.model_load_times),
+        }
     
     def get_image_embedding(self, image):
         """Get embedding for image"""
         if self.clip_model is None:
-            self.load_models()
+            self.load_clip_model()
+        import torch
             
         try:
             if isinstance(image, str):
@@ -59,10 +285,33 @@ class AISearchService:
             logger.error(f"Error getting image embedding: {e}")
             return None
     
+    def get_image_embeddings(self, images):
+        """Embed a batch of decoded RGB images in one forward pass"""
+        if self.clip_model is None:
+            self.load_clip_model()
+        if not images:
+            return []
+        import torch
+        
+        images = [Image.fromarray(image) if isinstance(image, np.ndarray) else image for image in images]
+        inputs = self.clip_processor(images=images, return_tensors="pt").to(self.device)
+        with torch.no_grad():
+            image_features = self.clip_model.get_image_features(**inputs)
+            image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+        return list(image_features.cpu().numpy())
+    
+    def get_text_embeddings(self, texts, batch_size=32):
+        """Embed a list of texts, letting the model batch them"""
+        if self.text_model is None:
+            self.load_text_model()
+        if not texts:
+            return []
+        return list(self.text_model.encode(texts, batch_size=batch_size, convert_to_tensor=False))
+    
     def get_text_embedding(self, text):
         """Get embedding for text"""
         if self.text_model is None:
-            self.load_models()
+            self.load_text_model()
             
         try:
             embedding = self.text_model.encode(text, convert_to_tensor=False)
@@ -71,150 +320,546 @@ class AISearchService:
             logger.error(f"Error getting text embedding: {e}")
             return None
     
-    def load_embeddings_cache(self):
-        """Load precomputed embeddings"""
-        cache_file = os.path.join(self.cache_dir, 'product_embeddings.pkl')
-        if os.path.exists(cache_file):
-            try:
-                with open(cache_file, 'rb') as f:
-                    self.embeddings_cache = pickle.load(f)
-                logger.info(f"Loaded {len(self.embeddings_cache)} cached embeddings")
-            except Exception as e:
-                logger.error(f"Error loading embeddings cache: {e}")
-                self.embeddings_cache = {}
+    def load_index(self):
+        """Return the memory-mapped embedding index, reopening it only if the file changed"""
+        if not os.path.exists(self.index_file) and os.path.exists(self.legacy_cache_file):
+            self.migrate_legacy_cache()
+        return self.index_loader.get()
+    
+    def save_index(self, index):
+        """Atomically replace the on-disk embedding index, in the configured vector storage"""
+        header = index.with_storage(self.index_storage).save(self.index_file, CLIP_MODEL_NAME, TEXT_MODEL_NAME)
+        logger.info(f"Embedding index v{header['version']} saved with {header['count']} products")
+        return header
+    
+    def ann_wanted(self, index):
+        """Whether IVF search applies to ``index``: enabled and the catalog is large enough"""
+        return self.ann_config.get('ENABLED', True) and len(index) >= self.ann_config.get('MIN_PRODUCTS', 5000)
+
+    def get_searcher(self, index, kind):
+        """IVF index for ``kind`` if enabled and built for this index version, else exact search"""
+        if not self.ann_wanted(index):
+            return ExactSearcher()
+        ann = self.ann_loaders[kind].get()
+        if ann is None:
+            return ExactSearcher()
+        if ann.header.get('index_version') != index.header.get('version'):
+            key = (kind, ann.header.get('index_version'), index.header.get('version'))
+            if key not in self._stale_ann_warned:
+                self._stale_ann_warned.add(key)
+                logger.warning(
+                    f"Ignoring {kind} IVF index built for embedding index v{key[1]} (current v{key[2]}); "
+                    f"falling back to exact search until `precompute_embeddings --build-ann` is run"
+                )
+            return ExactSearcher()
+        return ann
+    
+    def build_ann_indexes(self, nlist=None):
+        """Train IVF indexes over the current embedding index (image and text)"""
+        index = self.load_index()
+        built = {}
+        for kind, loader in self.ann_loaders.items():
+            # Centroids are trained on main vectors; variant images are bucketed under their product
+            main_mask = index.image_mask if kind == 'image' else index.text_mask
+            if not main_mask.any():
+                continue
+            started_at = time.monotonic()
+            extra = {}
+            if kind == 'image' and index.has_variants:
+                extra = {'extra_vectors': index.variant_vectors, 'extra_rows': index.variant_owner_rows()}
+            ann = IVFIndex.build(index.vectors(kind), main_mask, nlist=nlist, **extra)
+            ann.save(loader.path, {'index_version': index.header.get('version', 0), 'embedding': kind})
+            built[kind] = {'nlist': ann.nlist, 'seconds': round(time.monotonic() - started_at, 2)}
+            logger.info(f"Built {kind} IVF index with {ann.nlist} lists for index v{index.header.get('version', 0)}")
+        return built
+    
+    def ann_recall_report(self, k=10, nprobe_values=(1, 2, 4, 8, 16, 32)):
+        """Recall@k/latency of the IVF indexes against exact search, per embedding kind"""
+        index = self.load_index()
+        report = {}
+        for kind, loader in self.ann_loaders.items():
+            ann = loader.get()
+            if ann is None or ann.header.get('index_version') != index.header.get('version'):
+                continue
+            report[kind] = recall_report(index, kind, ann, k=k, nprobe_values=nprobe_values)
+        return report
     
-    def save_embeddings_cache(self):
-        """Save embeddings to cache"""
-        cache_file = os.path.join(self.cache_dir, 'product_embeddings.pkl')
+    def storage_report(self, k=10):
+        """Recall@k, size and latency of float16/int8 storage against float32 for the current index"""
+        return storage_report(self.load_index(), k=k)
+    
+    def migrate_legacy_cache(self):
+        """Convert the old pickled ``product_embeddings.pkl`` dict into an index file"""
         try:
-            with open(cache_file, 'wb') as f:
-                pickle.dump(self.embeddings_cache, f)
-            logger.info("Embeddings cache saved successfully")
+            with open(self.legacy_cache_file, 'rb') as f:
+                embeddings_cache = pickle.load(f)
+            products = Product.objects.in_bulk([data['product_id'] for data in embeddings_cache.values()])
+            for data in embeddings_cache.values():
+                product = products.get(data['product_id'])
+                data['product_text'] = product_search_text(product) if product else ''
+            self.save_index(EmbeddingIndex.from_cache(embeddings_cache))
+            logger.info(f"Migrated {len(embeddings_cache)} pickled embeddings to {self.index_file}")
         except Exception as e:
-            logger.error(f"Error saving embeddings cache: {e}")
+            logger.error(f"Error migrating legacy embeddings cache: {e}")
     
-    def precompute_product_embeddings(self):
-        """Precompute embeddings for all products"""
-        self.load_models()
-        self.load_embeddings_cache()
+    def precompute_product_embeddings(self, full=False, batch_size=32, workers=0, checkpoint_file=None,
+                                      rebuild_ann=True):
+        """Bring the embedding index in line with the product table.
+
+        By default only products whose fingerprint changed (or that are new)
+        are re-embedded and products that no longer exist are dropped; pass
+        ``full=True`` to re-embed the whole catalog. The index file is only
+        rewritten when something changed.
+
+        Changed products are streamed through the models ``batch_size`` at a
+        time. With ``workers`` > 1, image decoding and resizing run in a
+        process pool while the models embed the previous batch. If
+        ``checkpoint_file`` is given, progress is written there every
+        ``CHECKPOINT_INTERVAL`` seconds and picked up again by the next run.
+
+        A rewritten index gets a new version, which retires the IVF indexes
+        built for the old one; with ``rebuild_ann`` they are rebuilt right
+        away when ANN search applies to the new index.
+        """
+        embeddings_cache = {} if full else self.load_index().to_cache()
+        if checkpoint_file and os.path.exists(checkpoint_file):
+            checkpoint = self.load_checkpoint(checkpoint_file)
+            embeddings_cache.update(checkpoint)
+            logger.info(f"Resuming from checkpoint with {len(checkpoint)} products")
         
-        products = Product.objects.all()
-        updated_count = 0
+        stale_keys = set(embeddings_cache)
+        stats = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0, 'failed': 0}
+        pending = []
         
-        for product in products:
+        for product in embedding_products().iterator(chunk_size=2000):
             cache_key = f"product_{product.id}"
+            stale_keys.discard(cache_key)
+            fingerprint = product_fingerprint(product)
             
             # Skip if already cached and product not modified
-            if cache_key in self.embeddings_cache:
+            cached = embeddings_cache.get(cache_key)
+            if cached is not None and cached.get('fingerprint') == fingerprint:
+                stats['unchanged'] += 1
                 continue
+            pending.append((product, fingerprint, cached is not None))
+        
+        # Products deleted since the last run
+        for cache_key in stale_keys:
+            del embeddings_cache[cache_key]
+        stats['removed'] = len(stale_keys)
+        
+        batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        started_at = last_checkpoint = time.monotonic()
+        processed = 0
+        pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 and batches else None
+        try:
+            # Decode the next batch in the pool while the current one is embedded
+            next_images = self._decode_batch_images(batches[0], pool) if batches else None
+            for position, batch in enumerate(batches):
+                images = next_images
+                if position + 1 < len(batches):
+                    next_images = self._decode_batch_images(batches[position + 1], pool)
                 
-            try:
-                # Image embedding
-                image_embedding = None
-                if product.image:
-                    image_path = os.path.join(settings.MEDIA_ROOT, str(product.image))
-                    if os.path.exists(image_path):
-                        image_embedding = self.get_image_embedding(image_path)
-                
-                # Text embedding (name + description)
-                text_content = f"{product.name} {product.description or ''}"
-                text_embedding = self.get_text_embedding(text_content)
-                
-                self.embeddings_cache[cache_key] = {
-                    'image_embedding': image_embedding,
-                    'text_embedding': text_embedding,
-                    'product_id': product.id
-                }
+                self._embed_batch(batch, images, embeddings_cache, stats, batch_size)
+                processed += len(batch)
                 
-                updated_count += 1
-                if updated_count % 10 == 0:
-                    logger.info(f"Processed {updated_count} products...")
-                    
-            except Exception as e:
-                logger.error(f"Error processing product {product.id}: {e}")
+                elapsed = time.monotonic() - started_at
+                logger.info(
+                    f"Processed {processed}/{len(pending)} products "
+                    f"({processed / elapsed if elapsed else 0:.1f} products/s)"
+                )
+                if checkpoint_file and time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                    self.save_checkpoint(checkpoint_file, embeddings_cache)
+                    last_checkpoint = time.monotonic()
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        
+        elapsed = time.monotonic() - started_at
+        stats['seconds'] = round(elapsed, 2)
+        stats['products_per_second'] = round(processed / elapsed, 2) if elapsed and processed else 0.0
+        
+        if full or stats['added'] or stats['updated'] or stats['removed']:
+            self.save_index(EmbeddingIndex.from_cache(embeddings_cache))
+            if rebuild_ann and self.ann_wanted(self.load_index()):
+                try:
+                    stats['ann'] = self.build_ann_indexes()
+                except Exception as e:
+                    logger.error(f"Error rebuilding IVF indexes; exact search is used until they are rebuilt: {e}")
+        if checkpoint_file and os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+        logger.info(f"Embedding refresh finished: {stats}")
+        return stats
+    
+    def _decode_batch_images(self, batch, pool):
+        """Start decoding a batch's images, main image first then variant images, per product.
+
+        Returns one ``(main, [(variant_id, image), ...])`` pair per product,
+        holding futures (pool) or arrays (inline).
+        """
+        def decode(path):
+            if not path or not os.path.exists(path):
+                return None
+            return pool.submit(load_catalog_image, path) if pool is not None else load_catalog_image(path)
+        
+        return [
+            (
+                decode(product_image_path(product)),
+                [(variant_id, decode(path)) for variant_id, path in product_variant_images(product)],
+            )
+            for product, _, _ in batch
+        ]
+    
+    def _embed_batch(self, batch, images, embeddings_cache, stats, batch_size):
+        def result(image):
+            return image.result() if hasattr(image, 'result') else image
         
-        self.save_embeddings_cache()
-        logger.info(f"Precomputed embeddings for {updated_count} products")
+        try:
+            images = [
+                (result(main), [(variant_id, result(image)) for variant_id, image in variants])
+                for main, variants in images
+            ]
+            # Main and variant images of the whole batch go through CLIP together
+            decoded = [
+                image
+                for main, variants in images
+                for image in [main] + [image for _, image in variants]
+                if image is not None
+            ]
+            image_embeddings = iter(self.get_image_embeddings(decoded))
+            
+            # Text embedding (name + description)
+            texts = [product_search_text(product) for product, _, _ in batch]
+            text_embeddings = self.get_text_embeddings(texts, batch_size=batch_size)
+        except Exception as e:
+            stats['failed'] += len(batch)
+            logger.error(f"Error embedding batch starting at product {batch[0][0].id}: {e}")
+            return
+        
+        for (product, fingerprint, existed), (main, variants), text_content, text_embedding in zip(
+            batch, images, texts, text_embeddings
+        ):
+            image_embedding = next(image_embeddings) if main is not None else None
+            variants = [(variant_id, next(image_embeddings)) for variant_id, image in variants if image is not None]
+            embeddings_cache[f"product_{product.id}"] = {
+                'image_embedding': image_embedding,
+                'variant_ids': [variant_id for variant_id, _ in variants],
+                'variant_embeddings': [embedding for _, embedding in variants],
+                'text_embedding': text_embedding,
+                'product_text': text_content,
+                'fingerprint': fingerprint,
+                'product_id': product.id
+            }
+            stats['updated' if existed else 'added'] += 1
+    
+    def save_checkpoint(self, checkpoint_file, embeddings_cache):
+        EmbeddingIndex.from_cache(embeddings_cache).save(checkpoint_file, CLIP_MODEL_NAME, TEXT_MODEL_NAME)
+        logger.info(f"Checkpoint saved with {len(embeddings_cache)} products")
+    
+    def load_checkpoint(self, checkpoint_file):
+        """Entries from a previous interrupted run, if it used the same models"""
+        try:
+            checkpoint = EmbeddingIndex.load(checkpoint_file)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable checkpoint {checkpoint_file}: {e}")
+            return {}
+        if (checkpoint.header.get('image_model'), checkpoint.header.get('text_model')) != (CLIP_MODEL_NAME, TEXT_MODEL_NAME):
+            return {}
+        return checkpoint.to_cache()
+    
+    def fetch_ranked_products(self, product_ids, similarities, limit, queryset=None):
+        """Load ranked products with one ``in_bulk`` query, skipping ids deleted since indexing.
+
+        ``queryset`` lets callers add the annotations/prefetches their
+        serializer needs to that single query.
+        """
+        if queryset is None:
+            queryset = Product.objects.all()
+        products = queryset.in_bulk(product_ids)
+        ranked = []
+        for product_id, similarity in zip(product_ids, similarities):
+            product = products.get(product_id)
+            if product is None:
+                continue
+            ranked.append((product, similarity))
+            if len(ranked) == limit:
+                break
+        return ranked
     
-    def search_by_image(self, image, limit=5):
+    def search_by_image(self, image, limit=5, queryset=None, filters=None):
         """Enhanced image search with better similarity calculation"""
-        self.load_embeddings_cache()
+        ranked = self.rank_image(image, limit, filters)
+        if ranked is None:
+            return []
         
-        query_embedding = self.get_image_embedding(image)
-        if query_embedding is None:
+        product_ids, similarities, variant_ids = ranked
+        matched_variants = dict(zip(product_ids, variant_ids))
+        results = []
+        for product, similarity in self.fetch_ranked_products(product_ids, similarities, limit, queryset=queryset):
+            compatibility_percent = min(100, max(0, int(similarity * 100)))
+            results.append({
+                'product': product,
+                'similarity': similarity,
+                'compatibility_percent': compatibility_percent,
+                'variant_id': matched_variants.get(product.id),
+            })
+        
+        return results
+    
+    def rank_image(self, image, limit, filters=None):
+        """Rank the catalog against an image; returns ``(product_ids, similarities, variant_ids)`` or None.
+
+        Up to ``limit * 2`` ids are returned so callers can skip products
+        deleted since indexing without coming up short. ``variant_ids`` names
+        the variant whose image matched best, or None where the main image did.
+        ``filters`` restrict the catalog (see ``catalog_filter_mask``).
+        """
+        index = self.load_index()
+        
+        try:
+            if isinstance(image, str) or hasattr(image, 'read'):
+                image = Image.open(image).convert('RGB')
+        except Exception as e:
+            logger.error(f"Error opening search image: {e}")
+            return None
+        
+        # Near-identical uploads (same colour, dHash within a few bits) reuse
+        # the cached embedding and ranking instead of running CLIP again
+        signature, query_embedding = self.image_embedding_cache.lookup(image_signature(image))
+        results_key = (CLIP_MODEL_NAME, index.header.get('version', 0), signature, limit, filters_key(filters))
+        ranked = self.image_results_cache.get(results_key)
+        if ranked is None:
+            if query_embedding is None:
+                query_embedding = self.get_image_embedding(image)
+                if query_embedding is None:
+                    return None
+                query_embedding.flags.writeable = False
+                self.image_embedding_cache.set(signature, query_embedding)
+            
+            # Over-fetch a little so products deleted since indexing don't shrink the result
+            searcher = self.get_searcher(index, 'image')
+            product_ids, scores = searcher.search(
+                index, 'image', query_embedding, limit * 2,
+                mask=self.catalog_filter_mask(index, filters), nprobe=self.ann_config.get('NPROBE', 8),
+            )
+            # Convert from [-1, 1] to [0, 1]
+            ranked = (
+                product_ids.tolist(),
+                ((scores + 1) / 2).tolist(),
+                index.matching_variants(query_embedding, product_ids),
+            )
+            self.image_results_cache.set(results_key, ranked)
+        
+        return ranked
+    
+    def get_query_text_embedding(self, query):
+        """Text embedding for a normalised search query, served from the query cache when hot"""
+        key = (TEXT_MODEL_NAME, query)
+        embedding = self.query_embedding_cache.get(key)
+        if embedding is None:
+            embedding = self.get_text_embedding(query)
+            if embedding is None:
+                return None
+            embedding = np.asarray(embedding, dtype=np.float32)
+            embedding.flags.writeable = False
+            self.query_embedding_cache.set(key, embedding)
+        return embedding
+    
+    def cache_stats(self):
+        return {
+            'query_vectors': self.query_embedding_cache.stats(),
+            'text_results': self.text_results_cache.stats(),
+            'image_vectors': self.image_embedding_cache.stats(),
+            'image_results': self.image_results_cache.stats(),
+            'similar_results': self.similar_results_cache.stats(),
+        }
+    
+    def search_by_text(self, query, limit=10, queryset=None, filters=None):
+        """Enhanced text search with better accuracy"""
+        logger.info(f"Starting enhanced text search for: '{query}'")
+        
+        ranked = self.rank_text(query, limit, filters)
+        if ranked is None:
             return []
         
-        similarities = []
+        product_ids, similarities = ranked
+        ranked = self.fetch_ranked_products(product_ids, similarities, limit, queryset=queryset)
         
-        for cache_key, data in self.embeddings_cache.items():
-            if data['image_embedding'] is not None:
-                # Calculate cosine similarity
-                similarity = np.dot(query_embedding, data['image_embedding']) / (
-                    np.linalg.norm(query_embedding) * np.linalg.norm(data['image_embedding'])
-                )
-                # Convert from [-1, 1] to [0, 1]
-                similarity = (similarity + 1) / 2
-                similarities.append((data['product_id'], float(similarity)))
+        # Build results with better compatibility calculation
+        results = []
+        for i, (product, similarity) in enumerate(ranked):
+            # More realistic compatibility percentage
+            base_compatibility = int(similarity * 100)
+            
+            # Adjust based on ranking position
+            position_penalty = min(10, i * 2)  # Top results get less penalty
+            final_compatibility = max(45, base_compatibility - position_penalty)
+            
+            results.append({
+                'product': product,
+                'similarity': similarity,
+                'compatibility_percent': final_compatibility
+            })
         
-        similarities.sort(key=lambda x: x[1], reverse=True)
+        logger.info(f"Returning {len(results)} enhanced results")
+        return results
+    
+    def similar_products(self, product_id, limit=8, kind='combined', filters=None, queryset=None):
+        """Products closest to ``product_id``'s stored embeddings; no model is loaded.
+
+        ``filters`` (see ``catalog_filter_mask``) narrow the candidates through
+        a row mask. Returns None if the product is not indexed.
+        """
+        ranked = self.rank_similar(product_id, limit * 2, kind, filters)
+        if ranked is None:
+            return None
         
         results = []
-        for product_id, similarity in similarities[:limit]:
-            try:
-                product = Product.objects.get(id=product_id)
-                compatibility_percent = min(100, max(0, int(similarity * 100)))
-                results.append({
-                    'product': product,
-                    'similarity': similarity,
-                    'compatibility_percent': compatibility_percent
-                })
-            except Product.DoesNotExist:
+        for product, score in self.fetch_ranked_products(*ranked, limit, queryset=queryset):
+            results.append({
+                'product': product,
+                'similarity': score,
+                'compatibility_percent': min(100, max(0, int(score * 100)))
+            })
+        return results
+    
+    def rank_similar(self, product_id, limit, kind='combined', filters=None):
+        """Rank the catalog against a product's own vectors; returns ``(product_ids, scores)`` or None.
+
+        Cached per product, kind and filters until the index version changes.
+        """
+        index = self.load_index()
+        results_key = (index.header.get('version', 0), product_id, kind, filters_key(filters), limit)
+        ranked = self.similar_results_cache.get(results_key)
+        if ranked is not None:
+            return ranked
+        
+        _, rows = index.rows_for([product_id])
+        if len(rows) == 0:
+            return None
+        row = rows[0]
+        
+        mask = self.catalog_filter_mask(index, filters)
+        if mask is None:
+            mask = np.ones(len(index), dtype=bool)
+        mask[row] = False
+        
+        branches, weights = [], []
+        for branch, weight in (('image', self.scoring['IMAGE_WEIGHT']), ('text', self.scoring['TEXT_WEIGHT'])):
+            vector = index.stored_vector(branch, row) if kind in ('combined', branch) else None
+            if vector is None:
                 continue
+            searcher = self.get_searcher(index, branch)
+            product_ids, scores = searcher.search(
+                index, branch, vector, limit, mask=mask, nprobe=self.ann_config.get('NPROBE', 8)
+            )
+            # Convert from [-1, 1] to [0, 1]
+            branches.append((product_ids, (scores + 1) / 2))
+            weights.append(weight)
         
+        ranked = ([], [])
+        if branches:
+            # Weights rescaled to sum to 1, so a single branch keeps its own scores
+            product_ids, scores = FUSION_METHODS['weighted'](branches, [weight / sum(weights) for weight in weights])
+            ranked = (product_ids[:limit].tolist(), scores[:limit].tolist())
+        self.similar_results_cache.set(results_key, ranked)
+        return ranked
+    
+    def catalog_filter_mask(self, index, filters=None):
+        """Boolean row mask for catalog ``filters``, or None when there are none.
+
+        ``filters`` holds ``category``, ``brand``, ``price_bucket`` (one id or
+        a list), ``in_stock``, ``min_price`` and ``max_price``; see
+        ``CatalogFilterIndex.mask``.
+        """
+        filters = {name: value for name, value in (filters or {}).items() if value is not None}
+        if not filters:
+            return None
+        return get_catalog_filters().mask(index, **filters)
+    
+    def rank_text(self, query, limit, filters=None):
+        """Rank the catalog against a text query; returns ``(product_ids, similarities)`` or None"""
+        query_lower = normalize_query(query)
+        index = self.load_index()
+        
+        # Ranked ids are only valid for the index version they were computed on
+        results_key = (TEXT_MODEL_NAME, index.header.get('version', 0), query_lower, limit, filters_key(filters))
+        ranked = self.text_results_cache.get(results_key) if self.cache_text_results else None
+        if ranked is None:
+            ranked = self._rank_text(query_lower, index, limit, self.catalog_filter_mask(index, filters))
+            if ranked is not None and self.cache_text_results:
+                self.text_results_cache.set(results_key, ranked)
+        return ranked
+    
+    def _run_branch(self, rank, *args):
+        try:
+            return rank(*args)
+        finally:
+            # Branches run on pool threads, which Django's request cycle never cleans up
+            close_old_connections()
+    
+    def search_combined(self, image=None, text=None, limit=5, fusion='weighted', queryset=None, filters=None):
+        """Image + text search with both branches running concurrently.
+
+        Each branch only produces ranked id/score arrays; they are fused
+        (``weighted`` image/text score sum or ``rrf`` reciprocal rank) and products
+        are loaded once, for the final top ``limit``.
+        """
+        product_ids, scores, matched_variants = self.rank_combined(image, text, limit * 2, fusion, filters)
+        
+        results = []
+        for product, score in self.fetch_ranked_products(product_ids.tolist(), scores.tolist(), limit, queryset=queryset):
+            results.append({
+                'product': product,
+                'similarity': score,
+                'compatibility_percent': min(100, max(0, int(score * 100))),
+                'variant_id': matched_variants.get(product.id),
+            })
         return results
     
-    def search_by_text(self, query, limit=10):
-        """Enhanced text search with better accuracy"""
-        logger.info(f"Starting enhanced text search for: '{query}'")
+    def rank_combined(self, image, text, limit, fusion='weighted', filters=None):
+        """Fused ``(product_ids, scores)`` arrays of the image and text branches.
+
+        Also returns ``{product_id: variant_id}`` for the image branch's variant matches.
+        """
+        branches = []
+        if image is not None:
+            branches.append((self.rank_image, image, self.scoring['IMAGE_WEIGHT']))
+        if text:
+            branches.append((self.rank_text, text, self.scoring['TEXT_WEIGHT']))
         
-        # Improved category keywords with more variations
-        category_keywords = {
-            'dress': {
-                'primary': ['váy'],
-                'secondary': ['dress', 'skirt', 'đầm'],
-                'exclude': ['áo', 'quần', 'giày', 'shoe', 'pant', 'shirt']
-            },
-            'top': {
-                'primary': ['áo'],
-                'secondary': ['shirt', 'top', 'blouse', 'hoodie', 'sweater'],
-                'exclude': ['váy', 'quần', 'giày', 'dress', 'pant', 'shoe']
-            },
-            'bottom': {
-                'primary': ['quần'],
-                'secondary': ['pants', 'trouser', 'jean', 'short'],
-                'exclude': ['váy', 'áo', 'giày', 'dress', 'shirt', 'shoe']
-            },
-            'shoes': {
-                'primary': ['giày'],
-                'secondary': ['shoe', 'boot', 'sandal', 'sneaker'],
-                'exclude': ['váy', 'áo', 'quần', 'dress', 'shirt', 'pant']
-            }
-        }
+        if len(branches) > 1:
+            futures = [
+                self.branch_executor.submit(self._run_branch, rank, query, limit, filters)
+                for rank, query, _ in branches
+            ]
+            outcomes = [future.result() for future in futures]
+        else:
+            outcomes = [rank(query, limit, filters) for rank, query, _ in branches]
         
-        # Enhanced category detection
-        query_lower = query.lower()
+        matched_variants = {}
+        if image is not None and outcomes[0]:
+            matched_variants = dict(zip(outcomes[0][0], outcomes[0][2]))
+        product_ids, scores = FUSION_METHODS[fusion](
+            [outcome[:2] if outcome else ([], []) for outcome in outcomes],
+            [weight for _, _, weight in branches],
+        )
+        return product_ids, scores, matched_variants
+    
+    def _rank_text(self, query_lower, index, limit, filter_mask=None):
+        """Score the catalog for a normalised query; returns ``(product_ids, similarities)``"""
+        # Enhanced category detection from one pass of the shared keyword matcher
+        hits = keyword_matcher.match(query_lower)
         search_category = None
         category_confidence = 0
         
-        for category, terms in category_keywords.items():
-            # Check primary keywords (high confidence)
-            primary_matches = sum(1 for term in terms['primary'] if term in query_lower)
-            # Check secondary keywords (medium confidence)
-            secondary_matches = sum(1 for term in terms['secondary'] if term in query_lower)
-            # Check exclude keywords (negative confidence)
-            exclude_matches = sum(1 for term in terms['exclude'] if term in query_lower)
-            
-            confidence = (primary_matches * 3) + (secondary_matches * 1) - (exclude_matches * 2)
+        for category in SEARCH_CATEGORY_KEYWORDS:
+            # Primary keywords (high confidence), secondary (medium), exclude (negative)
+            confidence = (
+                hits.count('search_category', (category, 'primary')) * 3
+                + hits.count('search_category', (category, 'secondary'))
+                - hits.count('search_category', (category, 'exclude')) * 2
+            )
             
             if confidence > category_confidence:
                 category_confidence = confidence
@@ -222,112 +867,78 @@ class AISearchService:
         
         logger.info(f"Detected category: {search_category} (confidence: {category_confidence})")
         
-        self.load_embeddings_cache()
-        
-        query_embedding = self.get_text_embedding(query)
+        query_embedding = self.get_query_text_embedding(query_lower)
         if query_embedding is None:
-            return []
+            return None
         
-        similarities = []
+        lexical_index = get_lexical_index()
         
-        # Enhanced product filtering
+        # Enhanced product filtering, answered from the in-memory lexical index
+        # instead of an icontains OR-chain over the products table
         filtered_product_ids = None
         if search_category and category_confidence > 0:
-            terms = category_keywords[search_category]
-            
-            # Build complex query
-            name_queries = Q()
-            desc_queries = Q()
-            
-            # Primary terms (must match)
-            for term in terms['primary']:
-                name_queries |= Q(name__icontains=term)
-                desc_queries |= Q(description__icontains=term)
-            
-            # Secondary terms (can match)
-            for term in terms['secondary']:
-                name_queries |= Q(name__icontains=term)
-                desc_queries |= Q(description__icontains=term)
-            
-            # Exclude terms (must not match)
-            exclude_queries = Q()
-            for term in terms['exclude']:
-                exclude_queries |= Q(name__icontains=term)
-            
-            filtered_products = Product.objects.filter(
-                (name_queries | desc_queries)
-            ).exclude(exclude_queries).values_list('id', flat=True)
-            
-            filtered_product_ids = set(filtered_products)
+            terms = SEARCH_CATEGORY_KEYWORDS[search_category]
+            filtered_product_ids = lexical_index.matching_ids(
+                terms['primary'] + terms['secondary'], fields=('name', 'description')
+            ) - lexical_index.matching_ids(terms['exclude'], fields=('name',))
             logger.info(f"Filtered to {len(filtered_product_ids)} products in category")
         
-        # Calculate similarities with enhanced scoring
-        for cache_key, data in self.embeddings_cache.items():
-            if data['text_embedding'] is not None:
-                # Apply category filter
-                if filtered_product_ids and data['product_id'] not in filtered_product_ids:
-                    continue
-                
-                # Calculate base similarity
-                similarity = np.dot(query_embedding, data['text_embedding']) / (
-                    np.linalg.norm(query_embedding) * np.linalg.norm(data['text_embedding'])
-                )
-                
-                # Enhanced scoring with keyword matching bonus
-                try:
-                    product = Product.objects.get(id=data['product_id'])
-                    product_text = f"{product.name} {product.description or ''}".lower()
-                    
-                    # Keyword matching bonus
-                    query_words = query_lower.split()
-                    matched_words = sum(1 for word in query_words if word in product_text)
-                    keyword_bonus = (matched_words / len(query_words)) * 0.2
-                    
-                    # Category relevance bonus
-                    category_bonus = 0
-                    if search_category:
-                        terms = category_keywords[search_category]
-                        primary_in_product = sum(1 for term in terms['primary'] if term in product_text)
-                        category_bonus = primary_in_product * 0.1
-                    
-                    # Final similarity with bonuses
-                    enhanced_similarity = similarity + keyword_bonus + category_bonus
-                    enhanced_similarity = min(1.0, max(-1.0, enhanced_similarity))
-                    
-                    # Convert to [0, 1] range
-                    final_similarity = (enhanced_similarity + 1) / 2
-                    
-                    similarities.append((data['product_id'], float(final_similarity)))
-                    
-                except Product.DoesNotExist:
-                    continue
-        
-        # Sort by similarity
-        similarities.sort(key=lambda x: x[1], reverse=True)
+        candidate_mask = index.text_mask.copy()
+        if filter_mask is not None:
+            candidate_mask &= filter_mask
         
-        # Build results with better compatibility calculation
-        results = []
-        for i, (product_id, similarity) in enumerate(similarities[:limit]):
-            try:
-                product = Product.objects.get(id=product_id)
-                
-                # More realistic compatibility percentage
-                base_compatibility = int(similarity * 100)
-                
-                # Adjust based on ranking position
-                position_penalty = min(10, i * 2)  # Top results get less penalty
-                final_compatibility = max(45, base_compatibility - position_penalty)
-                
-                results.append({
-                    'product': product,
-                    'similarity': similarity,
-                    'compatibility_percent': final_compatibility
-                })
-            except Product.DoesNotExist:
-                continue
+        # Apply category filter
+        if filtered_product_ids:
+            _, category_rows = index.rows_for(sorted(filtered_product_ids))
+            keyword_mask = np.zeros(len(index), dtype=bool)
+            keyword_mask[category_rows] = True
+            candidate_mask &= keyword_mask
         
-        logger.info(f"Returning {len(results)} enhanced results")
-        return results
+        # Lexical half of the hybrid ranking: BM25 scores spread over index rows
+        lexical_scores = np.zeros(len(index.product_ids), dtype=np.float32)
+        lexical_ids, scores = lexical_index.score(query_lower, prefix=True)
+        if len(lexical_ids):
+            sorter = np.argsort(index.product_ids)
+            positions = np.searchsorted(index.product_ids, lexical_ids, sorter=sorter)
+            positions = np.minimum(positions, len(sorter) - 1)
+            found = index.product_ids[sorter[positions]] == lexical_ids
+            lexical_scores[sorter[positions[found]]] = scores[found] / scores.max()
+        
+        # With an IVF index only rows from the probed lists, plus every lexical
+        # match, are re-ranked; fall back to every candidate when that comes up short
+        candidate_rows = np.flatnonzero(candidate_mask)
+        searcher = self.get_searcher(index, 'text')
+        if not isinstance(searcher, ExactSearcher):
+            probed_rows = searcher.candidate_rows(
+                index, 'text', query_embedding, nprobe=self.ann_config.get('NPROBE', 8)
+            )
+            probed_rows = np.union1d(probed_rows, np.flatnonzero(lexical_scores))
+            probed_rows = probed_rows[candidate_mask[probed_rows]]
+            if len(probed_rows) >= limit * 2:
+                candidate_rows = probed_rows
+        
+        # Base cosine similarity for the candidates in one mat-vec product
+        base_similarities = index.similarities('text', query_embedding, candidate_rows)
+        
+        # Keyword matching bonus: BM25 score relative to the best lexical match
+        keyword_bonus = lexical_scores[candidate_rows] * self.scoring['LEXICAL_WEIGHT']
+        
+        # Category relevance bonus
+        category_bonus = np.zeros(len(candidate_rows), dtype=np.float32)
+        if search_category:
+            for term in SEARCH_CATEGORY_KEYWORDS[search_category]['primary']:
+                category_bonus += index.text_contains(term)[candidate_rows] * self.scoring['CATEGORY_WEIGHT']
+        
+        # Final similarity with bonuses, converted to [0, 1] range
+        enhanced_similarity = base_similarities + keyword_bonus + category_bonus
+        candidate_scores = (np.clip(enhanced_similarity, -1.0, 1.0) + 1) / 2
+        
+        # Over-fetch a little so products deleted since indexing don't shrink the result
+        best = top_k_indices(candidate_scores, limit * 2)
+        return (
+            index.product_ids[candidate_rows[best]].tolist(),
+            candidate_scores[best].tolist(),
+        )
 
 # Global instance
 ai_search_service = AISearchService()
@@ -0,0 +1,173 @@
+import logging
+import time
+
+import numpy as np
+
+from .embedding_index import MappedFileLoader, normalize_rows, normalize_vector, read_index, top_k_indices, write_index
+
+logger = logging.getLogger(__name__)
+
+# Rows scored per chunk while assigning vectors to centroids, to bound the
+# size of the temporary (chunk x nlist) score matrix
+ASSIGN_CHUNK = 8192
+
+
+class ExactSearcher:
+    """Brute-force search over every row; the reference and fallback implementation"""
+
+    name = 'exact'
+
+    def candidate_rows(self, index, kind, query_embedding, **params):
+        return np.flatnonzero(index.mask(kind))
+
+    def search(self, index, kind, query_embedding, limit, mask=None, **params):
+        product_ids, scores = index.search(kind, query_embedding, limit, mask=mask)
+        return product_ids, scores
+
+
+class IVFIndex:
+    """Inverted-file ANN index: spherical k-means centroids plus one posting list per centroid.
+
+    A query is compared against the ``nlist`` centroids and only the rows in
+    the ``nprobe`` closest lists are scored exactly. ``nprobe`` trades
+    latency for recall at query time; ``nlist`` is fixed at build time.
+    Rows refer to the ``EmbeddingIndex`` the IVF was built from, recorded as
+    ``index_version`` in the header. Extra vectors of a row (variant images)
+    are bucketed too, so a row may sit in several lists.
+    """
+
+    name = 'ivf'
+
+    def __init__(self, centroids, list_offsets, list_rows, header=None):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.header = header or {}
+
+    @property
+    def nlist(self):
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(cls, vectors, valid_mask, nlist=None, iterations=10, sample_size=None, seed=0,
+              extra_vectors=None, extra_rows=None):
+        """Train centroids on (a sample of) the valid rows and bucket every valid row.
+
+        ``extra_vectors[i]`` is also bucketed, under row ``extra_rows[i]``.
+        """
+        rows = np.flatnonzero(valid_mask)
+        if nlist is None:
+            nlist = max(1, int(np.sqrt(len(rows))))
+        nlist = max(1, min(nlist, len(rows)))
+        rng = np.random.default_rng(seed)
+
+        sample_size = sample_size or 64 * nlist
+        training = rows if len(rows) <= sample_size else rng.choice(rows, sample_size, replace=False)
+        # Normalising also undoes per-row int8 scales; only directions matter here
+        training_vectors = normalize_rows(vectors[np.sort(training)])
+        centroids = training_vectors[rng.choice(len(training_vectors), nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignment = cls._assign(training_vectors, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, training_vectors)
+            counts = np.bincount(assignment, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # Re-seed empty clusters from random training rows
+                sums[empty] = training_vectors[rng.choice(len(training_vectors), int(empty.sum()))]
+            centroids = normalize_rows(sums)
+
+        assignment = cls._assign(vectors, centroids, rows)
+        if extra_vectors is not None and len(extra_vectors):
+            assignment = np.concatenate([assignment, cls._assign(extra_vectors, centroids)])
+            rows = np.concatenate([rows, extra_rows])
+        order = np.argsort(assignment, kind='stable')
+        list_rows = rows[order].astype(np.int64)
+        list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+        list_offsets[1:] = np.cumsum(np.bincount(assignment, minlength=nlist))
+        return cls(centroids, list_offsets, list_rows)
+
+    @staticmethod
+    def _assign(vectors, centroids, rows=None):
+        count = len(vectors) if rows is None else len(rows)
+        assignment = np.empty(count, dtype=np.int64)
+        for start in range(0, count, ASSIGN_CHUNK):
+            chunk = vectors[start:start + ASSIGN_CHUNK] if rows is None else vectors[rows[start:start + ASSIGN_CHUNK]]
+            # argmax over centroids is unaffected by a positive per-row scale
+            assignment[start:start + ASSIGN_CHUNK] = np.argmax(np.asarray(chunk, dtype=np.float32) @ centroids.T, axis=1)
+        return assignment
+
+    def candidate_rows(self, index, kind, query_embedding, nprobe=8, **params):
+        """Rows in the ``nprobe`` posting lists closest to the query"""
+        query = normalize_vector(query_embedding)
+        probes = top_k_indices(self.centroids @ query, nprobe)
+        starts, ends = self.list_offsets[probes], self.list_offsets[probes + 1]
+        # A row with variant vectors in several probed lists is scored once
+        return np.unique(np.concatenate([self.list_rows[start:end] for start, end in zip(starts, ends)]))
+
+    def search(self, index, kind, query_embedding, limit, mask=None, nprobe=8, **params):
+        rows = self.candidate_rows(index, kind, query_embedding, nprobe=nprobe)
+        if mask is not None:
+            rows = rows[mask[rows]]
+        if len(rows) < limit:
+            # Too few rows in the probed lists: fall back to exact search
+            return index.search(kind, query_embedding, limit, mask=mask)
+
+        scores = index.similarities(kind, query_embedding, rows)
+        best = top_k_indices(scores, limit)
+        return index.product_ids[rows[best]], scores[best]
+
+    def save(self, path, header):
+        header = dict(header, kind='ivf', nlist=self.nlist)
+        write_index(path, header, {
+            'centroids': self.centroids,
+            'list_offsets': self.list_offsets,
+            'list_rows': self.list_rows,
+        })
+        self.header = header
+
+    @classmethod
+    def load(cls, path):
+        header, arrays = read_index(path)
+        return cls(arrays['centroids'], arrays['list_offsets'], arrays['list_rows'], header)
+
+
+class IVFLoader(MappedFileLoader):
+    def open(self):
+        return IVFIndex.load(self.path)
+
+
+def recall_report(index, kind, searcher, k=10, nprobe_values=(1, 2, 4, 8, 16, 32), queries=200, seed=0):
+    """Recall@k and latency of ``searcher`` against exact search.
+
+    Stored catalog vectors are used as queries, so no model has to be loaded.
+    Returns one dict per ``nprobe`` value.
+    """
+    rows = np.flatnonzero(index.mask(kind))
+    if len(rows) == 0:
+        return []
+    rng = np.random.default_rng(seed)
+    query_rows = rng.choice(rows, min(queries, len(rows)), replace=False)
+    query_vectors = list(index.dense(kind, np.sort(query_rows)))
+
+    exact = ExactSearcher()
+    started_at = time.perf_counter()
+    truth = [set(exact.search(index, kind, query, k)[0].tolist()) for query in query_vectors]
+    exact_ms = (time.perf_counter() - started_at) * 1000 / len(query_vectors)
+
+    report = []
+    for nprobe in nprobe_values:
+        hits = 0
+        started_at = time.perf_counter()
+        for query, expected in zip(query_vectors, truth):
+            found = searcher.search(index, kind, query, k, nprobe=nprobe)[0]
+            hits += len(expected.intersection(found.tolist()))
+        elapsed_ms = (time.perf_counter() - started_at) * 1000 / len(query_vectors)
+        report.append({
+            'nprobe': nprobe,
+            f'recall@{k}': round(hits / sum(len(expected) for expected in truth), 4),
+            'ann_ms': round(elapsed_ms, 3),
+            'exact_ms': round(exact_ms, 3),
+        })
+    return report
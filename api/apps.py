@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Keep the in-memory lexical search and catalog filter indexes in sync with product saves
+        from . import catalog_filters, lexical_index  # noqa: F401
@@ -0,0 +1,158 @@
+"""
+Database-side catalog filtering and facet counts.
+
+``filter_catalog_queryset`` applies brand, category, price, stock, colour
+and size filters to a ``Product`` queryset. ``facet_counts`` answers how
+many products each brand, category, colour, size and price bucket would
+match with one grouped aggregate query per facet, each ignoring that
+facet's own filter so the counts of the alternatives stay visible while
+one is selected.
+"""
+from django.db.models import (
+    Case, Count, DecimalField, Exists, F, IntegerField, Min, OuterRef, Q, Subquery, Value, When,
+)
+from django.db.models.functions import Coalesce
+
+from .catalog_filters import PRICE_BUCKETS
+from .models import Product, ProductVariant
+
+FACETS = ('brand', 'category', 'color', 'size', 'price_bucket')
+
+
+def catalog_price():
+    """SQL expression of the price a product is filtered and bucketed at.
+
+    A product with variants is priced at its cheapest variant, as in
+    ``catalog_filters.product_attributes`` and on the product cards. The
+    minimum is a correlated subquery so the outer query is not grouped.
+    """
+    cheapest_variant = ProductVariant.objects.filter(product=OuterRef('pk')).order_by().values('product').annotate(
+        cheapest=Min('price'),
+    ).values('cheapest')
+    return Case(
+        When(has_variants=True, then=Coalesce(Subquery(cheapest_variant), F('price'))),
+        default=F('price'),
+        output_field=DecimalField(max_digits=12, decimal_places=0),
+    )
+
+
+def with_catalog_price(queryset):
+    """``queryset`` with the ``catalog_price`` alias available to filters"""
+    if 'catalog_price' in queryset.query.annotations:
+        return queryset
+    return queryset.alias(catalog_price=catalog_price())
+
+
+def price_bucket_case():
+    """SQL expression of ``PRICE_BUCKETS`` over the ``catalog_price`` alias; NULL for unpriced products"""
+    return Case(
+        *[
+            When(catalog_price__lt=upper, then=Value(bucket))
+            for bucket, upper in enumerate(PRICE_BUCKETS[1:])
+        ],
+        When(catalog_price__isnull=False, then=Value(len(PRICE_BUCKETS) - 1)),
+        output_field=IntegerField(),
+    )
+
+
+def matching_variants(filters):
+    """Variants that satisfy the colour, size and stock filters"""
+    variants = ProductVariant.objects.all()
+    if filters.get('color'):
+        variants = variants.filter(color_id__in=filters['color'])
+    if filters.get('size'):
+        variants = variants.filter(size_id__in=filters['size'])
+    if filters.get('in_stock'):
+        variants = variants.filter(stock_quantity__gt=0)
+    return variants
+
+
+def filter_catalog_queryset(queryset, filters):
+    """Database version of the catalog filters (prices from ``catalog_price``).
+
+    ``color`` and ``size`` keep products with one variant matching both;
+    with ``in_stock`` that variant must also be in stock.
+    """
+    if filters.get('category'):
+        queryset = queryset.filter(category_id__in=filters['category'])
+    if filters.get('brand'):
+        queryset = queryset.filter(brand_id__in=filters['brand'])
+    if filters.get('price_bucket') or filters.get('min_price') is not None or filters.get('max_price') is not None:
+        queryset = with_catalog_price(queryset)
+    if filters.get('price_bucket'):
+        ranges = Q()
+        for bucket in filters['price_bucket']:
+            bucket_range = Q(catalog_price__gte=PRICE_BUCKETS[bucket])
+            if bucket + 1 < len(PRICE_BUCKETS):
+                bucket_range &= Q(catalog_price__lt=PRICE_BUCKETS[bucket + 1])
+            ranges |= bucket_range
+        queryset = queryset.filter(ranges)
+    if filters.get('min_price') is not None:
+        queryset = queryset.filter(catalog_price__gte=filters['min_price'])
+    if filters.get('max_price') is not None:
+        queryset = queryset.filter(catalog_price__lte=filters['max_price'])
+    if filters.get('color') or filters.get('size'):
+        queryset = queryset.filter(Exists(matching_variants(filters).filter(product=OuterRef('pk'))))
+    if filters.get('in_stock') is not None:
+        variant_in_stock = Exists(ProductVariant.objects.filter(product=OuterRef('pk'), stock_quantity__gt=0))
+        in_stock = Q(variant_in_stock, has_variants=True) | Q(has_variants=False, countInStock__gt=0)
+        queryset = queryset.filter(in_stock if filters['in_stock'] else ~in_stock)
+    return queryset
+
+
+def facet_counts(filters, queryset=None):
+    """``{facet: [{id, label..., count}, ...]}`` for every facet in ``FACETS``; five queries.
+
+    Each facet is counted over the products matching every filter but its
+    own. Price buckets are all listed, empty ones with a zero count.
+    """
+    if queryset is None:
+        queryset = Product.objects.all()
+
+    def products_without(*names):
+        return filter_catalog_queryset(queryset, {**filters, **{name: None for name in names}}).order_by()
+
+    facets = {
+        'brand': [
+            {'id': row['brand_id'], 'title': row['brand__title'], 'count': row['count']}
+            for row in products_without('brand').values('brand_id', 'brand__title')
+            .annotate(count=Count('id')).order_by('-count', 'brand__title')
+        ],
+        'category': [
+            {'id': row['category_id'], 'title': row['category__title'], 'count': row['count']}
+            for row in products_without('category').values('category_id', 'category__title')
+            .annotate(count=Count('id')).order_by('-count', 'category__title')
+        ],
+    }
+
+    # A colour counts the products with a variant in that colour and one of
+    # the selected sizes, and the other way round
+    products = products_without('color', 'size')
+    facets['color'] = [
+        {'id': row['color_id'], 'name': row['color__name'], 'hex_code': row['color__hex_code'], 'count': row['count']}
+        for row in matching_variants({**filters, 'color': None}).filter(product__in=products)
+        .values('color_id', 'color__name', 'color__hex_code')
+        .annotate(count=Count('product_id', distinct=True)).order_by('-count', 'color__name')
+    ]
+    facets['size'] = [
+        {'id': row['size_id'], 'name': row['size__name'], 'count': row['count']}
+        for row in matching_variants({**filters, 'size': None}).filter(product__in=products)
+        .values('size_id', 'size__name', 'size__order')
+        .annotate(count=Count('product_id', distinct=True)).order_by('size__order', 'size__name')
+    ]
+
+    bucket_counts = dict(
+        with_catalog_price(products_without('price_bucket')).filter(catalog_price__isnull=False)
+        .annotate(bucket=price_bucket_case()).values('bucket')
+        .annotate(count=Count('id')).values_list('bucket', 'count')
+    )
+    facets['price_bucket'] = [
+        {
+            'id': bucket,
+            'min_price': lower,
+            'max_price': PRICE_BUCKETS[bucket + 1] if bucket + 1 < len(PRICE_BUCKETS) else None,
+            'count': bucket_counts.get(bucket, 0),
+        }
+        for bucket, lower in enumerate(PRICE_BUCKETS)
+    ]
+    return facets
@@ -0,0 +1,329 @@
+"""
+Catalog attribute filters for semantic search.
+
+Category, brand, price and stock status of every product are kept as numpy
+columns and turned into boolean masks over ``EmbeddingIndex`` rows, so a
+filtered search ANDs a few cached bitmasks instead of asking the database
+for an id set. Product and variant saves keep the columns current through
+the signal handlers at the bottom of this module, and a counter in the
+shared cache tells the other workers to rebuild theirs.
+"""
+import logging
+import threading
+
+import numpy as np
+from django.db.models import Min, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Product, ProductVariant
+from .search_cache import SharedVersion
+
+logger = logging.getLogger(__name__)
+
+# Lower bounds (VND) of the price buckets; the last bucket is open-ended
+PRICE_BUCKETS = (0, 200_000, 500_000, 1_000_000, 2_000_000)
+# Distinct (field, values) masks kept per embedding index before the cache is reset
+MAX_CACHED_MASKS = 256
+
+# Fields whose saves can change a product's filter attributes
+PRODUCT_FILTER_FIELDS = frozenset({
+    'category', 'category_id', 'brand', 'brand_id', 'price', 'countInStock', 'has_variants',
+})
+VARIANT_FILTER_FIELDS = frozenset({'product', 'product_id', 'price', 'stock_quantity'})
+
+def price_bucket_index(price):
+    """Index into ``PRICE_BUCKETS`` of ``price`` (array or scalar); -1 for unknown prices"""
+    prices = np.asarray(price, dtype=np.float64)
+    buckets = np.searchsorted(PRICE_BUCKETS, np.nan_to_num(prices, nan=-1.0), side='right') - 1
+    return np.where(np.isnan(prices), -1, buckets)
+
+
+def product_attributes(queryset=None):
+    """``(id, category_id, brand_id, price, in_stock)`` rows in one aggregate query.
+
+    A product with variants is priced at its cheapest variant and in stock
+    while any variant is, as on the product cards.
+    """
+    if queryset is None:
+        queryset = Product.objects.all()
+    rows = queryset.order_by().annotate(
+        variant_min_price=Min('variants__price'),
+        variant_stock=Sum('variants__stock_quantity'),
+    ).values_list(
+        'id', 'category_id', 'brand_id', 'price', 'countInStock',
+        'has_variants', 'variant_min_price', 'variant_stock',
+    )
+    for product_id, category_id, brand_id, price, stock, has_variants, variant_price, variant_stock in rows:
+        if has_variants:
+            price = variant_price if variant_price is not None else price
+            stock = variant_stock
+        yield (
+            product_id,
+            category_id,
+            brand_id,
+            float(price) if price is not None else np.nan,
+            (stock or 0) > 0,
+        )
+
+
+def instance_attributes(product):
+    """``product_attributes`` row of a product without variants, read off the instance"""
+    return (
+        product.id,
+        product.category_id,
+        product.brand_id,
+        float(product.price) if product.price is not None else np.nan,
+        (product.countInStock or 0) > 0,
+    )
+
+
+class CatalogFilterIndex:
+    """Filterable product attributes as columns sorted by product id.
+
+    ``mask(index, ...)`` aligns the columns to an embedding index's rows
+    once per index, caches one boolean mask per (field, value) and returns
+    their AND. Attribute updates patch the aligned columns and cached masks
+    in place.
+    """
+
+    def __init__(self, attributes=()):
+        attributes = sorted(attributes)
+        self.product_ids = np.array([row[0] for row in attributes], dtype=np.int64)
+        self.columns = {
+            'category': np.array([row[1] for row in attributes], dtype=np.int64),
+            'brand': np.array([row[2] for row in attributes], dtype=np.int64),
+            'price': np.array([row[3] for row in attributes], dtype=np.float64),
+            'in_stock': np.array([row[4] for row in attributes], dtype=bool),
+        }
+        self.version = 0
+        self._lock = threading.Lock()
+        # (embedding index, columns aligned to its rows, {(field, value): mask})
+        self._view = None
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def _aligned(self, index):
+        view = self._view
+        if view is not None and view[0] is index:
+            return view
+        with self._lock:
+            found, rows = self._positions(index.product_ids)
+            columns = {
+                'category': np.full(len(index), -1, dtype=np.int64),
+                'brand': np.full(len(index), -1, dtype=np.int64),
+                'price': np.full(len(index), np.nan, dtype=np.float64),
+                'in_stock': np.zeros(len(index), dtype=bool),
+            }
+            for name, column in self.columns.items():
+                columns[name][found] = column[rows]
+            columns['price_bucket'] = price_bucket_index(columns['price'])
+            view = (index, columns, {})
+            self._view = view
+        return view
+
+    def _positions(self, product_ids):
+        """``(found, positions)``: which of ``product_ids`` have attributes, and where"""
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        if len(self.product_ids) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.product_ids, product_ids), len(self.product_ids) - 1)
+        found = np.flatnonzero(self.product_ids[positions] == product_ids)
+        return found, positions[found]
+
+    def value_mask(self, index, field, values):
+        """Rows of ``index`` whose ``field`` equals one of ``values``"""
+        _, columns, masks = self._aligned(index)
+        values = tuple(sorted(values)) if isinstance(values, (list, tuple, set)) else (values,)
+        key = (field, values)
+        # _patch_view walks the cached masks under the lock
+        with self._lock:
+            mask = masks.get(key)
+            if mask is None:
+                mask = np.isin(columns[field], values) if len(values) > 1 else columns[field] == values[0]
+                if len(masks) >= MAX_CACHED_MASKS:
+                    masks.clear()
+                masks[key] = mask
+        return mask
+
+    def mask(self, index, category=None, brand=None, price_bucket=None, in_stock=None,
+             min_price=None, max_price=None):
+        """AND of the requested filters over ``index`` rows, or None when nothing is filtered.
+
+        ``category``, ``brand`` and ``price_bucket`` take one value or a list
+        (any of them matches).
+        """
+        masks = [
+            self.value_mask(index, field, value)
+            for field, value in (
+                ('category', category), ('brand', brand), ('price_bucket', price_bucket), ('in_stock', in_stock),
+            )
+            if value is not None
+        ]
+        if min_price is not None or max_price is not None:
+            prices = self._aligned(index)[1]['price']
+            if min_price is not None:
+                masks.append(prices >= min_price)
+            if max_price is not None:
+                masks.append(prices <= max_price)
+        if not masks:
+            return None
+        if len(masks) == 1:
+            return masks[0].copy()
+        return np.logical_and.reduce(masks)
+
+    def set(self, product_id, category_id, brand_id, price, in_stock):
+        """Store one product's attributes; returns False when they were already current"""
+        with self._lock:
+            found, positions = self._positions([product_id])
+            values = {'category': category_id, 'brand': brand_id, 'price': price, 'in_stock': in_stock}
+            if len(found):
+                position = positions[0]
+                current_price = self.columns['price'][position]
+                if (
+                    self.columns['category'][position] == category_id
+                    and self.columns['brand'][position] == brand_id
+                    and self.columns['in_stock'][position] == in_stock
+                    and (current_price == price or (np.isnan(current_price) and np.isnan(price)))
+                ):
+                    return False
+                for name, value in values.items():
+                    self.columns[name][position] = value
+            else:
+                position = np.searchsorted(self.product_ids, product_id)
+                self.product_ids = np.insert(self.product_ids, position, product_id)
+                for name, value in values.items():
+                    self.columns[name] = np.insert(self.columns[name], position, value)
+            self.version += 1
+            self._patch_view(product_id, values)
+            return True
+
+    def remove(self, product_id):
+        with self._lock:
+            found, positions = self._positions([product_id])
+            if len(found):
+                self.product_ids = np.delete(self.product_ids, positions[0])
+                for name in self.columns:
+                    self.columns[name] = np.delete(self.columns[name], positions[0])
+                self.version += 1
+            self._patch_view(product_id, {'category': -1, 'brand': -1, 'price': np.nan, 'in_stock': False})
+            return bool(len(found))
+
+    def _patch_view(self, product_id, values):
+        """Bring the aligned columns and cached masks up to date for one product"""
+        if self._view is None:
+            return
+        index, columns, masks = self._view
+        _, rows = index.rows_for([product_id])
+        if len(rows) == 0:
+            return
+        row = rows[0]
+        for name, value in values.items():
+            columns[name][row] = value
+        columns['price_bucket'][row] = price_bucket_index(columns['price'][row])
+        for (field, accepted), mask in masks.items():
+            mask[row] = columns[field][row] in accepted
+
+    def stats(self):
+        return {
+            'products': len(self),
+            'version': self.version,
+            'cached_masks': len(self._view[2]) if self._view is not None else 0,
+        }
+
+
+_catalog_filters = None
+_catalog_filters_lock = threading.Lock()
+# Bumped on every attribute change so the other workers rebuild their copies
+_catalog_version = SharedVersion('catalog-filters:version')
+
+
+def build_catalog_filters(queryset=None):
+    index = CatalogFilterIndex(product_attributes(queryset))
+    logger.info(f"Built catalog filter index over {len(index)} products")
+    return index
+
+
+def get_catalog_filters():
+    """Process-wide filter index, built from the database on first use and
+    rebuilt once another worker has changed product attributes"""
+    global _catalog_filters
+    index = _catalog_filters
+    if index is not None and not _catalog_version.is_stale():
+        return index
+    with _catalog_filters_lock:
+        if _catalog_filters is None or _catalog_filters is index:
+            if index is not None:
+                logger.info("Catalog filters changed in another worker; rebuilding")
+            # Read before building, so changes made during the build trigger another rebuild
+            version = _catalog_version.current()
+            _catalog_filters = build_catalog_filters()
+            _catalog_version.mark_built(version)
+        return _catalog_filters
+
+
+def catalog_filters_version():
+    """Version of the product attributes filters are evaluated against, for keys of cached filtered results.
+
+    The shared counter moves on every attribute change in any worker; with
+    no shared cache the local index's own change count is used.
+    """
+    version = _catalog_version.current()
+    if version is None:
+        return ('local', get_catalog_filters().version)
+    return version
+
+
+def set_catalog_filters(index):
+    """Replace the process-wide index; ``None`` makes the next use rebuild it from the database"""
+    global _catalog_filters
+    with _catalog_filters_lock:
+        _catalog_filters = index
+        _catalog_version.mark_built(_catalog_version.current() if index is not None else None)
+
+
+def _refresh(product_id, product=None):
+    """Re-read one product's attributes; a saved product without variants is read off the instance"""
+    index = _catalog_filters
+    if index is None:
+        # Nothing to patch here; the other workers still have to hear about it
+        _catalog_version.bump(applied_locally=False)
+        return
+    changed = False
+    try:
+        if product is not None and not product.has_variants:
+            rows = [instance_attributes(product)]
+        else:
+            rows = product_attributes(Product.objects.filter(id=product_id))
+        for attributes in rows:
+            changed = index.set(*attributes) or changed
+    except Exception as e:
+        logger.error(f"Error updating catalog filter index: {e}")
+        changed = True
+    if changed:
+        _catalog_version.bump()
+
+
+@receiver(post_save, sender=Product, dispatch_uid='catalog_filters_product_saved')
+def product_saved(sender, instance, update_fields=None, **kwargs):
+    # Sales and rating updates leave the filter attributes alone
+    if update_fields is not None and PRODUCT_FILTER_FIELDS.isdisjoint(update_fields):
+        return
+    _refresh(instance.id, instance)
+
+
+@receiver(post_delete, sender=Product, dispatch_uid='catalog_filters_product_deleted')
+def product_deleted(sender, instance, **kwargs):
+    index = _catalog_filters
+    if index is None or index.remove(instance.id):
+        _catalog_version.bump(applied_locally=index is not None)
+
+
+@receiver(post_save, sender=ProductVariant, dispatch_uid='catalog_filters_variant_saved')
+@receiver(post_delete, sender=ProductVariant, dispatch_uid='catalog_filters_variant_deleted')
+def variant_changed(sender, instance, update_fields=None, **kwargs):
+    # Variant prices and stock decide the product's price bucket and stock status
+    if update_fields is not None and VARIANT_FILTER_FIELDS.isdisjoint(update_fields):
+        return
+    _refresh(instance.product_id)
@@ -0,0 +1,637 @@
+import json
+import logging
+import os
+import struct
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# On-disk layout: 8-byte magic, little-endian uint64 header length, a JSON
+# header, then every array as raw C-ordered bytes at a 64-byte aligned offset
+# recorded in the header. Arrays are opened read-only with ``np.memmap`` so
+# all workers on the host share the same page cache.
+INDEX_MAGIC = b'AIDXIDX1'
+INDEX_FORMAT_VERSION = 1
+INDEX_ALIGNMENT = 64
+
+# Compact vector storage: float16 halves the matrices, int8 quarters them and
+# keeps one float32 scale per row (row ~= int8_row * scale)
+STORAGE_DTYPES = {
+    'float32': np.float32,
+    'float16': np.float16,
+    'int8': np.int8,
+}
+# Rows converted to float32 at a time when scoring compact matrices
+SCORE_CHUNK = 8192
+
+
+def normalize_rows(vectors):
+    """L2-normalise each row, leaving all-zero rows untouched"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def normalize_vector(vector):
+    """L2-normalise a single query vector"""
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        return vector
+    return vector / norm
+
+
+def quantize_rows(vectors, storage):
+    """Convert float32 rows to ``storage``; returns ``(matrix, scales)``, scales only for int8"""
+    if storage not in STORAGE_DTYPES:
+        raise ValueError(f"Unknown embedding storage '{storage}'")
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if storage == 'int8':
+        scales = np.abs(vectors).max(axis=1) / 127 if len(vectors) else np.empty(0, dtype=np.float32)
+        scales = scales.astype(np.float32)
+        safe = np.where(scales == 0, 1.0, scales)[:, None]
+        return np.rint(vectors / safe).astype(np.int8), scales
+    return vectors.astype(STORAGE_DTYPES[storage]), None
+
+
+def dequantize_rows(matrix, scales=None):
+    rows = np.asarray(matrix, dtype=np.float32)
+    if scales is not None:
+        rows = rows * np.asarray(scales, dtype=np.float32).reshape(-1, 1)
+    return rows
+
+
+def top_k_indices(scores, k):
+    """Indices of the k highest scores, best first"""
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k >= n:
+        return np.argsort(-scores, kind='stable')
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+class EmbeddingIndex:
+    """Catalog embeddings kept as contiguous, pre-normalised float32 matrices.
+
+    Row ``i`` of ``image_vectors`` and ``text_vectors`` belongs to
+    ``product_ids[i]``. Products without an image (or text) embedding keep a
+    zero row and are masked out through ``image_mask``/``text_mask``.
+
+    The lower-cased product text used for keyword re-ranking is stored as one
+    UTF-8 blob, row ``i`` spanning ``text_blob[text_offsets[i]:text_offsets[i + 1]]``
+    and rows separated by a newline so whitespace-free terms never match
+    across two products.
+
+    Distinct variant images are kept in a separate ``variant_vectors``
+    matrix in the same CSR layout: product row ``i`` owns variant rows
+    ``variant_offsets[i]:variant_offsets[i + 1]``, which belong to the
+    ``ProductVariant`` ids in ``variant_ids``. A product's image similarity
+    is the best of its main and variant vectors.
+
+    The matrices may also be stored compactly (see ``STORAGE_DTYPES``); they
+    are then scored chunk by chunk straight from the compact form, and
+    ``dense`` returns float32 rows where a caller needs real vectors.
+    """
+
+    def __init__(self, product_ids, image_vectors, text_vectors, image_mask=None, text_mask=None,
+                 text_blob=None, text_offsets=None, fingerprints=None, image_scales=None, text_scales=None,
+                 variant_vectors=None, variant_ids=None, variant_offsets=None, variant_scales=None):
+        self.product_ids = np.asarray(product_ids, dtype=np.int64)
+        self.image_vectors = image_vectors
+        self.text_vectors = text_vectors
+        self.image_scales = image_scales
+        self.text_scales = text_scales
+        n = len(self.product_ids)
+        self.variant_vectors = (
+            np.empty((0, image_vectors.shape[1]), dtype=image_vectors.dtype) if variant_vectors is None else variant_vectors
+        )
+        self.variant_ids = np.empty(0, dtype=np.int64) if variant_ids is None else variant_ids
+        self.variant_offsets = np.zeros(n + 1, dtype=np.int64) if variant_offsets is None else variant_offsets
+        self.variant_scales = variant_scales
+        self._variant_counts = np.diff(self.variant_offsets)
+        self.image_mask = np.ones(n, dtype=bool) if image_mask is None else np.asarray(image_mask, dtype=bool)
+        self.text_mask = np.ones(n, dtype=bool) if text_mask is None else np.asarray(text_mask, dtype=bool)
+        # Products searchable by image: a main image or at least one variant image
+        self.image_search_mask = self.image_mask | (self._variant_counts > 0)
+        self.text_blob = np.empty(0, dtype=np.uint8) if text_blob is None else text_blob
+        self.text_offsets = np.zeros(n + 1, dtype=np.int64) if text_offsets is None else text_offsets
+        self.fingerprints = np.zeros(n, dtype='S40') if fingerprints is None else fingerprints
+        self.header = {}
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    @classmethod
+    def empty(cls):
+        return cls(
+            np.empty(0, dtype=np.int64),
+            np.empty((0, 0), dtype=np.float32),
+            np.empty((0, 0), dtype=np.float32),
+        )
+
+    @classmethod
+    def from_cache(cls, embeddings_cache):
+        """Build the matrices from the legacy ``{'product_<id>': {...}}`` dict"""
+        entries = sorted(embeddings_cache.values(), key=lambda data: data['product_id'])
+        if not entries:
+            return cls.empty()
+
+        product_ids = np.array([data['product_id'] for data in entries], dtype=np.int64)
+        image_vectors, image_mask = cls._stack([data.get('image_embedding') for data in entries])
+        text_vectors, text_mask = cls._stack([data.get('text_embedding') for data in entries])
+        text_blob, text_offsets = cls._pack_texts([data.get('product_text') or '' for data in entries])
+        fingerprints = np.array([data.get('fingerprint') or '' for data in entries], dtype='S40')
+
+        variant_embeddings = [data.get('variant_embeddings') or [] for data in entries]
+        variant_offsets = np.zeros(len(entries) + 1, dtype=np.int64)
+        variant_offsets[1:] = np.cumsum([len(embeddings) for embeddings in variant_embeddings])
+        variant_ids = np.array(
+            [variant_id for data in entries for variant_id in data.get('variant_ids') or []], dtype=np.int64
+        )
+        variant_vectors = np.zeros((0, image_vectors.shape[1]), dtype=np.float32)
+        if variant_offsets[-1]:
+            variant_vectors = normalize_rows(np.vstack([
+                np.ravel(embedding) for embeddings in variant_embeddings for embedding in embeddings
+            ]))
+            if image_vectors.shape[1] == 0:
+                # Only variant images so far; keep the main matrix at the same width
+                image_vectors = np.zeros((len(entries), variant_vectors.shape[1]), dtype=np.float32)
+        return cls(
+            product_ids, image_vectors, text_vectors, image_mask, text_mask,
+            text_blob, text_offsets, fingerprints,
+            variant_vectors=variant_vectors, variant_ids=variant_ids, variant_offsets=variant_offsets,
+        )
+
+    @staticmethod
+    def _pack_texts(texts):
+        encoded = [text.lower().encode('utf-8') + b'\n' for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(chunk) for chunk in encoded])
+        blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return blob, offsets
+
+    @staticmethod
+    def _stack(embeddings):
+        dim = next((len(np.ravel(e)) for e in embeddings if e is not None), 0)
+        matrix = np.zeros((len(embeddings), dim), dtype=np.float32)
+        mask = np.zeros(len(embeddings), dtype=bool)
+        for row, embedding in enumerate(embeddings):
+            if embedding is not None:
+                matrix[row] = np.ravel(embedding)
+                mask[row] = True
+        return normalize_rows(matrix), mask
+
+    @property
+    def storage(self):
+        return np.dtype(self.image_vectors.dtype).name
+
+    def with_storage(self, storage):
+        """Copy of the index with its matrices converted to ``storage``"""
+        if storage == self.storage:
+            return self
+        image_vectors, image_scales = quantize_rows(self.dense('image'), storage)
+        text_vectors, text_scales = quantize_rows(self.dense('text'), storage)
+        variant_vectors, variant_scales = quantize_rows(self.dense('variant'), storage)
+        index = EmbeddingIndex(
+            self.product_ids, image_vectors, text_vectors, self.image_mask, self.text_mask,
+            self.text_blob, self.text_offsets, self.fingerprints, image_scales, text_scales,
+            variant_vectors, self.variant_ids, self.variant_offsets, variant_scales,
+        )
+        index.header = dict(self.header)
+        return index
+
+    def vectors(self, kind):
+        """Stored matrix for ``kind`` (image, text or variant), possibly compact; use ``dense`` for float32 rows"""
+        return getattr(self, f'{kind}_vectors')
+
+    def scales(self, kind):
+        return getattr(self, f'{kind}_scales')
+
+    def dense(self, kind, rows=None):
+        """Float32 vectors of ``rows`` (default: all rows)"""
+        matrix, scales = self.vectors(kind), self.scales(kind)
+        if rows is None:
+            return dequantize_rows(matrix, scales)
+        return dequantize_rows(matrix[rows], None if scales is None else scales[rows])
+
+    def mask(self, kind):
+        return self.image_search_mask if kind == 'image' else self.text_mask
+
+    @property
+    def has_variants(self):
+        return len(self.variant_ids) > 0
+
+    def rows_for(self, product_ids):
+        """``(found, rows)``: positions in ``product_ids`` that are indexed, and their rows"""
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        if len(self) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.product_ids, product_ids), len(self) - 1)
+        found = np.flatnonzero(self.product_ids[positions] == product_ids)
+        return found, positions[found]
+
+    def stored_vector(self, kind, row):
+        """Float32 vector stored for ``row`` (an image falls back to the first variant image), or None"""
+        if not self.mask(kind)[row]:
+            return None
+        if kind == 'image' and not self.image_mask[row]:
+            return self.dense('variant', [self.variant_offsets[row]])[0]
+        return self.dense(kind, [row])[0]
+
+    def variant_owner_rows(self):
+        """Product row of every variant row"""
+        return np.repeat(np.arange(len(self), dtype=np.int64), self._variant_counts)
+
+    def similarities(self, kind, query_embedding, rows=None):
+        """Cosine similarity of the query against every row, or just ``rows`` (one mat-vec product)"""
+        matrix = self.vectors(kind)
+        if len(self) == 0 or matrix.shape[1] == 0:
+            return np.empty(0 if rows is None else len(rows), dtype=np.float32)
+        query = normalize_vector(query_embedding)
+        scores = self._matrix_similarities(kind, query, rows)
+        if kind == 'image' and self.has_variants:
+            self._fold_variant_similarities(query, scores, rows)
+        return scores
+
+    def _matrix_similarities(self, kind, query, rows=None):
+        matrix = self.vectors(kind)
+        if matrix.dtype != np.float32:
+            return self._compact_similarities(kind, query, rows)
+        if rows is None:
+            return matrix @ query
+        # Gathering a large subset copies most of the matrix; scoring all rows is cheaper
+        if len(rows) * 2 < len(matrix):
+            return matrix[rows] @ query
+        return (matrix @ query)[rows]
+
+    def _variant_rows(self, rows):
+        """Positions in ``rows`` (default: all rows) owning variants, their variant rows and group starts"""
+        if rows is None:
+            owners = np.flatnonzero(self._variant_counts)
+            return owners, None, self.variant_offsets[owners]
+        counts = self._variant_counts[rows]
+        owners = np.flatnonzero(counts)
+        counts = counts[owners]
+        starts = np.zeros(len(owners), dtype=np.int64)
+        np.cumsum(counts[:-1], out=starts[1:])
+        # Concatenated ranges variant_offsets[row]:variant_offsets[row + 1] of every owner
+        variant_rows = np.repeat(self.variant_offsets[rows[owners]] - starts, counts) + np.arange(counts.sum())
+        return owners, variant_rows, starts
+
+    def _fold_variant_similarities(self, query, scores, rows):
+        """Raise each product's image score to its best variant image score, in place"""
+        if rows is not None:
+            rows = np.asarray(rows)
+        owners, variant_rows, starts = self._variant_rows(rows)
+        if len(owners) == 0:
+            return
+        best = np.maximum.reduceat(self._matrix_similarities('variant', query, variant_rows), starts)
+        product_rows = owners if rows is None else rows[owners]
+        # Products without a main image are scored by their variants alone
+        scores[owners] = np.where(self.image_mask[product_rows], np.maximum(scores[owners], best), best)
+
+    def matching_variants(self, query_embedding, product_ids):
+        """Variant id whose image best matches the query for each product, or None where the main image wins"""
+        matches = [None] * len(product_ids)
+        if not self.has_variants or len(product_ids) == 0:
+            return matches
+        found, rows = self.rows_for(product_ids)
+        owners, variant_rows, starts = self._variant_rows(rows)
+        if len(owners) == 0:
+            return matches
+
+        query = normalize_vector(query_embedding)
+        main_scores = self._matrix_similarities('image', query, rows[owners])
+        variant_scores = self._matrix_similarities('variant', query, variant_rows)
+        ends = np.append(starts[1:], len(variant_rows))
+        for owner, start, end, main_score in zip(owners, starts, ends, main_scores):
+            best = start + int(np.argmax(variant_scores[start:end]))
+            if not self.image_mask[rows[owner]] or variant_scores[best] > main_score:
+                matches[found[owner]] = int(self.variant_ids[variant_rows[best]])
+        return matches
+
+    def _compact_similarities(self, kind, query, rows):
+        """Score a float16/int8 matrix a chunk at a time, so only one chunk is ever widened"""
+        matrix, scales = self.vectors(kind), self.scales(kind)
+        if rows is not None and len(rows) * 2 >= len(matrix):
+            return self._compact_similarities(kind, query, None)[rows]
+
+        count = len(matrix) if rows is None else len(rows)
+        scores = np.empty(count, dtype=np.float32)
+        for start in range(0, count, SCORE_CHUNK):
+            stop = min(count, start + SCORE_CHUNK)
+            block = matrix[start:stop] if rows is None else matrix[rows[start:stop]]
+            scores[start:stop] = block.astype(np.float32) @ query
+        if scales is not None:
+            scores *= scales if rows is None else scales[rows]
+        return scores
+
+    def product_text(self, row):
+        start, end = self.text_offsets[row], self.text_offsets[row + 1]
+        return bytes(self.text_blob[start:end]).decode('utf-8').rstrip('\n')
+
+    def text_contains(self, term):
+        """Boolean mask of rows whose product text contains ``term`` as a substring.
+
+        Candidate positions are narrowed one byte of the needle at a time with
+        vectorised comparisons over the whole blob, so the cost is independent
+        of how many products match.
+        """
+        hits = np.zeros(len(self), dtype=bool)
+        needle = np.frombuffer(term.lower().encode('utf-8'), dtype=np.uint8)
+        if needle.size == 0 or needle.size > self.text_blob.size:
+            return hits
+
+        positions = np.flatnonzero(self.text_blob[:self.text_blob.size - needle.size + 1] == needle[0])
+        for offset in range(1, needle.size):
+            positions = positions[self.text_blob[positions + offset] == needle[offset]]
+        hits[np.searchsorted(self.text_offsets, positions, side='right') - 1] = True
+        return hits
+
+    def search(self, kind, query_embedding, limit, mask=None):
+        """Return ``(product_ids, cosine_scores)`` of the best ``limit`` rows.
+
+        Only rows passing ``mask`` are scored, so a selective filter touches
+        just its slice of the matrix.
+        """
+        valid = self.mask(kind)
+        if mask is not None:
+            valid = valid & mask
+        rows = np.flatnonzero(valid)
+        scores = self.similarities(kind, query_embedding, rows)
+        if scores.size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        best = top_k_indices(scores, limit)
+        return self.product_ids[rows[best]], scores[best]
+
+    def arrays(self):
+        arrays = {
+            'product_ids': self.product_ids,
+            'image_vectors': self.image_vectors,
+            'text_vectors': self.text_vectors,
+            'image_mask': self.image_mask,
+            'text_mask': self.text_mask,
+            'text_blob': self.text_blob,
+            'text_offsets': self.text_offsets,
+            'fingerprints': self.fingerprints,
+        }
+        if self.has_variants:
+            arrays.update(
+                variant_vectors=self.variant_vectors,
+                variant_ids=self.variant_ids,
+                variant_offsets=self.variant_offsets,
+            )
+        for kind in ('image', 'text', 'variant'):
+            if self.scales(kind) is not None:
+                arrays[f'{kind}_scales'] = self.scales(kind)
+        return arrays
+
+    def to_cache(self):
+        """Inverse of ``from_cache``, used when updating an index in place"""
+        cache = {}
+        for row, product_id in enumerate(self.product_ids.tolist()):
+            variant_rows = np.arange(self.variant_offsets[row], self.variant_offsets[row + 1])
+            cache[f"product_{product_id}"] = {
+                'variant_ids': self.variant_ids[variant_rows].tolist(),
+                'variant_embeddings': list(self.dense('variant', variant_rows)) if len(variant_rows) else [],
+                'image_embedding': self.dense('image', [row])[0] if self.image_mask[row] else None,
+                'text_embedding': self.dense('text', [row])[0] if self.text_mask[row] else None,
+                'product_text': self.product_text(row),
+                'fingerprint': self.fingerprints[row].decode('ascii'),
+                'product_id': product_id,
+            }
+        return cache
+
+    def save(self, path, image_model, text_model):
+        """Atomically write the index, bumping the version of any previous file"""
+        previous_version = 0
+        if os.path.exists(path):
+            try:
+                previous_version = read_index_header(path).get('version', 0)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable embedding index {path}: {e}")
+        header = {
+            'version': previous_version + 1,
+            'created_at': time.time(),
+            'count': len(self),
+            'image_model': image_model,
+            'text_model': text_model,
+            'image_dim': int(self.image_vectors.shape[1]),
+            'text_dim': int(self.text_vectors.shape[1]),
+            'storage': self.storage,
+        }
+        write_index(path, header, self.arrays())
+        return header
+
+    @classmethod
+    def load(cls, path):
+        """Open an index file; arrays are read-only memory maps"""
+        header, arrays = read_index(path)
+        index = cls(
+            arrays['product_ids'],
+            arrays['image_vectors'],
+            arrays['text_vectors'],
+            arrays['image_mask'],
+            arrays['text_mask'],
+            arrays.get('text_blob'),
+            arrays.get('text_offsets'),
+            arrays.get('fingerprints'),
+            arrays.get('image_scales'),
+            arrays.get('text_scales'),
+            arrays.get('variant_vectors'),
+            arrays.get('variant_ids'),
+            arrays.get('variant_offsets'),
+            arrays.get('variant_scales'),
+        )
+        index.header = header
+        return index
+
+
+def storage_report(index, storages=('float32', 'float16', 'int8'), k=10, queries=200, seed=0):
+    """Size, latency and recall@k of each storage type against float32 exact search.
+
+    Stored catalog vectors are used as queries. Returns one dict per
+    (embedding kind, storage).
+    """
+    reference = index.with_storage('float32')
+    rng = np.random.default_rng(seed)
+    report = []
+    for kind in ('image', 'text'):
+        rows = np.flatnonzero(reference.mask(kind))
+        if len(rows) == 0:
+            continue
+        query_vectors = reference.dense(kind, np.sort(rng.choice(rows, min(queries, len(rows)), replace=False)))
+        truth = [set(reference.search(kind, query, k)[0].tolist()) for query in query_vectors]
+        float32_bytes = reference.vectors(kind).nbytes
+
+        for storage in storages:
+            compact = reference.with_storage(storage)
+            nbytes = compact.vectors(kind).nbytes
+            if compact.scales(kind) is not None:
+                nbytes += compact.scales(kind).nbytes
+            hits = 0
+            started_at = time.perf_counter()
+            for query, expected in zip(query_vectors, truth):
+                hits += len(expected.intersection(compact.search(kind, query, k)[0].tolist()))
+            elapsed_ms = (time.perf_counter() - started_at) * 1000 / len(query_vectors)
+            report.append({
+                'kind': kind,
+                'storage': storage,
+                f'recall@{k}': round(hits / sum(len(expected) for expected in truth), 4),
+                'mb': round(nbytes / 2**20, 2),
+                'compression': round(float32_bytes / nbytes, 2),
+                'search_ms': round(elapsed_ms, 3),
+            })
+    return report
+
+
+def _aligned(offset):
+    return (offset + INDEX_ALIGNMENT - 1) // INDEX_ALIGNMENT * INDEX_ALIGNMENT
+
+
+def write_index(path, header, arrays):
+    """Write ``arrays`` plus ``header`` to ``path`` via a temp file and ``os.replace``"""
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+            'offset': offset,
+        }
+        offset = _aligned(offset + array.nbytes)
+
+    header = dict(header, format_version=INDEX_FORMAT_VERSION, arrays=layout)
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _aligned(len(INDEX_MAGIC) + 8 + len(header_bytes))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.embeddings-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(INDEX_MAGIC)
+            f.write(struct.pack('<Q', len(header_bytes)))
+            f.write(header_bytes)
+            for name, array in arrays.items():
+                f.seek(data_start + layout[name]['offset'])
+                f.write(array.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _read_header(f):
+    if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+        raise ValueError('not an embedding index file')
+    (header_length,) = struct.unpack('<Q', f.read(8))
+    header = json.loads(f.read(header_length).decode('utf-8'))
+    if header.get('format_version') != INDEX_FORMAT_VERSION:
+        raise ValueError(f"unsupported index format {header.get('format_version')}")
+    return header, _aligned(len(INDEX_MAGIC) + 8 + header_length)
+
+
+def read_index_header(path):
+    with open(path, 'rb') as f:
+        return _read_header(f)[0]
+
+
+def read_index(path):
+    """Return ``(header, {name: np.memmap})`` for an index file"""
+    with open(path, 'rb') as f:
+        header, data_start = _read_header(f)
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        shape = tuple(spec['shape'])
+        dtype = np.dtype(spec['dtype'])
+        if int(np.prod(shape)) == 0:
+            arrays[name] = np.empty(shape, dtype=dtype)
+        else:
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=data_start + spec['offset'], shape=shape)
+    return header, arrays
+
+
+class MappedFileLoader:
+    """Process-wide handle on a file written with ``write_index``.
+
+    The file is memory-mapped once and only reopened when its mtime, size or
+    inode changes (writes always go through ``os.replace``, so a new version
+    always shows up as a new inode). Subclasses implement ``open`` and return
+    ``None`` to keep the previously loaded value.
+    """
+
+    def __init__(self, path, default=None):
+        self.path = path
+        self.value = default
+        self._stat_key = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return self.value
+        stat_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stat_key == self._stat_key:
+            return self.value
+
+        with self._lock:
+            if stat_key != self._stat_key:
+                self._stat_key = stat_key
+                try:
+                    value = self.open()
+                except (OSError, ValueError, KeyError) as e:
+                    logger.error(f"Error loading {self.path}: {e}")
+                    value = None
+                if value is not None:
+                    self.value = value
+        return self.value
+
+    def open(self):
+        raise NotImplementedError
+
+
+class IndexLoader(MappedFileLoader):
+    """Loader for the product embedding index, rejecting files built with other models"""
+
+    def __init__(self, path, image_model, text_model):
+        super().__init__(path, EmbeddingIndex.empty())
+        self.image_model = image_model
+        self.text_model = text_model
+
+    @property
+    def index(self):
+        return self.value
+
+    @property
+    def version(self):
+        return self.value.header.get('version', 0)
+
+    def open(self):
+        index = EmbeddingIndex.load(self.path)
+        header = index.header
+        if header.get('image_model') != self.image_model or header.get('text_model') != self.text_model:
+            logger.warning(
+                f"Embedding index {self.path} was built with "
+                f"{header.get('image_model')}/{header.get('text_model')}, ignoring it"
+            )
+            return None
+
+        logger.info(f"Loaded embedding index v{header['version']} with {len(index)} products")
+        return index
@@ -0,0 +1,135 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceRejected(Exception):
+    """The executor is saturated; the client should retry after ``retry_after`` seconds"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class InferenceTimeout(InferenceRejected):
+    """The request's deadline passed before its inference finished"""
+
+
+class InferenceExecutor:
+    """Size-limited thread pool for model inference with admission control.
+
+    At most ``max_workers`` jobs run and ``max_queue`` wait; anything beyond
+    that is rejected immediately instead of tying up a request thread. Each
+    job carries a deadline: the caller stops waiting when it passes, and a
+    job still queued by then is dropped without running.
+    """
+
+    def __init__(self, max_workers=2, max_queue=8, timeout=10.0, retry_after=2, history=256):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ai-inference')
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._durations = deque(maxlen=history)
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @classmethod
+    def from_settings(cls):
+        config = getattr(settings, 'AI_SEARCH_INFERENCE', {})
+        return cls(
+            max_workers=config.get('WORKERS', 2),
+            max_queue=config.get('MAX_QUEUE', 8),
+            timeout=config.get('TIMEOUT', 10.0),
+            retry_after=config.get('RETRY_AFTER', 2),
+        )
+
+    def run(self, fn, *args, timeout=None, **kwargs):
+        """Run ``fn(*args, **kwargs)`` on the pool and wait for its result.
+
+        Raises ``InferenceRejected`` when the pool and queue are full and
+        ``InferenceTimeout`` when the deadline passes first.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise InferenceRejected('AI search is busy, please retry shortly', self.retry_after)
+            self._pending += 1
+
+        try:
+            future = self._executor.submit(self._call, deadline, fn, args, kwargs)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            # Drops the job if it has not started; a running one finishes in
+            # the background and still counts against capacity until then
+            cancelled = future.cancel()
+            with self._lock:
+                self.timed_out += 1
+                if cancelled:
+                    self._pending -= 1
+            raise InferenceTimeout('AI search timed out, please retry shortly', self.retry_after)
+
+    def _call(self, deadline, fn, args, kwargs):
+        try:
+            if time.monotonic() >= deadline:
+                # Waited in the queue past the caller's deadline; nobody wants the result
+                return None
+            with self._lock:
+                self._running += 1
+            started_at = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started_at
+                with self._lock:
+                    self._running -= 1
+                    self._durations.append(elapsed)
+                    self.completed += 1
+                # Pool threads are outside Django's request cycle
+                close_old_connections()
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def stats(self):
+        with self._lock:
+            durations = np.array(self._durations, dtype=np.float64) * 1000
+            stats = {
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'running': self._running,
+                'queue_depth': self._pending - self._running,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+            }
+        if len(durations):
+            stats['inference_ms'] = {
+                'last': round(float(durations[-1]), 2),
+                'mean': round(float(durations.mean()), 2),
+                'p95': round(float(np.percentile(durations, 95)), 2),
+            }
+        return stats
+
+
+inference_executor = InferenceExecutor.from_settings()
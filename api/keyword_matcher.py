@@ -0,0 +1,270 @@
+"""
+Shared keyword matcher for the intent and entity extractors.
+
+Every keyword lexicon used by the chat assistants and by AI text search is
+compiled once, at import, into a single Aho-Corasick automaton. One pass over
+a message reports every keyword it contains (as a substring, exactly like the
+``keyword in message_lower`` checks it replaces), and callers read the hits
+per lexicon and label.
+"""
+from collections import Counter, deque
+from functools import lru_cache
+
+
+# --- AILanguageProcessor (ai_chat/ai_service.py) ---
+
+INTENT_KEYWORDS = {
+    'product_search': [
+        'tìm', 'search', 'tìm kiếm', 'có', 'bán', 'sản phẩm', 'hàng', 'đồ',
+        'áo', 'quần', 'giày', 'dép', 'túi', 'phụ kiện', 'mua', 'cần', 'muốn',
+        'shop', 'store', 'còn', 'bày bán', 'kinh doanh'
+    ],
+    'size_help': [
+        'size', 'cỡ', 'số', 'kích thước', 'vừa', 'to', 'nhỏ', 'lớn', 'bé',
+        'chọn size', 'size nào', 'đo size', 'hướng dẫn', 'bảng size'
+    ],
+    'order_help': [
+        'đặt hàng', 'order', 'mua', 'thanh toán', 'giỏ hàng', 'cart',
+        'checkout', 'đặt', 'giao hàng', 'ship', 'delivery'
+    ],
+    'greeting': [
+        'xin chào', 'hello', 'hi', 'chào', 'hey', 'good morning', 'good afternoon',
+        'chào bạn', 'chào shop', 'alo'
+    ],
+    'price_inquiry': [
+        'giá', 'price', 'bao nhiêu', 'cost', 'tiền', 'phí', 'rẻ', 'đắt',
+        'khuyến mãi', 'sale', 'giảm giá', 'ưu đãi', 'discount'
+    ],
+}
+
+ENTITY_COLOR_KEYWORDS = {
+    'đỏ': ['đỏ', 'red', 'đỏ tươi', 'đỏ đậm'],
+    'xanh': ['xanh', 'blue', 'xanh dương', 'xanh da trời', 'navy'],
+    'xanh lá': ['xanh lá', 'green', 'xanh lục', 'xanh cây'],
+    'vàng': ['vàng', 'yellow', 'gold'],
+    'đen': ['đen', 'black', 'đen tuyền'],
+    'trắng': ['trắng', 'white', 'trắng tinh'],
+    'xám': ['xám', 'gray', 'grey', 'ghi'],
+    'nâu': ['nâu', 'brown', 'nâu đất'],
+    'hồng': ['hồng', 'pink', 'hồng phấn'],
+    'tím': ['tím', 'purple', 'violet'],
+    'cam': ['cam', 'orange'],
+    'be': ['be', 'beige', 'kem']
+}
+
+BRAND_KEYWORDS = {
+    'nike': ['nike', 'nike air', 'air jordan'],
+    'adidas': ['adidas', 'three stripes', '3 sọc'],
+    'zara': ['zara'],
+    'h&m': ['h&m', 'hm'],
+    'uniqlo': ['uniqlo'],
+    'gucci': ['gucci'],
+    'louis vuitton': ['lv', 'louis vuitton'],
+    'chanel': ['chanel'],
+    'puma': ['puma'],
+    'converse': ['converse', 'chuck taylor']
+}
+
+CATEGORY_KEYWORDS = {
+    'áo': ['áo', 'shirt', 'top', 'áo thun', 'áo polo', 'áo khoác', 'hoodie', 'sweater'],
+    'quần': ['quần', 'pants', 'jean', 'jeans', 'quần jean', 'quần tây', 'short', 'quần short'],
+    'giày': ['giày', 'shoes', 'sneaker', 'boot', 'sandal', 'dép', 'giày thể thao'],
+    'túi': ['túi', 'bag', 'backpack', 'handbag', 'túi xách', 'balo'],
+    'phụ kiện': ['phụ kiện', 'accessory', 'mũ', 'hat', 'belt', 'thắt lưng', 'kính']
+}
+
+# Checked in order; the first gender with a hit wins
+GENDER_KEYWORDS = {
+    'nam': ['nam', 'men', 'boy', 'male'],
+    'nữ': ['nữ', 'women', 'girl', 'female'],
+    'unisex': ['unisex', 'cả nam và nữ'],
+}
+
+STYLE_KEYWORDS = {
+    'basic': ['basic', 'cơ bản', 'đơn giản'],
+    'casual': ['casual', 'thường ngày', 'dạo phố'],
+    'formal': ['formal', 'công sở', 'lịch sự'],
+    'sport': ['sport', 'thể thao', 'gym', 'running'],
+    'vintage': ['vintage', 'cổ điển', 'retro'],
+    'streetwear': ['streetwear', 'đường phố', 'hip hop']
+}
+
+# --- SmartAIProcessor (ai_chat/smart_ai_service.py) ---
+
+SMART_INTENT_KEYWORDS = {
+    'database_query': [
+        'có bao nhiêu', 'tổng cộng', 'số lượng', 'danh sách', 'liệt kê',
+        'cho tôi biết', 'hiển thị', 'tất cả', 'toàn bộ'
+    ],
+    # Từ khóa tìm kiếm trực tiếp
+    'search': ['tìm', 'search', 'mua', 'cần', 'muốn'],
+    # Từ khóa sản phẩm
+    'product': ['áo', 'quần', 'giày', 'dép', 'sản phẩm'],
+    # Từ khóa hỏi về sản phẩm
+    'inquiry': ['có', 'bán', 'shop'],
+    # Từ khóa size (để nhận diện "size 42" là product search)
+    'size': ['size', 'cỡ', 'kích thước'],
+    'stats': [
+        'thống kê', 'báo cáo', 'doanh thu', 'bán chạy', 'top', 'phổ biến',
+        'nhiều nhất', 'ít nhất', 'trung bình'
+    ],
+    'recommendation': [
+        'gợi ý', 'recommend', 'tư vấn', 'nên mua', 'phù hợp', 'đề xuất'
+    ],
+    'greeting': ['xin chào', 'hello', 'hi', 'chào'],
+}
+
+# Checked in order; the first colour with a hit wins
+FILTER_COLOR_KEYWORDS = {
+    'đỏ': ['đỏ', 'red'],
+    'xanh dương': ['xanh dương', 'xanh', 'blue', 'navy'],
+    'xanh lá': ['xanh lá', 'green'],
+    'vàng': ['vàng', 'yellow'],
+    'đen': ['đen', 'black'],
+    'trắng': ['trắng', 'white'],
+    'xám': ['xám', 'gray', 'grey'],
+    'nâu': ['nâu', 'brown'],
+    'hồng': ['hồng', 'pink'],
+    'tím': ['tím', 'purple'],
+    'cam': ['cam', 'orange']
+}
+
+# --- AISearchService.search_by_text (api/ai_search.py) ---
+
+SEARCH_CATEGORY_KEYWORDS = {
+    'dress': {
+        'primary': ['váy'],
+        'secondary': ['dress', 'skirt', 'đầm'],
+        'exclude': ['áo', 'quần', 'giày', 'shoe', 'pant', 'shirt']
+    },
+    'top': {
+        'primary': ['áo'],
+        'secondary': ['shirt', 'top', 'blouse', 'hoodie', 'sweater'],
+        'exclude': ['váy', 'quần', 'giày', 'dress', 'pant', 'shoe']
+    },
+    'bottom': {
+        'primary': ['quần'],
+        'secondary': ['pants', 'trouser', 'jean', 'short'],
+        'exclude': ['váy', 'áo', 'giày', 'dress', 'shirt', 'shoe']
+    },
+    'shoes': {
+        'primary': ['giày'],
+        'secondary': ['shoe', 'boot', 'sandal', 'sneaker'],
+        'exclude': ['váy', 'áo', 'quần', 'dress', 'shirt', 'pant']
+    }
+}
+
+
+class KeywordHits:
+    """Keywords found in one message, readable per lexicon and label"""
+
+    def __init__(self, matcher, keywords):
+        self.keywords = frozenset(keywords)
+        self._labels = matcher.labels
+        self._counts = Counter(
+            group for keyword in self.keywords for group in matcher.groups[keyword]
+        )
+
+    def count(self, lexicon, label):
+        """Number of distinct keywords of ``lexicon[label]`` in the message"""
+        return self._counts[(lexicon, label)]
+
+    def has(self, lexicon, label=None):
+        if label is not None:
+            return self._counts[(lexicon, label)] > 0
+        return any(self._counts[(lexicon, name)] for name in self._labels[lexicon])
+
+    def labels(self, lexicon):
+        """Labels of ``lexicon`` with at least one hit, in declaration order"""
+        return [label for label in self._labels[lexicon] if self._counts[(lexicon, label)]]
+
+    def first(self, lexicon):
+        labels = self.labels(lexicon)
+        return labels[0] if labels else None
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton over ``{lexicon: {label: [keywords]}}``.
+
+    A keyword may belong to several labels and lexicons; ``match`` returns a
+    ``KeywordHits`` for every (overlapping) substring occurrence found in a
+    single left-to-right pass. Results are memoised per message because the
+    same message is usually inspected by several extractors in a row.
+    """
+
+    def __init__(self, lexicons, cache_size=256):
+        self.labels = {lexicon: list(groups) for lexicon, groups in lexicons.items()}
+        self.groups = {}
+        for lexicon, groups in lexicons.items():
+            for label, keywords in groups.items():
+                for keyword in keywords:
+                    self.groups.setdefault(keyword, []).append((lexicon, label))
+
+        # goto[state] maps a character to the next state; outputs[state] holds
+        # the keywords that end there, including those reached by fail links
+        self._goto = [{}]
+        self._outputs = [()]
+        for keyword in self.groups:
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._outputs.append(())
+                state = next_state
+            self._outputs[state] += (keyword,)
+
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._outputs[next_state] += self._outputs[self._fail[next_state]]
+
+        self.match = lru_cache(maxsize=cache_size)(self._match)
+
+    def _match(self, text):
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if outputs[state]:
+                found.update(outputs[state])
+        return KeywordHits(self, found)
+
+    def naive_match(self, text):
+        """Reference implementation: one ``keyword in text`` scan per keyword"""
+        return KeywordHits(self, [keyword for keyword in self.groups if keyword in text])
+
+
+def _flatten_search_categories():
+    return {
+        (category, role): keywords
+        for category, roles in SEARCH_CATEGORY_KEYWORDS.items()
+        for role, keywords in roles.items()
+    }
+
+
+LEXICONS = {
+    'intent': INTENT_KEYWORDS,
+    'color': ENTITY_COLOR_KEYWORDS,
+    'brand': BRAND_KEYWORDS,
+    'category': CATEGORY_KEYWORDS,
+    'gender': GENDER_KEYWORDS,
+    'style': STYLE_KEYWORDS,
+    'smart_intent': SMART_INTENT_KEYWORDS,
+    'filter_color': FILTER_COLOR_KEYWORDS,
+    'search_category': _flatten_search_categories(),
+}
+
+keyword_matcher = KeywordMatcher(LEXICONS)
@@ -0,0 +1,399 @@
+import bisect
+import logging
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+import numpy as np
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Brand, Category, Product
+from .search_cache import SharedVersion
+
+logger = logging.getLogger(__name__)
+
+# Per-field term-frequency weights (BM25F): a hit in the name counts three
+# times as much as one in the description
+FIELD_WEIGHTS = {
+    'name': 3.0,
+    'brand': 2.0,
+    'category': 2.0,
+    'description': 1.0,
+}
+
+# Marks accent-folded terms, so "ao" typed without diacritics still finds "áo"
+FOLDED_PREFIX = '~'
+
+# Upper bound on vocabulary terms a single prefix query term expands to
+MAX_PREFIX_EXPANSIONS = 50
+
+# Product fields whose values end up in the indexed text (``update_fields``
+# may name a foreign key by either spelling)
+INDEXED_FIELDS = frozenset({'name', 'description', 'brand', 'brand_id', 'category', 'category_id'})
+
+_WORD_RE = re.compile(r'\w+')
+
+_NO_POSTINGS = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+
+
+def fold_accents(text):
+    """Strip Vietnamese diacritics: "quần áo đẹp" -> "quan ao dep" """
+    decomposed = unicodedata.normalize('NFD', text)
+    stripped = ''.join(char for char in decomposed if unicodedata.category(char) != 'Mn')
+    return stripped.replace('đ', 'd').replace('Đ', 'D')
+
+
+def syllables(text):
+    """Lower-cased NFC syllables of ``text``; Vietnamese words are space-separated syllables"""
+    return _WORD_RE.findall(unicodedata.normalize('NFC', text or '').lower())
+
+
+def document_terms(text):
+    """Terms indexed for one field value.
+
+    Every syllable is indexed accent-folded; syllables carrying diacritics are
+    also indexed as written, so accented queries stay precise. Adjacent
+    syllables are indexed as folded bigrams, which rewards multi-syllable
+    words such as "áo khoác" matching as a phrase.
+    """
+    words = syllables(text)
+    folded = [fold_accents(word) for word in words]
+    terms = [FOLDED_PREFIX + word for word in folded]
+    terms.extend(word for word, plain in zip(words, folded) if word != plain)
+    terms.extend(f'{FOLDED_PREFIX}{a} {b}' for a, b in zip(folded, folded[1:]))
+    return terms
+
+
+def query_terms(text):
+    """Terms looked up for a query: accented syllables as written, plain ones folded, plus folded bigrams"""
+    words = syllables(text)
+    folded = [fold_accents(word) for word in words]
+    terms = [word if word != plain else FOLDED_PREFIX + plain for word, plain in zip(words, folded)]
+    bigrams = [f'{FOLDED_PREFIX}{a} {b}' for a, b in zip(folded, folded[1:])]
+    return terms, bigrams
+
+
+def product_fields(product):
+    return {
+        'name': product.name or '',
+        'description': product.description or '',
+        'brand': product.brand.title if product.brand_id else '',
+        'category': product.category.title if product.category_id else '',
+    }
+
+
+class LexicalIndex:
+    """In-memory inverted index over products with BM25F scoring.
+
+    Postings are kept per field as ``term -> {slot: term frequency}`` dicts so
+    single products can be added, replaced or removed cheaply; the postings
+    of a term are turned into NumPy arrays on first use after a change and
+    scored vectorised. Slots of removed products are reused.
+    """
+
+    def __init__(self, field_weights=None, k1=1.2, b=0.75):
+        self.field_weights = dict(field_weights or FIELD_WEIGHTS)
+        self.k1 = k1
+        self.b = b
+        self.version = 0
+        self._lock = threading.RLock()
+        self._postings = {field: {} for field in self.field_weights}
+        self._compiled = {}
+        self._vocabulary = None
+        self._slots = {}
+        self._doc_terms = []
+        self._free = []
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._lengths = np.zeros(0, dtype=np.float64)
+        self._total_length = 0.0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, product_id):
+        return product_id in self._slots
+
+    def add(self, product_id, fields):
+        """Index (or re-index) one product from a ``{field: text}`` dict.
+
+        Returns False, leaving the index untouched, when the product is
+        already indexed with the same terms.
+        """
+        counts = {
+            field: Counter(document_terms(fields.get(field, '')))
+            for field in self.field_weights
+        }
+        with self._lock:
+            slot = self._slots.get(product_id)
+            if slot is not None and self._doc_terms[slot] == counts:
+                return False
+            self._remove(product_id)
+            slot = self._free.pop() if self._free else self._grow()
+            length = 0.0
+            for field, field_counts in counts.items():
+                postings = self._postings[field]
+                for term, tf in field_counts.items():
+                    term_postings = postings.get(term)
+                    if term_postings is None:
+                        term_postings = postings[term] = {}
+                        self._vocabulary_add(term)
+                    term_postings[slot] = tf
+                    self._compiled.pop((field, term), None)
+                length += self.field_weights[field] * sum(field_counts.values())
+            self._slots[product_id] = slot
+            self._doc_terms[slot] = counts
+            self._ids[slot] = product_id
+            self._lengths[slot] = length
+            self._total_length += length
+            self.version += 1
+            return True
+
+    def add_product(self, product):
+        return self.add(product.id, product_fields(product))
+
+    def remove(self, product_id):
+        with self._lock:
+            if not self._remove(product_id):
+                return False
+            self.version += 1
+            return True
+
+    def _remove(self, product_id):
+        slot = self._slots.pop(product_id, None)
+        if slot is None:
+            return False
+        for field, field_counts in self._doc_terms[slot].items():
+            postings = self._postings[field]
+            for term in field_counts:
+                term_postings = postings[term]
+                del term_postings[slot]
+                if not term_postings:
+                    del postings[term]
+                    self._vocabulary_discard(term)
+                self._compiled.pop((field, term), None)
+        self._doc_terms[slot] = None
+        self._total_length -= self._lengths[slot]
+        self._lengths[slot] = 0.0
+        self._free.append(slot)
+        return True
+
+    def _vocabulary_add(self, term):
+        # Bigrams are only matched exactly, never by prefix
+        vocabulary = self._vocabulary
+        if vocabulary is None or ' ' in term:
+            return
+        position = bisect.bisect_left(vocabulary, term)
+        if position == len(vocabulary) or vocabulary[position] != term:
+            vocabulary.insert(position, term)
+
+    def _vocabulary_discard(self, term):
+        vocabulary = self._vocabulary
+        if vocabulary is None or ' ' in term:
+            return
+        if any(term in postings for postings in self._postings.values()):
+            # Still indexed in another field
+            return
+        position = bisect.bisect_left(vocabulary, term)
+        if position < len(vocabulary) and vocabulary[position] == term:
+            del vocabulary[position]
+
+    def _grow(self):
+        slot = len(self._doc_terms)
+        self._doc_terms.append(None)
+        if slot >= len(self._ids):
+            capacity = max(1024, 2 * len(self._ids))
+            self._ids = np.resize(self._ids, capacity)
+            self._lengths = np.resize(self._lengths, capacity)
+            self._lengths[slot:] = 0.0
+        return slot
+
+    def _field_postings(self, field, term):
+        key = (field, term)
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            postings = self._postings[field].get(term)
+            if postings is None:
+                return _NO_POSTINGS
+            compiled = (
+                np.fromiter(postings.keys(), dtype=np.int64, count=len(postings)),
+                np.fromiter(postings.values(), dtype=np.float64, count=len(postings)),
+            )
+            self._compiled[key] = compiled
+        return compiled
+
+    def expand(self, term, prefix=True):
+        """Vocabulary terms starting with ``term`` (just ``term`` when ``prefix`` is off)"""
+        if not prefix:
+            return [term]
+        with self._lock:
+            if self._vocabulary is None:
+                # Sorted once, then kept sorted as terms come and go
+                vocabulary = set()
+                for postings in self._postings.values():
+                    vocabulary.update(term for term in postings if ' ' not in term)
+                self._vocabulary = sorted(vocabulary)
+            vocabulary = self._vocabulary
+            start = bisect.bisect_left(vocabulary, term)
+            expansions = []
+            for candidate in vocabulary[start:start + MAX_PREFIX_EXPANSIONS]:
+                if not candidate.startswith(term):
+                    break
+                expansions.append(candidate)
+        return expansions
+
+    def matching_ids(self, words, fields=None, prefix=True):
+        """Ids of products with any of ``words`` (or, with ``prefix``, a term starting with one) in ``fields``"""
+        fields = fields or tuple(self.field_weights)
+        slots = []
+        with self._lock:
+            for word in words:
+                terms, _ = query_terms(word)
+                for term in terms:
+                    for expanded in self.expand(term, prefix):
+                        slots.extend(self._field_postings(field, expanded)[0] for field in fields)
+            if not slots:
+                return set()
+            return set(self._ids[np.unique(np.concatenate(slots))].tolist())
+
+    def score(self, query, prefix=False):
+        """BM25F scores of every product matching ``query``; returns ``(product_ids, scores)`` unsorted"""
+        terms, bigrams = query_terms(query)
+        with self._lock:
+            if not self._slots:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+            doc_count = len(self._slots)
+            average_length = self._total_length / doc_count or 1.0
+            length_norm = self.k1 * (1 - self.b + self.b * self._lengths / average_length)
+            scores = np.zeros(len(self._ids), dtype=np.float64)
+
+            expanded_terms = [expanded for term in terms for expanded in self.expand(term, prefix)]
+            for term in dict.fromkeys(expanded_terms + bigrams):
+                slots, tfs = [], []
+                for field, weight in self.field_weights.items():
+                    field_slots, field_tfs = self._field_postings(field, term)
+                    slots.append(field_slots)
+                    tfs.append(field_tfs * weight)
+                slots = np.concatenate(slots)
+                if not len(slots):
+                    continue
+                # Fold the weighted per-field frequencies into one per document
+                slots, inverse = np.unique(slots, return_inverse=True)
+                tf = np.bincount(inverse, weights=np.concatenate(tfs))
+                idf = math.log(1 + (doc_count - len(slots) + 0.5) / (len(slots) + 0.5))
+                scores[slots] += idf * tf * (self.k1 + 1) / (tf + length_norm[slots])
+
+            matched = np.flatnonzero(scores)
+            return self._ids[matched].copy(), scores[matched].astype(np.float32)
+
+    def search(self, query, limit=10, prefix=False):
+        """Top ``limit`` products for ``query``; returns ``(product_ids, scores)`` best first"""
+        product_ids, scores = self.score(query, prefix=prefix)
+        order = np.argsort(-scores, kind='stable')[:limit]
+        return product_ids[order], scores[order]
+
+    def stats(self):
+        return {
+            'documents': len(self._slots),
+            'terms': sum(len(postings) for postings in self._postings.values()),
+            'version': self.version,
+        }
+
+
+_lexical_index = None
+_lexical_index_lock = threading.Lock()
+# Bumped on every indexed change so the other workers rebuild their copies
+_lexical_version = SharedVersion('lexical-index:version')
+
+
+def build_lexical_index(queryset=None):
+    """Build a ``LexicalIndex`` over ``queryset`` (default: every product)"""
+    if queryset is None:
+        queryset = Product.objects.all()
+    queryset = queryset.select_related('brand', 'category').only(
+        'id', 'name', 'description', 'brand__title', 'category__title'
+    )
+    index = LexicalIndex()
+    for product in queryset.iterator(chunk_size=2000):
+        index.add_product(product)
+    logger.info(f"Built lexical index over {len(index)} products")
+    return index
+
+
+def get_lexical_index():
+    """Process-wide lexical index, built from the database on first use.
+
+    Product saves and deletes in this process keep it current through the
+    signal handlers below; changes made by other workers bump a counter in
+    the shared cache, and the index is rebuilt once that counter moves.
+    """
+    global _lexical_index
+    index = _lexical_index
+    if index is not None and not _lexical_version.is_stale():
+        return index
+    with _lexical_index_lock:
+        if _lexical_index is None or _lexical_index is index:
+            if index is not None:
+                logger.info("Lexical index changed in another worker; rebuilding")
+            # Read before building, so changes made during the build trigger another rebuild
+            version = _lexical_version.current()
+            _lexical_index = build_lexical_index()
+            _lexical_version.mark_built(version)
+        return _lexical_index
+
+
+def set_lexical_index(index):
+    """Replace the process-wide index; ``None`` makes the next use rebuild it from the database"""
+    global _lexical_index
+    with _lexical_index_lock:
+        _lexical_index = index
+        _lexical_version.mark_built(_lexical_version.current() if index is not None else None)
+
+
+def reset_lexical_index():
+    set_lexical_index(None)
+
+
+def _reindex(products):
+    index = _lexical_index
+    changed = index is None
+    try:
+        for product in products:
+            if index is not None and index.add_product(product):
+                changed = True
+    except Exception as e:
+        logger.error(f"Error updating lexical index: {e}")
+        changed = True
+    # Without a local copy there is nothing to compare against, so assume a change
+    if changed:
+        _lexical_version.bump(applied_locally=index is not None)
+
+
+@receiver(post_save, sender=Product, dispatch_uid='lexical_index_product_saved')
+def product_saved(sender, instance, update_fields=None, **kwargs):
+    # Stock, sales and rating updates leave the indexed text alone
+    if update_fields is not None and INDEXED_FIELDS.isdisjoint(update_fields):
+        return
+    _reindex([instance])
+
+
+@receiver(post_delete, sender=Product, dispatch_uid='lexical_index_product_deleted')
+def product_deleted(sender, instance, **kwargs):
+    index = _lexical_index
+    if index is None or index.remove(instance.id):
+        _lexical_version.bump(applied_locally=index is not None)
+
+
+@receiver(post_save, sender=Brand, dispatch_uid='lexical_index_brand_saved')
+@receiver(post_save, sender=Category, dispatch_uid='lexical_index_category_saved')
+def product_group_saved(sender, instance, created, **kwargs):
+    # A renamed brand or category changes the indexed text of its products
+    if created:
+        return
+    lookup = 'brand' if sender is Brand else 'category'
+    if _lexical_index is None:
+        _lexical_version.bump(applied_locally=False)
+        return
+    _reindex(Product.objects.filter(**{lookup: instance}).select_related('brand', 'category'))
@@ -0,0 +1,101 @@
+import json
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark AI search latency (p50/p95/p99), memory and index load time on synthetic '
+        'catalogs of random normalised embeddings. Models are mocked by default, so no weights '
+        'are downloaded. A 1M-row catalog needs about 4 GB of RAM and disk.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            default='1000,10000,100000',
+            help='Comma-separated catalog sizes (default: 1000,10000,100000; add 1000000 for 1M)',
+        )
+        parser.add_argument('--queries', type=int, default=200, help='Queries per measurement (default: 200)')
+        parser.add_argument('--limit', type=int, default=10, help='Results per query (default: 10)')
+        parser.add_argument(
+            '--kinds',
+            default='image,text,combined',
+            help='Comma-separated search kinds to time (default: image,text,combined)',
+        )
+        parser.add_argument('--ann', action='store_true', help='Also build and time the IVF indexes')
+        parser.add_argument('--nprobe', type=int, default=8, help='IVF lists probed per query (default: 8)')
+        parser.add_argument(
+            '--storage',
+            default='float32',
+            help='Comma-separated vector storages to time: float32, float16, int8 (default: float32)',
+        )
+        parser.add_argument(
+            '--no-lexical',
+            action='store_true',
+            help='Skip building the BM25 index over the synthetic product names',
+        )
+        parser.add_argument(
+            '--real-models',
+            action='store_true',
+            help='Run the real CLIP / sentence-transformer models instead of mocks',
+        )
+        parser.add_argument('--workdir', default=None, help='Directory for index files (default: a temp dir)')
+        parser.add_argument('--output', default=None, help='Also write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        try:
+            from api.embedding_index import STORAGE_DTYPES
+            from api.search_benchmark import run_benchmark
+        except ImportError as e:
+            raise CommandError(f'AI search dependencies are not installed: {e}')
+
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        except ValueError:
+            raise CommandError('--sizes must be comma-separated integers')
+        kinds = [kind.strip() for kind in options['kinds'].split(',') if kind.strip()]
+        unknown = set(kinds) - {'image', 'text', 'combined'}
+        if unknown:
+            raise CommandError(f"Unknown search kinds: {', '.join(sorted(unknown))}")
+        storages = [storage.strip() for storage in options['storage'].split(',') if storage.strip()]
+        unknown = set(storages) - set(STORAGE_DTYPES)
+        if unknown:
+            raise CommandError(f"Unknown storages: {', '.join(sorted(unknown))}")
+
+        workdir = options['workdir'] or tempfile.mkdtemp(prefix='ai-search-bench-')
+        results = []
+        self.stdout.write(
+            f"{'size':>9} {'storage':<7} {'searcher':<6} {'kind':<9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+            f"{'qps':>8} {'load ms':>8} {'index MB':>9} {'rss MB':>8}"
+        )
+        try:
+            for row in run_benchmark(
+                sizes,
+                workdir,
+                queries=max(1, options['queries']),
+                limit=max(1, options['limit']),
+                kinds=kinds,
+                storages=storages,
+                ann=options['ann'],
+                nprobe=options['nprobe'],
+                lexical=not options['no_lexical'],
+                mock_models=not options['real_models'],
+                log=lambda message: self.stderr.write(message),
+            ):
+                results.append(row)
+                self.stdout.write(
+                    f"{row['size']:>9} {row['storage']:<7} {row['searcher']:<6} {row['kind']:<9} {row['p50_ms']:>9.3f} "
+                    f"{row['p95_ms']:>9.3f} {row['p99_ms']:>9.3f} {row['qps']:>8.1f} {row['load_ms']:>8.2f} "
+                    f"{row['index_mb']:>9.1f} {row['rss_mb']:>8.1f}"
+                )
+        finally:
+            if not options['workdir']:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
@@ -0,0 +1,63 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.keyword_matcher import keyword_matcher
+
+SAMPLE_MESSAGES = [
+    'xin chào shop',
+    'tìm áo thun nam màu đen size L',
+    'có quần jean nữ xanh dương dưới 500k không',
+    'giày thể thao nike air size 42 giá bao nhiêu',
+    'cho tôi biết tổng cộng có bao nhiêu sản phẩm',
+    'gợi ý cho tôi một bộ đồ công sở lịch sự',
+    'thống kê top thương hiệu bán chạy nhất',
+    'làm sao để đặt hàng và thanh toán, ship mất mấy ngày',
+    'túi xách gucci màu hồng phấn có sale không',
+    'áo khoác hoodie streetwear unisex phong cách retro vintage',
+    'váy đầm dạo phố màu be kem',
+    'i need running shoes for women, white or grey, under 1 million',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Micro-benchmark the shared Aho-Corasick keyword matcher against the per-keyword '
+        '"keyword in message" loops it replaced'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=2000,
+            help='Passes over the sample messages per implementation (default: 2000)',
+        )
+
+    def handle(self, *args, **options):
+        messages = [message.lower() for message in SAMPLE_MESSAGES]
+        iterations = max(1, options['iterations'])
+
+        for message in messages:
+            expected = keyword_matcher.naive_match(message).keywords
+            found = keyword_matcher._match(message).keywords
+            if found != expected:
+                self.stdout.write(self.style.ERROR(
+                    f'Mismatch for {message!r}: missing={sorted(expected - found)} extra={sorted(found - expected)}'
+                ))
+                return
+
+        keywords = len(keyword_matcher.groups)
+        self.stdout.write(f'{keywords} keywords, {len(messages)} messages, {iterations} iterations')
+        for name, match in (
+            ('per-keyword loops', keyword_matcher.naive_match),
+            ('aho-corasick', keyword_matcher._match),
+            ('aho-corasick (memoised)', keyword_matcher.match),
+        ):
+            started_at = time.perf_counter()
+            for _ in range(iterations):
+                for message in messages:
+                    match(message)
+            elapsed = time.perf_counter() - started_at
+            per_message_us = elapsed * 1e6 / (iterations * len(messages))
+            self.stdout.write(f'  {name:<24} {per_message_us:8.2f} us/message')
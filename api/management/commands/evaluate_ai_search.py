@@ -0,0 +1,70 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay a labelled query set (JSONL of query -> relevant product ids) against the AI search '
+        'index and report recall@k, nDCG@k, MRR and ranking latency for each scoring configuration.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', help='JSONL query set; see api/search_eval.py for the format')
+        parser.add_argument(
+            '--configs',
+            default=None,
+            help=(
+                'JSON file with a list of configurations, e.g. '
+                '[{"name": "lexical-0.3", "scoring": {"LEXICAL_WEIGHT": 0.3}, "fusion": "rrf", '
+                '"ann": {"NPROBE": 16}}] (default: baseline plus one knob moved at a time)'
+            ),
+        )
+        parser.add_argument('--k', type=int, default=10, help='Cut-off for recall and nDCG (default: 10)')
+        parser.add_argument('--output', default=None, help='Also write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        try:
+            from api.ai_search import ai_search_service
+            from api.search_eval import evaluate, load_queries
+            from api.search_fusion import FUSION_METHODS
+        except ImportError as e:
+            raise CommandError(f'AI search dependencies are not installed: {e}')
+
+        try:
+            queries = load_queries(options['queries'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not read the query set: {e}')
+        if not queries:
+            raise CommandError('The query set is empty')
+
+        configs = None
+        if options['configs']:
+            try:
+                with open(options['configs']) as f:
+                    configs = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Could not read the configurations: {e}')
+            if not isinstance(configs, list) or not all(isinstance(config, dict) for config in configs):
+                raise CommandError('--configs must hold a JSON list of objects')
+            unknown = {config.get('fusion', 'weighted') for config in configs} - set(FUSION_METHODS)
+            if unknown:
+                raise CommandError(f"Unknown fusion methods: {', '.join(sorted(unknown))}")
+
+        k = max(1, options['k'])
+        results = []
+        self.stdout.write(
+            f"{'config':<16} {f'recall@{k}':>10} {f'ndcg@{k}':>8} {'mrr':>7} {'failed':>6} "
+            f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'qps':>8}"
+        )
+        for row in evaluate(ai_search_service, queries, configs, k, log=lambda message: self.stderr.write(message)):
+            results.append(row)
+            self.stdout.write(
+                f"{row['config']:<16} {row[f'recall@{k}']:>10.4f} {row[f'ndcg@{k}']:>8.4f} {row['mrr']:>7.4f} "
+                f"{row['failed']:>6} {row['p50_ms']:>9.3f} {row['p95_ms']:>9.3f} {row['p99_ms']:>9.3f} {row['qps']:>8.1f}"
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
@@ -2,16 +2,96 @@ from django.core.management.base import BaseCommand
 from api.ai_search import ai_search_service
 
 class Command(BaseCommand):
-    help = 'Precompute embeddings for all products'
+    help = (
+        'Precompute embeddings for all products. Runs as an incremental refresh by default: '
+        'only new or changed products are re-embedded and deleted products are dropped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Re-embed every product instead of only the changed ones',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=32,
+            help='Number of products sent to the models per batch (default: 32)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=0,
+            help='Processes used to decode and resize images; 0 or 1 decodes inline (default: 0)',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default=None,
+            help='File to checkpoint progress to; an interrupted run resumes from it',
+        )
+        parser.add_argument(
+            '--build-ann',
+            action='store_true',
+            help='(Re)build the IVF approximate nearest-neighbour indexes after the refresh, even below '
+                 'MIN_PRODUCTS; a refresh that rewrites the index rebuilds them anyway when ANN search is in use',
+        )
+        parser.add_argument(
+            '--nlist',
+            type=int,
+            default=None,
+            help='Number of IVF lists (default: sqrt of the number of products)',
+        )
+        parser.add_argument(
+            '--ann-report',
+            action='store_true',
+            help='Print recall@10 and latency of the IVF indexes against exact search',
+        )
+        parser.add_argument(
+            '--storage-report',
+            action='store_true',
+            help='Print recall@10, size and latency of float16/int8 vector storage against float32',
+        )
 
     def handle(self, *args, **options):
-        self.stdout.write('Starting to precompute embeddings...')
+        mode = 'full rebuild' if options['full'] else 'incremental refresh'
+        self.stdout.write(f'Starting to precompute embeddings ({mode})...')
         try:
-            ai_search_service.precompute_product_embeddings()
+            stats = ai_search_service.precompute_product_embeddings(
+                full=options['full'],
+                batch_size=max(1, options['batch_size']),
+                workers=options['workers'],
+                checkpoint_file=options['checkpoint'],
+            )
             self.stdout.write(
-                self.style.SUCCESS('Successfully precomputed embeddings!')
+                self.style.SUCCESS(
+                    'Successfully precomputed embeddings! '
+                    f"added={stats['added']} updated={stats['updated']} removed={stats['removed']} "
+                    f"unchanged={stats['unchanged']} failed={stats['failed']} "
+                    f"({stats['products_per_second']} products/s)"
+                )
             )
+            built = stats.get('ann', {})
+            if options['build_ann'] and (not built or options['nlist']):
+                built = ai_search_service.build_ann_indexes(nlist=options['nlist'])
+            for kind, info in built.items():
+                self.stdout.write(f"Built {kind} IVF index: {info['nlist']} lists in {info['seconds']}s")
+            if options['ann_report']:
+                for kind, rows in ai_search_service.ann_recall_report().items():
+                    self.stdout.write(f'{kind} IVF vs exact:')
+                    for row in rows:
+                        self.stdout.write(
+                            f"  nprobe={row['nprobe']:<3} recall@10={row['recall@10']:.3f} "
+                            f"ann={row['ann_ms']:.2f}ms exact={row['exact_ms']:.2f}ms"
+                        )
+            if options['storage_report']:
+                self.stdout.write(f'Index storage: {ai_search_service.index_storage}')
+                for row in ai_search_service.storage_report():
+                    self.stdout.write(
+                        f"  {row['kind']:<5} {row['storage']:<7} recall@10={row['recall@10']:.3f} "
+                        f"{row['mb']:.2f}MB (x{row['compression']}) search={row['search_ms']:.2f}ms"
+                    )
         except Exception as e:
             self.stdout.write(
                 self.style.ERROR(f'Error: {e}')
-            )
\ No newline at end of file
+            )
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Load the AI search models and embedding index, reporting how long each takes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--models',
+            default='clip,text',
+            help='Comma-separated models to load: clip, text (default: clip,text)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            from api.ai_search import ai_search_service
+        except ImportError as e:
+            self.stdout.write(self.style.ERROR(f'AI search unavailable: {e}'))
+            return
+
+        models = [model.strip() for model in options['models'].split(',') if model.strip()]
+        try:
+            timings = ai_search_service.warm_up(models=models)
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error: {e}'))
+            return
+
+        for step, seconds in timings.items():
+            self.stdout.write(f'{step}: {seconds}s')
+        self.stdout.write(self.style.SUCCESS('AI search is warm'))
@@ -73,6 +73,15 @@ class Product(models.Model):
     # Thêm trường để xác định sản phẩm có biến thể hay không
     has_variants = models.BooleanField(default=False, help_text="Sản phẩm có biến thể màu sắc/size")
 
+    class Meta:
+        # Chỉ mục cho phân trang keyset: mỗi khóa sắp xếp đi kèm id
+        indexes = [
+            models.Index(fields=['createdAt', 'id'], name='product_created_id_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['total_sold', 'id'], name='product_sold_id_idx'),
+            models.Index(fields=['rating', 'id'], name='product_rating_id_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -0,0 +1,185 @@
+"""
+Keyset (cursor) pagination for the product catalog.
+
+Pages are cut with ``WHERE (sort_key, id) > (last_key, last_id)`` over an
+index on the same columns instead of ``OFFSET``, so page 1,000 costs the
+same as page one and rows inserted while a client pages through are
+neither skipped nor repeated. Cursors are opaque base64 tokens that
+carry the ordering and the last row's keys.
+"""
+import base64
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .models import Product
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination over ``(sort field, id)``; NULL sort values come after every other value.
+
+    Only requests that carry ``cursor``, ``page_size`` or ``ordering`` are
+    paginated; a bare list request keeps returning every row, as clients
+    written before pagination expect.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering_query_param = 'ordering'
+    # Field the page is sorted on, by ``ordering`` value; ties are broken on id
+    orderings = ('createdAt',)
+    default_ordering = '-createdAt'
+    settings_name = None
+    model = None
+
+    def __init__(self):
+        config = getattr(settings, self.settings_name, {}) if self.settings_name else {}
+        self.page_size = config.get('PAGE_SIZE', 24)
+        self.max_page_size = config.get('MAX_PAGE_SIZE', 100)
+
+    def is_requested(self, request):
+        params = request.query_params
+        return any(
+            name in params
+            for name in (self.cursor_query_param, self.page_size_query_param, self.ordering_query_param)
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        cursor = self.decode_cursor(request)
+        if cursor is None:
+            self.ordering = self.get_ordering(request)
+            position, reverse = None, False
+        else:
+            self.ordering, position, reverse = cursor
+        field, descending = self.ordering.lstrip('-'), self.ordering.startswith('-')
+        # Walking backwards is walking forwards in the opposite order
+        descending = descending != reverse
+
+        loaded, deferred = queryset.query.deferred_loading
+        if not deferred and loaded and field not in loaded:
+            # The next cursor is built from the sort key, so an ``only()`` must load it
+            queryset = queryset.only(*loaded, field)
+        if position is not None:
+            queryset = queryset.filter(self.after(field, *position, descending))
+        if descending:
+            order = (F(field).desc(nulls_first=True), F('id').desc())
+        else:
+            order = (F(field).asc(nulls_last=True), F('id').asc())
+        rows = list(queryset.order_by(*order)[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.rows = rows
+        return rows
+
+    def get_page_size(self, request):
+        raw = request.query_params.get(self.page_size_query_param)
+        if raw is None:
+            return self.page_size
+        try:
+            page_size = int(raw)
+        except ValueError:
+            raise ValidationError({self.page_size_query_param: 'Must be an integer.'})
+        if page_size < 1:
+            raise ValidationError({self.page_size_query_param: 'Must be at least 1.'})
+        return min(page_size, self.max_page_size) if self.max_page_size else page_size
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param) or self.default_ordering
+        if ordering.lstrip('-') not in self.orderings:
+            choices = ', '.join(f'{field}, -{field}' for field in self.orderings)
+            raise ValidationError({self.ordering_query_param: f'Must be one of: {choices}.'})
+        return ordering
+
+    @staticmethod
+    def after(field, value, pk, descending):
+        """Rows strictly after ``(value, pk)`` in the page order"""
+        if descending:
+            if value is None:
+                return Q(**{f'{field}__isnull': True, 'id__lt': pk}) | Q(**{f'{field}__isnull': False})
+            return Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': pk})
+        if value is None:
+            return Q(**{f'{field}__isnull': True, 'id__gt': pk})
+        return Q(**{f'{field}__gt': value}) | Q(**{field: value, 'id__gt': pk}) | Q(**{f'{field}__isnull': True})
+
+    def decode_cursor(self, request):
+        """``(ordering, (value, pk), reverse)`` from the request's cursor, or None without one"""
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+            ordering = payload['o']
+            if ordering.lstrip('-') not in self.orderings:
+                raise ValueError(ordering)
+            model_field = self.model._meta.get_field(ordering.lstrip('-'))
+            value = None if payload['v'] is None else model_field.to_python(payload['v'])
+            return ordering, (value, int(payload['i'])), bool(payload.get('r'))
+        except (ValueError, TypeError, KeyError, AttributeError, DjangoValidationError) as e:
+            raise NotFound('Invalid cursor.') from e
+
+    def encode_cursor(self, row, reverse):
+        field = self.ordering.lstrip('-')
+        value = getattr(row, field)
+        if value is not None:
+            value = self.model._meta.get_field(field).value_to_string(row)
+        payload = {'o': self.ordering, 'v': value, 'i': row.pk, 'r': int(reverse)}
+        token = base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode('ascii'))
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.ordering_query_param)
+        return replace_query_param(url, self.cursor_query_param, token.decode('ascii'))
+
+    def get_next_link(self):
+        if not self.has_next or not self.rows:
+            return None
+        return self.encode_cursor(self.rows[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.rows:
+            return None
+        return self.encode_cursor(self.rows[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class ProductCursorPagination(KeysetPagination):
+    """``/api/products/?ordering=-price&page_size=24``, then follow ``next`` / ``previous``"""
+    orderings = ('createdAt', 'price', 'total_sold', 'rating')
+    settings_name = 'PRODUCT_PAGINATION'
+    model = Product
+
+
+class CatalogCursorPagination(ProductCursorPagination):
+    """Product pagination for endpoints that always page"""
+
+    def is_requested(self, request):
+        return True
@@ -0,0 +1,231 @@
+"""
+Synthetic-catalog benchmark for ``AISearchService``.
+
+Builds embedding indexes of random normalised vectors, saves them in the
+normal index format, and times image, text and combined ranking against
+them. With ``mock_models`` the CLIP / sentence-transformer calls are replaced
+by deterministic random embeddings, so no weights are downloaded and the
+benchmark runs on CPU-only CI.
+"""
+import gc
+import hashlib
+import os
+import resource
+import time
+
+import numpy as np
+from PIL import Image
+
+from .ai_search import CLIP_MODEL_NAME, TEXT_MODEL_NAME, AISearchService
+from .ann_index import IVFLoader
+from .embedding_index import EmbeddingIndex, IndexLoader, normalize_rows
+from .lexical_index import LexicalIndex, set_lexical_index
+from .search_cache import ImageHashCache, QueryCache
+
+# Rows generated per chunk, bounding the temporary random-normal buffers
+GENERATE_CHUNK = 65536
+
+SYNTHETIC_WORDS = {
+    'kind': ['áo thun', 'áo khoác', 'áo sơ mi', 'quần jean', 'quần short', 'giày thể thao', 'váy', 'đầm', 'túi xách'],
+    'color': ['đen', 'trắng', 'xanh dương', 'đỏ', 'xám', 'be', 'hồng', 'nâu'],
+    'audience': ['nam', 'nữ', 'unisex', 'trẻ em'],
+    'style': ['basic', 'công sở', 'thể thao', 'vintage', 'streetwear', 'oversize'],
+    'brand': ['nike', 'adidas', 'zara', 'uniqlo', 'puma', 'converse', 'local brand'],
+}
+
+
+class MockEmbeddingModels:
+    """Deterministic stand-ins for CLIP and MiniLM: the same input always maps to the same random vector"""
+
+    def __init__(self, image_dim=512, text_dim=384):
+        self.image_dim = image_dim
+        self.text_dim = text_dim
+
+    @staticmethod
+    def _vector(key, dim):
+        seed = int.from_bytes(hashlib.sha1(key).digest()[:8], 'little')
+        return np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+
+    def image(self, image):
+        if isinstance(image, str) or hasattr(image, 'read'):
+            image = Image.open(image)
+        elif isinstance(image, np.ndarray):
+            # The precompute pipeline hands over images decoded by load_catalog_image
+            image = Image.fromarray(image)
+        vector = self._vector(image.convert('RGB').resize((16, 16)).tobytes(), self.image_dim)
+        return vector / np.linalg.norm(vector)
+
+    def text(self, text):
+        return self._vector(text.encode('utf-8'), self.text_dim)
+
+    def install(self, service):
+        """Route ``service``'s model calls to the mocks"""
+        service.get_image_embedding = self.image
+        service.get_image_embeddings = lambda images: [self.image(image) for image in images]
+        service.get_text_embedding = self.text
+        service.get_text_embeddings = lambda texts, batch_size=32: [self.text(text) for text in texts]
+
+
+def synthetic_product_text(rng, count):
+    columns = [rng.choice(len(words), count) for words in SYNTHETIC_WORDS.values()]
+    vocab = list(SYNTHETIC_WORDS.values())
+    return [
+        ' '.join(vocab[field][column[row]] for field, column in enumerate(columns))
+        for row in range(count)
+    ]
+
+
+def random_unit_rows(rng, count, dim):
+    matrix = np.empty((count, dim), dtype=np.float32)
+    for start in range(0, count, GENERATE_CHUNK):
+        stop = min(count, start + GENERATE_CHUNK)
+        matrix[start:stop] = normalize_rows(rng.standard_normal((stop - start, dim), dtype=np.float32))
+    return matrix
+
+
+def synthetic_index(count, image_dim=512, text_dim=384, seed=0):
+    """``EmbeddingIndex`` of ``count`` products with random unit vectors; returns ``(index, texts)``"""
+    rng = np.random.default_rng(seed)
+    texts = synthetic_product_text(rng, count)
+    text_blob, text_offsets = EmbeddingIndex._pack_texts(texts)
+    index = EmbeddingIndex(
+        np.arange(1, count + 1, dtype=np.int64),
+        random_unit_rows(rng, count, image_dim),
+        random_unit_rows(rng, count, text_dim),
+        text_blob=text_blob,
+        text_offsets=text_offsets,
+    )
+    return index, texts
+
+
+def synthetic_lexical_index(texts):
+    index = LexicalIndex()
+    for product_id, text in enumerate(texts, start=1):
+        index.add(product_id, {'name': text})
+    return index
+
+
+def synthetic_queries(count, seed=1):
+    """``count`` (noise image, text query) pairs"""
+    rng = np.random.default_rng(seed)
+    texts = synthetic_product_text(rng, count)
+    queries = []
+    for row in range(count):
+        pixels = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+        # Keep only the kind and colour words: search queries are short
+        queries.append((Image.fromarray(pixels), ' '.join(texts[row].split()[:3])))
+    return queries
+
+
+def current_rss_mb():
+    """Resident set size of this process, falling back to the peak where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def latency_summary(samples_ms):
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'qps': round(1000 / float(samples.mean()), 1),
+    }
+
+
+def benchmark_service(workdir, mock_models=True):
+    """An ``AISearchService`` reading from ``workdir`` with every result cache out of the way"""
+    service = AISearchService()
+    service.cache_dir = workdir
+    service.index_file = os.path.join(workdir, 'product_embeddings.idx')
+    service.legacy_cache_file = os.path.join(workdir, 'product_embeddings.pkl')
+    service.index_loader = IndexLoader(service.index_file, CLIP_MODEL_NAME, TEXT_MODEL_NAME)
+    service.ann_loaders = {
+        kind: IVFLoader(os.path.join(workdir, f'product_embeddings.ivf-{kind}.idx'))
+        for kind in ('image', 'text')
+    }
+    service.query_embedding_cache = QueryCache('bench:text-vector', backend='')
+    service.text_results_cache = QueryCache('bench:text-results', backend='')
+    service.image_results_cache = QueryCache('bench:image-results', max_entries=1, ttl=0, backend='')
+    service.image_embedding_cache = ImageHashCache(max_entries=1, max_distance=0)
+    service.cache_text_results = False
+    if mock_models:
+        MockEmbeddingModels().install(service)
+    return service
+
+
+def run_benchmark(sizes, workdir, queries=200, limit=10, kinds=('image', 'text', 'combined'),
+                  ann=False, nprobe=8, lexical=True, mock_models=True, seed=0, log=None,
+                  storages=('float32',)):
+    """Benchmark every catalog size and storage; yields one result dict per (size, storage, searcher, kind)"""
+    log = log or (lambda message: None)
+    query_set = synthetic_queries(queries, seed=seed + 1)
+
+    for size in sizes:
+        for storage in storages:
+            yield from _benchmark_catalog(
+                size, storage, workdir, query_set, limit, kinds, ann, nprobe, lexical, mock_models, seed, log,
+            )
+
+
+def _benchmark_catalog(size, storage, workdir, query_set, limit, kinds, ann, nprobe, lexical, mock_models, seed, log):
+    service = benchmark_service(workdir, mock_models=mock_models)
+    rss_before = current_rss_mb()
+
+    started_at = time.perf_counter()
+    index, texts = synthetic_index(size, seed=seed)
+    index = index.with_storage(storage)
+    generate_seconds = time.perf_counter() - started_at
+    index.save(service.index_file, CLIP_MODEL_NAME, TEXT_MODEL_NAME)
+    index_bytes = os.path.getsize(service.index_file)
+    del index
+    gc.collect()
+    log(f'{size} rows ({storage}): generated in {generate_seconds:.2f}s, index file {index_bytes / 2**20:.1f} MB')
+
+    set_lexical_index(synthetic_lexical_index(texts) if lexical else LexicalIndex())
+    del texts
+
+    started_at = time.perf_counter()
+    index = service.load_index()
+    load_ms = (time.perf_counter() - started_at) * 1000
+
+    searchers = [('exact', {'ENABLED': False})]
+    if ann:
+        service.ann_config = {'ENABLED': True, 'MIN_PRODUCTS': 0, 'NPROBE': nprobe}
+        started_at = time.perf_counter()
+        service.build_ann_indexes()
+        log(f'{size} rows: IVF indexes built in {time.perf_counter() - started_at:.2f}s')
+        searchers.append(('ivf', {'ENABLED': True, 'MIN_PRODUCTS': 0, 'NPROBE': nprobe}))
+
+    for searcher, ann_config in searchers:
+        service.ann_config = ann_config
+        for kind in kinds:
+            samples = []
+            for image, text in query_set:
+                started_at = time.perf_counter()
+                if kind == 'image':
+                    service.rank_image(image, limit)
+                elif kind == 'text':
+                    service.rank_text(text, limit)
+                else:
+                    service.rank_combined(image, text, limit)
+                samples.append((time.perf_counter() - started_at) * 1000)
+            yield dict(
+                size=size,
+                storage=storage,
+                searcher=searcher,
+                kind=kind,
+                load_ms=round(load_ms, 2),
+                index_mb=round(index_bytes / 2**20, 1),
+                rss_mb=round(current_rss_mb() - rss_before, 1),
+                **latency_summary(samples),
+            )
+
+    service.branch_executor.shutdown()
+    del index, service
+    set_lexical_index(None)
+    gc.collect()
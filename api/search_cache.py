@@ -0,0 +1,317 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+# Levels per RGB channel of the colour signature kept next to the dHash
+COLOUR_LEVELS = 4
+
+
+class LRUCache:
+    """Thread-safe, size-bounded LRU mapping whose entries also expire after ``ttl`` seconds"""
+
+    def __init__(self, max_entries=1024, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {
+            'entries': len(self._data),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+def normalize_query(text):
+    """Canonical form of a search query: NFC, lower-case, single spaces"""
+    text = unicodedata.normalize('NFC', text or '')
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+class QueryCache:
+    """Two-level cache for text-search work keyed on the normalised query.
+
+    Entries live in a per-process ``LRUCache`` and, when the
+    ``AI_SEARCH_QUERY_CACHE['BACKEND']`` setting names a Django cache alias,
+    in that shared cache as well so every worker benefits from hot queries.
+    Query vectors are keyed on the model name; ranked results additionally
+    on the embedding index version so a reindex invalidates them.
+    """
+
+    def __init__(self, namespace, max_entries=None, ttl=None, backend=None):
+        config = getattr(settings, 'AI_SEARCH_QUERY_CACHE', {})
+        self.namespace = namespace
+        self.ttl = ttl if ttl is not None else config.get('TTL', 3600)
+        self.local = LRUCache(
+            max_entries if max_entries is not None else config.get('MAX_ENTRIES', 1024),
+            self.ttl,
+        )
+        self.backend = backend if backend is not None else config.get('BACKEND')
+        self.shared_hits = 0
+        self.misses = 0
+
+    def _key(self, parts):
+        raw = '\x1f'.join(str(part) for part in parts)
+        return f"{self.namespace}:{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+    def _shared(self):
+        if not self.backend:
+            return None
+        try:
+            return caches[self.backend]
+        except Exception as e:
+            logger.warning(f"Query cache backend '{self.backend}' unavailable: {e}")
+            return None
+
+    def get(self, parts):
+        key = self._key(parts)
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        shared = self._shared()
+        if shared is not None:
+            try:
+                value = shared.get(key, _MISSING)
+            except Exception as e:
+                logger.warning(f"Query cache lookup failed: {e}")
+                value = _MISSING
+            if value is not _MISSING:
+                self.shared_hits += 1
+                self.local.set(key, value)
+                return value
+
+        self.misses += 1
+        return None
+
+    def set(self, parts, value):
+        key = self._key(parts)
+        self.local.set(key, value)
+        shared = self._shared()
+        if shared is not None:
+            try:
+                shared.set(key, value, self.ttl or None)
+            except Exception as e:
+                logger.warning(f"Query cache store failed: {e}")
+
+    def clear(self):
+        self.local.clear()
+
+    def stats(self):
+        local = self.local.stats()
+        return {
+            'entries': local['entries'],
+            'max_entries': local['max_entries'],
+            'local_hits': local['hits'],
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'backend': self.backend,
+        }
+
+
+class SharedVersion:
+    """Change counter in a shared Django cache that keeps per-process indexes in step across workers.
+
+    Writers ``bump()`` it after changing rows an in-memory index is built
+    from; a process remembers the value its copy was built at
+    (``mark_built``) and ``is_stale()`` turns true once another process has
+    bumped it since. Lookups are throttled to one per ``check_interval``
+    seconds. With no shared cache configured every process only sees its
+    own writes.
+    """
+
+    def __init__(self, key, backend=None, check_interval=None):
+        config = getattr(settings, 'SEARCH_INDEX_SYNC', {})
+        self.key = key
+        self.backend = backend if backend is not None else config.get('BACKEND', 'default')
+        self.check_interval = check_interval if check_interval is not None else config.get('CHECK_INTERVAL', 5)
+        self.seen = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _shared(self):
+        if not self.backend:
+            return None
+        try:
+            return caches[self.backend]
+        except Exception as e:
+            logger.warning(f"Index version backend '{self.backend}' unavailable: {e}")
+            return None
+
+    def current(self):
+        """The shared counter (0 when unset or evicted), or None without a usable shared cache"""
+        shared = self._shared()
+        if shared is None:
+            return None
+        try:
+            return shared.get(self.key, 0)
+        except Exception as e:
+            logger.warning(f"Index version lookup failed for '{self.key}': {e}")
+            return None
+
+    def mark_built(self, version):
+        """Record that the local copy reflects every change up to ``version`` (read before building)"""
+        with self._lock:
+            self.seen = version
+            self._checked_at = time.monotonic()
+
+    def is_stale(self):
+        """True when the counter moved past the value the local copy was built at"""
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is not None and now - self._checked_at < self.check_interval:
+                return False
+            self._checked_at = now
+        version = self.current()
+        return version is not None and version != self.seen
+
+    def bump(self, applied_locally=True):
+        """Announce a change to every process.
+
+        With ``applied_locally`` the local copy already holds the change, so
+        it stays current unless another process bumped in the meantime.
+        """
+        shared = self._shared()
+        if shared is None:
+            return None
+        try:
+            try:
+                version = shared.incr(self.key)
+            except ValueError:
+                # Never set, or evicted: start over, unless another process just did
+                version = 1 if shared.add(self.key, 1, None) else shared.incr(self.key)
+        except Exception as e:
+            logger.warning(f"Index version bump failed for '{self.key}': {e}")
+            return None
+        with self._lock:
+            if applied_locally and self.seen is not None and version == self.seen + 1:
+                self.seen = version
+        return version
+
+
+def dhash(image):
+    """64-bit difference hash of a PIL image.
+
+    The image is shrunk to 9x8 greyscale and each
+    bit records whether a pixel is brighter than its right-hand neighbour, so
+    re-encoded, resized or lightly compressed copies of a photo hash to the
+    same (or a very close) value.
+    """
+    pixels = np.asarray(
+        image.convert('L').resize((9, 8), Image.BILINEAR),
+        dtype=np.int16,
+    )
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def colour_signature(image):
+    """Coarse colour of a PIL image: its mean RGB, ``COLOUR_LEVELS`` levels per channel, as one int.
+
+    dHash only sees brightness, so the same print in red and in blue hashes
+    alike; their signatures differ.
+    """
+    pixels = np.asarray(image.convert('RGB').resize((8, 8), Image.BILINEAR), dtype=np.float64)
+    levels = np.minimum((pixels.reshape(-1, 3).mean(axis=0) * COLOUR_LEVELS / 256).astype(np.int64), COLOUR_LEVELS - 1)
+    return int((levels[0] * COLOUR_LEVELS + levels[1]) * COLOUR_LEVELS + levels[2])
+
+
+def image_signature(image):
+    """``(colour_signature, dhash)`` key of an image in ``ImageHashCache``"""
+    return colour_signature(image), dhash(image)
+
+
+def hamming_distances(value, others):
+    """Number of differing bits between ``value`` and each 64-bit int in ``others``"""
+    xor = np.bitwise_xor(np.asarray(others, dtype=np.uint64), np.uint64(value))
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class ImageHashCache(LRUCache):
+    """LRU+TTL cache keyed on image signatures that also answers near matches.
+
+    Keys are ``(colour, dhash)`` pairs from ``image_signature``. ``lookup``
+    returns the entry with the same colour signature whose hash is within
+    ``max_distance`` bits of the query hash (exact matches first). The
+    candidate hashes are scanned with one vectorised XOR/popcount, which
+    stays cheap because the cache is bounded by ``max_entries``.
+    """
+
+    def __init__(self, max_entries=None, ttl=None, max_distance=None):
+        config = getattr(settings, 'AI_SEARCH_IMAGE_CACHE', {})
+        super().__init__(
+            max_entries if max_entries is not None else config.get('MAX_ENTRIES', 512),
+            ttl if ttl is not None else config.get('TTL', 3600),
+        )
+        self.max_distance = max_distance if max_distance is not None else config.get('MAX_DISTANCE', 4)
+
+    def lookup(self, signature):
+        """Return ``(matched_signature, value)``, or ``(signature, None)`` on a miss"""
+        value = self.get(signature, _MISSING)
+        if value is not _MISSING:
+            return signature, value
+        if self.max_distance <= 0:
+            return signature, None
+
+        colour, image_hash = signature
+        with self._lock:
+            # Another colourway of the same pattern must not count as a near match
+            keys = [key for key in self._data if key[0] == colour]
+        if not keys:
+            return signature, None
+        distances = hamming_distances(image_hash, [key[1] for key in keys])
+        nearest = int(np.argmin(distances))
+        if distances[nearest] > self.max_distance:
+            return signature, None
+
+        value = self.get(keys[nearest], _MISSING)
+        if value is _MISSING:
+            return signature, None
+        # The exact lookup above already counted a miss for this request
+        with self._lock:
+            self.misses -= 1
+        return keys[nearest], value
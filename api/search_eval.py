@@ -0,0 +1,205 @@
+"""
+Offline relevance and latency evaluation for ``AISearchService``.
+
+Replays a labelled query set against the current embedding index under one
+or more configurations (scoring weights, fusion method, exact or IVF search)
+and reports recall@k, nDCG@k, MRR and ranking latency for each, so weight
+changes are measured instead of guessed.
+
+The query set is JSONL, one query per line::
+
+    {"query": "áo thun nam", "relevant": [12, 40, 41]}
+    {"query": "giày", "image": "queries/sneaker.jpg", "relevant": [7], "grades": {"7": 2}}
+    {"image": "queries/dress.jpg", "relevant": [90, 91], "filters": {"in_stock": true}}
+
+``kind`` (text, image or combined) defaults from which of ``query`` and
+``image`` are present; ``grades`` gives graded relevance for nDCG (default 1);
+image paths are relative to the query file.
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image
+
+from .search_benchmark import latency_summary
+from .search_cache import ImageHashCache, QueryCache
+
+SEARCH_KINDS = ('text', 'image', 'combined')
+
+# Configurations evaluated when none are given: the live settings, then one
+# knob moved at a time
+DEFAULT_CONFIGS = [
+    {'name': 'baseline'},
+    {'name': 'no-lexical', 'scoring': {'LEXICAL_WEIGHT': 0.0}},
+    {'name': 'lexical-0.4', 'scoring': {'LEXICAL_WEIGHT': 0.4}},
+    {'name': 'no-category', 'scoring': {'CATEGORY_WEIGHT': 0.0}},
+    {'name': 'image-0.8', 'scoring': {'IMAGE_WEIGHT': 0.8, 'TEXT_WEIGHT': 0.2}},
+    {'name': 'text-0.6', 'scoring': {'IMAGE_WEIGHT': 0.4, 'TEXT_WEIGHT': 0.6}},
+    {'name': 'rrf', 'fusion': 'rrf'},
+    {'name': 'exact', 'ann': {'ENABLED': False}},
+]
+
+
+def load_queries(path):
+    """Parse a JSONL query set; raises ``ValueError`` naming the offending line"""
+    base_dir = os.path.dirname(os.path.abspath(path))
+    queries = []
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                text = (entry.get('query') or '').strip()
+                image_path = entry.get('image')
+                kind = entry.get('kind') or ('combined' if text and image_path else 'image' if image_path else 'text')
+                if kind not in SEARCH_KINDS:
+                    raise ValueError(f'unknown kind {kind!r}')
+                if kind != 'image' and not text:
+                    raise ValueError(f'{kind} queries need a "query"')
+                if kind != 'text' and not image_path:
+                    raise ValueError(f'{kind} queries need an "image"')
+                relevant = [int(product_id) for product_id in entry['relevant']]
+                if not relevant:
+                    raise ValueError('"relevant" is empty')
+                grades = {int(product_id): float(grade) for product_id, grade in (entry.get('grades') or {}).items()}
+                image = None
+                if image_path:
+                    with Image.open(os.path.join(base_dir, image_path)) as opened:
+                        image = opened.convert('RGB')
+            except (KeyError, TypeError, ValueError, OSError) as e:
+                raise ValueError(f'{path}:{line_number}: {e}')
+            queries.append({
+                'kind': kind,
+                'query': text,
+                'image': image,
+                'relevant': relevant,
+                'grades': {product_id: grades.get(product_id, 1.0) for product_id in relevant},
+                'filters': entry.get('filters') or None,
+            })
+    return queries
+
+
+def recall_at_k(ranked_ids, relevant, k):
+    return len(set(ranked_ids[:k]) & set(relevant)) / len(relevant)
+
+
+def ndcg_at_k(ranked_ids, grades, k):
+    """Normalised DCG with exponential gain; ``grades`` maps relevant ids to their grade"""
+    discounts = 1 / np.log2(np.arange(2, k + 2))
+    gains = np.array([2 ** grades.get(product_id, 0.0) - 1 for product_id in ranked_ids[:k]])
+    ideal = np.sort(2 ** np.array(list(grades.values())) - 1)[::-1][:k]
+    ideal_dcg = float(ideal @ discounts[:len(ideal)])
+    if ideal_dcg == 0:
+        return 0.0
+    return float(gains @ discounts[:len(gains)]) / ideal_dcg
+
+
+def reciprocal_rank(ranked_ids, relevant, k):
+    relevant = set(relevant)
+    for position, product_id in enumerate(ranked_ids[:k], start=1):
+        if product_id in relevant:
+            return 1 / position
+    return 0.0
+
+
+@contextmanager
+def evaluation_caches(service, query_count):
+    """Swap ``service``'s caches for private ones for the duration of an evaluation.
+
+    Ranked results are not cached at all: their keys leave out the scoring
+    weights, so a hit would report another configuration's ranking. Query
+    vectors are held for the whole query set, exact matches only, so the
+    models run once per query and latency measures ranking alone.
+    """
+    names = ('cache_text_results', 'text_results_cache', 'image_results_cache',
+             'query_embedding_cache', 'image_embedding_cache')
+    saved = {name: getattr(service, name) for name in names}
+    service.cache_text_results = False
+    service.text_results_cache = QueryCache('eval:text-results', max_entries=0, backend='')
+    service.image_results_cache = QueryCache('eval:image-results', max_entries=0, backend='')
+    service.query_embedding_cache = QueryCache('eval:text-vector', max_entries=query_count, ttl=0, backend='')
+    service.image_embedding_cache = ImageHashCache(max_entries=query_count, ttl=0, max_distance=0)
+    try:
+        yield service
+    finally:
+        for name, value in saved.items():
+            setattr(service, name, value)
+
+
+@contextmanager
+def configured(service, config):
+    """Apply ``config``'s ``scoring`` and ``ann`` overrides to ``service``"""
+    saved = (service.scoring, service.ann_config)
+    service.scoring = {**service.scoring, **config.get('scoring', {})}
+    service.ann_config = {**service.ann_config, **config.get('ann', {})}
+    try:
+        yield service
+    finally:
+        service.scoring, service.ann_config = saved
+
+
+def rank_query(service, entry, k, fusion='weighted'):
+    """Top ``k`` product ids for one query entry, or None when the service could not rank it"""
+    if entry['kind'] == 'text':
+        ranked = service.rank_text(entry['query'], k, entry['filters'])
+    elif entry['kind'] == 'image':
+        ranked = service.rank_image(entry['image'], k, entry['filters'])
+    else:
+        ranked = service.rank_combined(entry['image'], entry['query'], k, fusion, entry['filters'])
+    if ranked is None:
+        return None
+    return [int(product_id) for product_id in ranked[0][:k]]
+
+
+def evaluate(service, queries, configs=None, k=10, log=None):
+    """Replay ``queries`` under every configuration; yields one summary dict per configuration"""
+    log = log or (lambda message: None)
+    with evaluation_caches(service, len(queries)):
+        # One untimed pass embeds every query
+        for entry in queries:
+            rank_query(service, entry, k)
+        log(f'Embedded {len(queries)} queries')
+        for config in configs or DEFAULT_CONFIGS:
+            yield _evaluate_config(service, queries, config, k)
+
+
+def _evaluate_config(service, queries, config, k):
+    name = config.get('name') or json.dumps(config, sort_keys=True)
+    fusion = config.get('fusion', 'weighted')
+    metrics = {'recall': [], 'ndcg': [], 'mrr': []}
+    samples, failed = [], 0
+    with configured(service, config):
+        for entry in queries:
+            started_at = time.perf_counter()
+            ranked_ids = rank_query(service, entry, k, fusion)
+            samples.append((time.perf_counter() - started_at) * 1000)
+            if ranked_ids is None:
+                failed += 1
+                ranked_ids = []
+            metrics['recall'].append(recall_at_k(ranked_ids, entry['relevant'], k))
+            metrics['ndcg'].append(ndcg_at_k(ranked_ids, entry['grades'], k))
+            metrics['mrr'].append(reciprocal_rank(ranked_ids, entry['relevant'], k))
+    result = {
+        'config': name,
+        'queries': len(queries),
+        'failed': failed,
+        f'recall@{k}': round(float(np.mean(metrics['recall'])), 4),
+        f'ndcg@{k}': round(float(np.mean(metrics['ndcg'])), 4),
+        'mrr': round(float(np.mean(metrics['mrr'])), 4),
+        **latency_summary(samples),
+    }
+    by_kind = {}
+    for kind in SEARCH_KINDS:
+        rows = [i for i, entry in enumerate(queries) if entry['kind'] == kind]
+        if rows:
+            by_kind[kind] = {
+                'queries': len(rows),
+                f'recall@{k}': round(float(np.mean([metrics['recall'][i] for i in rows])), 4),
+                f'ndcg@{k}': round(float(np.mean([metrics['ndcg'][i] for i in rows])), 4),
+            }
+    result['by_kind'] = by_kind
+    return result
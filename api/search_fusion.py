@@ -0,0 +1,47 @@
+import numpy as np
+
+# Constant from the original reciprocal-rank-fusion paper; damps the
+# difference between the very top ranks
+RRF_K = 60
+
+
+def _union(branches):
+    ids = [np.asarray(product_ids, dtype=np.int64) for product_ids, _ in branches]
+    return np.unique(np.concatenate(ids)) if ids else np.empty(0, dtype=np.int64)
+
+
+def weighted_fusion(branches, weights):
+    """Fuse ``[(product_ids, scores), ...]`` by a weighted sum of scores.
+
+    A product missing from a branch contributes 0 for that branch. Returns
+    ``(product_ids, fused_scores)`` ordered best first.
+    """
+    all_ids = _union(branches)
+    fused = np.zeros(len(all_ids), dtype=np.float64)
+    for (product_ids, scores), weight in zip(branches, weights):
+        positions = np.searchsorted(all_ids, np.asarray(product_ids, dtype=np.int64))
+        fused[positions] += weight * np.asarray(scores, dtype=np.float64)
+    order = np.argsort(-fused, kind='stable')
+    return all_ids[order], fused[order]
+
+
+def reciprocal_rank_fusion(branches, weights, k=RRF_K):
+    """Fuse ranked lists by weighted reciprocal rank, ignoring raw score scales.
+
+    Scores are normalised so a product ranked first by every branch gets 1.0.
+    """
+    all_ids = _union(branches)
+    fused = np.zeros(len(all_ids), dtype=np.float64)
+    for (product_ids, _), weight in zip(branches, weights):
+        positions = np.searchsorted(all_ids, np.asarray(product_ids, dtype=np.int64))
+        fused[positions] += weight / (k + 1 + np.arange(len(positions)))
+    if len(branches):
+        fused /= sum(weights) / (k + 1)
+    order = np.argsort(-fused, kind='stable')
+    return all_ids[order], fused[order]
+
+
+FUSION_METHODS = {
+    'weighted': weighted_fusion,
+    'rrf': reciprocal_rank_fusion,
+}
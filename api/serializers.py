@@ -1,4 +1,8 @@
+import logging
+
 from rest_framework import serializers
+from django.db.models import Min, Prefetch, Sum, prefetch_related_objects
+from django.db.models.manager import BaseManager
 from api.models import Brand, Category, Product, Review, ShippingAddress, Order, OrderItem, PayboxWallet, PayboxTransaction, Favorite, Color, Size, ProductVariant
 from django.contrib.auth.models import User
 from django.utils import timezone
@@ -7,6 +11,8 @@ from api.models import RefundRequest
 
 from api.models import RefundRequest
 
+logger = logging.getLogger(__name__)
+
 
 class ReviewSerializer(serializers.ModelSerializer):
     product_name = serializers.SerializerMethodField(read_only=True)
@@ -94,45 +100,239 @@ class BrandSerializer(serializers.ModelSerializer):
         fields = ('id', 'title', 'description', 'featured_product', 'image')
 
 
-class ProductSerializer(serializers.ModelSerializer):
-    reviews = ReviewSerializer(read_only=True, many=True, source='review_set')
+def split_names(value):
+    """Names in a comma-separated ``?fields=``/``?expand=`` value or list"""
+    if not value:
+        return set()
+    values = value if isinstance(value, (list, tuple, set)) else str(value).split(',')
+    return {name.strip() for name in values if name.strip()}
+
+
+class SparseFieldsetMixin:
+    """``fields`` keeps only the named fields; ``expand`` adds relations from ``Meta.expandable_fields``.
+
+    Both are taken from keyword arguments or, failing that, from the
+    request's ``?fields=`` and ``?expand=`` query parameters.
+    """
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        params = getattr(self.context.get('request'), 'query_params', {})
+        fields = split_names(fields if fields is not None else params.get('fields'))
+        expand = split_names(expand if expand is not None else params.get('expand'))
+        for name, field in getattr(self.Meta, 'expandable_fields', {}).items():
+            if name in expand:
+                self.fields[name] = field()
+        if fields:
+            for name in set(self.fields) - fields - expand:
+                self.fields.pop(name)
+
+
+class ProductCollectionSerializer(serializers.ListSerializer):
+    """List of products that warns when each product would load its variants separately"""
+
+    def to_representation(self, data):
+        products = data.all() if isinstance(data, BaseManager) else data
+        first = next(iter(products), None)
+        if (
+            first is not None
+            and not hasattr(first, 'variant_min_price')
+            and 'variants' not in getattr(first, '_prefetched_objects_cache', {})
+        ):
+            logger.warning(
+                f"{type(self.child).__name__} got products without product_list_queryset annotations; "
+                f"variant prices and stock cost one query per product"
+            )
+        return super().to_representation(products)
+
+
+class ProductListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Slim product for lists, chat suggestions and favourites; expects ``product_list_queryset`` products.
+
+    ``?expand=`` adds ``reviews``, ``variants``, ``available_colors``,
+    ``available_sizes``, or nests ``brand`` / ``category`` in place of their ids.
+    """
     is_favorite = serializers.SerializerMethodField()
-    variants = ProductVariantSerializer(read_only=True, many=True)
-    available_colors = serializers.SerializerMethodField()
-    available_sizes = serializers.SerializerMethodField()
     min_price = serializers.SerializerMethodField()
     total_stock = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
-        fields = ('id', 'name', 'image', 'brand', 'category', 'description',
-                  'rating', 'numReviews', 'price', 'countInStock', 'createdAt',
-                  'reviews', 'is_favorite', 'total_sold', 'has_variants', 'variants',
-                  'available_colors', 'available_sizes', 'min_price', 'total_stock')
+        fields = ('id', 'name', 'image', 'brand', 'category', 'rating', 'numReviews',
+                  'price', 'min_price', 'countInStock', 'total_stock', 'total_sold',
+                  'has_variants', 'is_favorite', 'createdAt')
+        list_serializer_class = ProductCollectionSerializer
+        expandable_fields = {
+            'brand': lambda: BrandSerializer(read_only=True),
+            'category': lambda: CategorySerializer(read_only=True),
+            'reviews': lambda: ReviewSerializer(read_only=True, many=True, source='review_set'),
+            'variants': lambda: ProductVariantSerializer(read_only=True, many=True),
+            'available_colors': serializers.SerializerMethodField,
+            'available_sizes': serializers.SerializerMethodField,
+        }
 
     def get_is_favorite(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return Favorite.objects.filter(user=request.user, product=obj).exists()
-        return False
+        return obj.id in favorite_product_ids(self.context.get('request'))
 
     def get_available_colors(self, obj):
         if obj.has_variants:
-            colors = Color.objects.filter(productvariant__product=obj).distinct()
-            return ColorSerializer(colors, many=True).data
+            colors = {variant.color.id: variant.color for variant in product_variants(obj)}
+            return ColorSerializer(sorted(colors.values(), key=lambda color: color.id), many=True).data
         return []
 
     def get_available_sizes(self, obj):
         if obj.has_variants:
-            sizes = Size.objects.filter(productvariant__product=obj).distinct().order_by('order', 'name')
-            return SizeSerializer(sizes, many=True).data
+            sizes = {variant.size.id: variant.size for variant in product_variants(obj)}
+            return SizeSerializer(sorted(sizes.values(), key=lambda size: (size.order, size.name)), many=True).data
         return []
 
     def get_min_price(self, obj):
-        return obj.get_min_price()
+        if obj.has_variants:
+            if hasattr(obj, 'variant_min_price'):
+                min_price = obj.variant_min_price
+            else:
+                min_price = min((variant.price for variant in product_variants(obj)), default=None)
+            return min_price if min_price is not None else obj.price
+        return obj.price
 
     def get_total_stock(self, obj):
-        return obj.get_total_stock()
+        if obj.has_variants:
+            if hasattr(obj, 'variant_stock'):
+                return obj.variant_stock or 0
+            return sum(variant.stock_quantity for variant in product_variants(obj))
+        return obj.countInStock
+
+
+class ProductSerializer(ProductListSerializer):
+    """Full product with reviews and variants, for the detail page and admin writes"""
+    reviews = ReviewSerializer(read_only=True, many=True, source='review_set')
+    variants = ProductVariantSerializer(read_only=True, many=True)
+    available_colors = serializers.SerializerMethodField()
+    available_sizes = serializers.SerializerMethodField()
+
+    class Meta(ProductListSerializer.Meta):
+        fields = ('id', 'name', 'image', 'brand', 'category', 'description',
+                  'rating', 'numReviews', 'price', 'countInStock', 'createdAt',
+                  'reviews', 'is_favorite', 'total_sold', 'has_variants', 'variants',
+                  'available_colors', 'available_sizes', 'min_price', 'total_stock')
+        expandable_fields = {
+            'brand': ProductListSerializer.Meta.expandable_fields['brand'],
+            'category': ProductListSerializer.Meta.expandable_fields['category'],
+        }
+
+
+def favorite_product_ids(request):
+    """Ids of the products the request's user has favourited, loaded in one query per request"""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return frozenset()
+    product_ids = getattr(request, '_favorite_product_ids', None)
+    if product_ids is None:
+        product_ids = frozenset(Favorite.objects.filter(user=user).values_list('product_id', flat=True))
+        request._favorite_product_ids = product_ids
+    return product_ids
+
+
+def forget_favorite_product_ids(request):
+    """Drop the request's cached favourites after it changed them"""
+    request._favorite_product_ids = None
+
+
+def product_detail_queryset(queryset=None):
+    """Products with everything ProductSerializer reads in a fixed number of queries.
+
+    Reviews and variants (with their colour and size) are prefetched and
+    favourites come from ``favorite_product_ids``, so a page costs the same
+    handful of queries however many products it holds.
+    """
+    if queryset is None:
+        queryset = Product.objects.all()
+    return queryset.prefetch_related(
+        Prefetch('review_set', queryset=Review.objects.select_related('user')),
+        Prefetch('variants', queryset=ProductVariant.objects.select_related('color', 'size')),
+    )
+
+
+def product_list_queryset(queryset=None, expand=()):
+    """Products for ProductListSerializer: variant price and stock annotated, expansions joined or prefetched"""
+    if queryset is None:
+        queryset = Product.objects.all()
+    queryset = queryset.annotate(
+        variant_min_price=Min('variants__price'),
+        variant_stock=Sum('variants__stock_quantity'),
+    )
+    expand = split_names(expand)
+    related = [name for name in ('brand', 'category') if name in expand]
+    if related:
+        queryset = queryset.select_related(*related)
+    if 'reviews' in expand:
+        queryset = queryset.prefetch_related(Prefetch('review_set', queryset=Review.objects.select_related('user')))
+    if expand & {'variants', 'available_colors', 'available_sizes'}:
+        queryset = queryset.prefetch_related(
+            Prefetch('variants', queryset=ProductVariant.objects.select_related('color', 'size'))
+        )
+    return queryset
+
+
+def product_list_instances(products):
+    """``products`` (a queryset or instances) reloaded through ``product_list_queryset`` in one query, in order.
+
+    For product lists built by code that cannot annotate its own queryset,
+    such as the chat suggestions.
+    """
+    products = list(products)
+    loaded = product_list_queryset().in_bulk([product.id for product in products])
+    return [loaded[product.id] for product in products if product.id in loaded]
+
+
+def product_variants(product):
+    """``product``'s variants with colour and size, prefetching them once if the queryset did not"""
+    if 'variants' not in getattr(product, '_prefetched_objects_cache', {}):
+        prefetch_related_objects(
+            [product], Prefetch('variants', queryset=ProductVariant.objects.select_related('color', 'size'))
+        )
+    return product.variants.all()
+
+
+def search_card_queryset(queryset=None):
+    """Products with everything ProductSearchCardSerializer reads, fetched in one query"""
+    if queryset is None:
+        queryset = Product.objects.all()
+    return queryset.only(
+        'id', 'name', 'image', 'price', 'rating', 'numReviews', 'countInStock', 'has_variants'
+    ).annotate(
+        variant_min_price=Min('variants__price'),
+        variant_stock=Sum('variants__stock_quantity'),
+    )
+
+
+class ProductSearchCardSerializer(serializers.ModelSerializer):
+    """Compact product card for search results; expects ``search_card_queryset`` products.
+
+    ``score``, ``compatibility_percent`` and ``matched_variant`` (the variant
+    whose image matched an image query) are read from attributes the search
+    view sets on each product.
+    """
+    min_price = serializers.SerializerMethodField()
+    in_stock = serializers.SerializerMethodField()
+    score = serializers.FloatField(source='search_score', read_only=True, default=None)
+    compatibility_percent = serializers.IntegerField(read_only=True, default=None)
+    matched_variant = serializers.IntegerField(source='matched_variant_id', read_only=True, default=None)
+
+    class Meta:
+        model = Product
+        fields = ('id', 'name', 'image', 'price', 'min_price', 'rating', 'numReviews',
+                  'in_stock', 'score', 'compatibility_percent', 'matched_variant')
+
+    def get_min_price(self, obj):
+        if obj.has_variants and obj.variant_min_price is not None:
+            return obj.variant_min_price
+        return obj.price
+
+    def get_in_stock(self, obj):
+        if obj.has_variants:
+            return (obj.variant_stock or 0) > 0
+        return (obj.countInStock or 0) > 0
 
 
 class UserSerializer(serializers.ModelSerializer):
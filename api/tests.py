@@ -1,3 +1,1263 @@
-# from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from PIL import Image
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from api import catalog_filters, lexical_index
+from api.ai_search import AISearchService
+from api.warmup import warm_up_ai_search
+from api.ann_index import IVFIndex, recall_report
+from api.catalog_facets import facet_counts, filter_catalog_queryset
+from api.catalog_filters import (
+    CatalogFilterIndex, get_catalog_filters, price_bucket_index, product_attributes, set_catalog_filters,
+)
+from api.embedding_index import EmbeddingIndex, IndexLoader, normalize_rows, storage_report
+from api.inference_executor import InferenceExecutor, InferenceRejected, InferenceTimeout
+from api.keyword_matcher import LEXICONS, KeywordMatcher, keyword_matcher
+from api.lexical_index import LexicalIndex, get_lexical_index, reset_lexical_index
+from api.models import Brand, Category, Color, Favorite, Product, ProductVariant, Review, Size
+from api.search_benchmark import MockEmbeddingModels, run_benchmark
+from api.search_cache import (
+    ImageHashCache, LRUCache, QueryCache, SharedVersion, dhash, hamming_distances, image_signature,
+)
+from api.search_eval import evaluate, load_queries, ndcg_at_k, recall_at_k
+from api.search_fusion import FUSION_METHODS
+
+
+class ProductListQueryCountTests(TestCase):
+    """The product list must cost the same number of queries however many products it returns"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shopper', 'shopper@example.com', 'secret')
+        cls.brand = Brand.objects.create(title='Brand')
+        cls.category = Category.objects.create(title='Category', description='')
+        cls.colors = [Color.objects.create(name=name, hex_code='#000000') for name in ('Đen', 'Trắng')]
+        cls.sizes = [Size.objects.create(name=name, order=order) for order, name in enumerate(('M', 'L'))]
+
+    def create_products(self, count):
+        for _ in range(count):
+            number = Product.objects.count() + 1
+            product = Product.objects.create(
+                name=f'Product {number}', brand=self.brand, category=self.category,
+                price=100000, countInStock=5, has_variants=number % 2 == 0,
+            )
+            if product.has_variants:
+                for color in self.colors:
+                    for size in self.sizes:
+                        ProductVariant.objects.create(
+                            product=product, color=color, size=size, price=90000 + size.order, stock_quantity=3,
+                        )
+            Review.objects.create(product=product, user=self.user, name='shopper', rating=5, comment='ok')
+            if number % 3 == 0:
+                Favorite.objects.create(user=self.user, product=product)
+
+    def list_queries(self, client, query=''):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(f'/api/products/{query}', HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def assert_constant_queries(self, client, expected):
+        self.create_products(2)
+        small_count, _ = self.list_queries(client)
+        self.create_products(10)
+        large_count, products = self.list_queries(client)
+        self.assertEqual(len(products), 12)
+        self.assertEqual(small_count, large_count)
+        self.assertEqual(large_count, expected)
+        return products
+
+    def test_anonymous_list(self):
+        # Products, reviews, variants with colour and size
+        products = self.assert_constant_queries(APIClient(), 3)
+        with_variants = next(product for product in products if product['has_variants'])
+        self.assertEqual([color['name'] for color in with_variants['available_colors']], ['Đen', 'Trắng'])
+        self.assertEqual([size['name'] for size in with_variants['available_sizes']], ['M', 'L'])
+        self.assertEqual(with_variants['min_price'], 90000)
+        self.assertEqual(with_variants['total_stock'], 12)
+        self.assertEqual(len(with_variants['reviews']), 1)
+        self.assertFalse(any(product['is_favorite'] for product in products))
+
+    def test_slim_list_and_sparse_fieldsets(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.create_products(2)
+        small_count, _ = self.list_queries(client, '?page_size=50')
+        self.create_products(10)
+        # Products with variant price and stock annotated, then the user's favourites
+        large_count, page = self.list_queries(client, '?page_size=50')
+        self.assertEqual((small_count, large_count), (2, 2))
+        product = page['results'][0]
+        self.assertNotIn('reviews', product)
+        self.assertNotIn('variants', product)
+        self.assertIn('min_price', product)
+
+        with_variants = Product.objects.filter(has_variants=True).first()
+        queries, products = self.list_queries(client, '?fields=id,name,brand&expand=brand,variants')
+        # Products and their variants; is_favorite was not asked for, so no favourites query
+        self.assertEqual(queries, 2)
+        product = next(product for product in products if product['id'] == with_variants.id)
+        self.assertEqual(set(product), {'id', 'name', 'brand', 'variants'})
+        self.assertEqual(product['brand']['title'], 'Brand')
+        self.assertEqual(len(product['variants']), 4)
+
+        response = client.get(f'/api/products/{with_variants.id}/?fields=id,description', HTTP_HOST='localhost')
+        self.assertEqual(set(response.json()), {'id', 'description'})
+
+    def test_chat_suggestions_query_count(self):
+        def suggestion_queries():
+            client = APIClient()
+            client.force_authenticate(User.objects.get(id=self.user.id))
+            with CaptureQueriesContext(connection) as queries:
+                response = client.post('/ai/recommendations/products/', {'query': 'product', 'limit': 10},
+                                       format='json', HTTP_HOST='localhost')
+            self.assertEqual(response.status_code, 200)
+            return len(queries), response.json()['products']
+
+        self.create_products(2)
+        small_count, _ = suggestion_queries()
+        self.create_products(6)
+        with self.assertNoLogs('api.serializers', 'WARNING'):
+            large_count, products = suggestion_queries()
+        # Preferences, the search and one annotated reload of the suggestions
+        self.assertEqual((small_count, large_count), (3, 3))
+        self.assertEqual(len(products), 8)
+        with_variants = next(product for product in products if product['has_variants'])
+        self.assertEqual((float(with_variants['min_price']), with_variants['total_stock']), (90000, 12))
+
+    def test_authenticated_list(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        # Plus one query for the user's favourite ids, however many products are listed
+        products = self.assert_constant_queries(client, 4)
+        favorites = set(Favorite.objects.filter(user=self.user).values_list('product_id', flat=True))
+        self.assertEqual({product['id'] for product in products if product['is_favorite']}, favorites)
+
+
+class ProductKeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(title='Brand')
+        category = Category.objects.create(title='Category', description='')
+        # Repeated and missing prices exercise the id tie-break and NULL ordering
+        for number in range(23):
+            Product.objects.create(
+                name=f'Product {number}', brand=brand, category=category,
+                price=None if number % 7 == 0 else (number % 4) * 1000, total_sold=number % 3,
+            )
+
+    def walk(self, client, url, direction):
+        ids, pages = [], 0
+        while url:
+            response = client.get(url, HTTP_HOST='localhost')
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            page_ids = [product['id'] for product in page['results']]
+            ids = ids + page_ids if direction == 'next' else page_ids + ids
+            url, pages = page[direction], pages + 1
+        return ids, pages, page
+
+    def test_walks_every_ordering_both_ways(self):
+        client = APIClient()
+        for ordering in ('-createdAt', 'price', '-price', 'total_sold', '-rating'):
+            field, descending = ordering.lstrip('-'), ordering.startswith('-')
+            products = sorted(Product.objects.values('id', field), key=lambda row: row['id'], reverse=descending)
+            # NULLs sort after every value ascending and before every value descending
+            expected = [row['id'] for row in sorted(
+                products, key=lambda row: (row[field] is None, row[field] or 0), reverse=descending,
+            )]
+            forward, pages, last_page = self.walk(client, f'/api/products/?ordering={ordering}&page_size=5', 'next')
+            self.assertEqual(forward, expected, ordering)
+            self.assertEqual(pages, 5)
+            backward, _, _ = self.walk(client, last_page['previous'], 'previous')
+            self.assertEqual(backward + [product['id'] for product in last_page['results']], expected, ordering)
+
+    def test_page_size_cap_and_bad_input(self):
+        client = APIClient()
+        with self.settings(PRODUCT_PAGINATION={'PAGE_SIZE': 4, 'MAX_PAGE_SIZE': 10}):
+            self.assertEqual(len(client.get('/api/products/?page_size=50', HTTP_HOST='localhost').json()['results']), 10)
+            self.assertEqual(len(client.get('/api/products/?ordering=price', HTTP_HOST='localhost').json()['results']), 4)
+        self.assertEqual(client.get('/api/products/?ordering=name', HTTP_HOST='localhost').status_code, 400)
+        self.assertEqual(client.get('/api/products/?cursor=bogus', HTTP_HOST='localhost').status_code, 404)
+        # Without pagination parameters the list stays a bare array
+        self.assertEqual(len(client.get('/api/products/', HTTP_HOST='localhost').json()), 23)
+
+
+class CatalogFacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.brands = [Brand.objects.create(title=title) for title in ('Alpha', 'Beta')]
+        cls.categories = [Category.objects.create(title=title, description='') for title in ('Áo', 'Quần')]
+        cls.red, cls.blue = (Color.objects.create(name=name, hex_code='#000000') for name in ('Đỏ', 'Xanh'))
+        cls.small, cls.large = (Size.objects.create(name=name, order=order) for order, name in enumerate(('S', 'L')))
+        for number in range(12):
+            product = Product.objects.create(
+                name=f'Product {number}', brand=cls.brands[number % 2], category=cls.categories[number % 3 == 0],
+                price=150000 + number * 100000, countInStock=number % 4, has_variants=number < 6,
+            )
+            if product.has_variants:
+                # Red/S in stock for every variant product; Blue/L only for even ones, out of stock
+                ProductVariant.objects.create(product=product, color=cls.red, size=cls.small,
+                                              price=product.price, stock_quantity=2)
+                if number % 2 == 0:
+                    ProductVariant.objects.create(product=product, color=cls.blue, size=cls.large,
+                                                  price=product.price, stock_quantity=0)
+
+    def catalog(self, query=''):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get(f'/api/catalog/?{query}', HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(queries)
+
+    def counts(self, data, facet):
+        return {row['id']: row['count'] for row in data['facets'][facet] if row['count']}
+
+    def test_facets_ignore_their_own_filter(self):
+        data, queries = self.catalog(f'brand={self.brands[0].id}&color={self.blue.id}&page_size=2')
+        even = [number for number in range(6) if number % 2 == 0]
+        self.assertEqual(data['count'], len(even))
+        self.assertEqual(len(data['results']), 2)
+        self.assertIsNotNone(data['next'])
+        # Brand counts keep the colour filter, not the brand filter
+        self.assertEqual(self.counts(data, 'brand'), {self.brands[0].id: 3})
+        # Colour counts keep the brand filter, not the colour filter
+        self.assertEqual(self.counts(data, 'color'), {self.red.id: 3, self.blue.id: 3})
+        # Colour and size must hold on the same variant
+        self.assertEqual(self.counts(data, 'size'), {self.large.id: 3})
+        self.assertEqual(sum(row['count'] for row in data['facets']['price_bucket']), 3)
+        # The page with its annotations, the total and five facets
+        _, more_queries = self.catalog(f'brand={self.brands[0].id}&color={self.blue.id}&page_size=50')
+        self.assertEqual(queries, more_queries)
+        self.assertEqual(queries, 7)
+
+    def test_in_stock_applies_to_matching_variant(self):
+        data, _ = self.catalog(f'color={self.blue.id}&in_stock=true')
+        self.assertEqual(data['count'], 0)
+        data, _ = self.catalog('price_bucket=1&ordering=price')
+        prices = [product['price'] for product in data['results']]
+        self.assertEqual(prices, sorted(prices))
+        self.assertTrue(all(200000 <= float(price) < 500000 for price in prices))
+        self.assertEqual(APIClient().get('/api/catalog/?brand=x', HTTP_HOST='localhost').status_code, 400)
+
+    def test_prices_match_the_search_filter_index(self):
+        sale = Product.objects.create(name='Sale', brand=self.brands[0], category=self.categories[0],
+                                      price=900000, has_variants=True)
+        ProductVariant.objects.create(product=sale, color=self.red, size=self.large, price=300000, stock_quantity=1)
+        # Priced at the cheapest variant, like the AI search bitmasks and the cards
+        buckets = {product_id: int(price_bucket_index(price)) for product_id, _, _, price, _ in product_attributes()}
+        self.assertEqual(buckets[sale.id], 1)
+        for bucket in range(5):
+            products = filter_catalog_queryset(Product.objects.all(), {'price_bucket': [bucket]})
+            self.assertEqual(
+                set(products.values_list('id', flat=True)),
+                {product_id for product_id, product_bucket in buckets.items() if product_bucket == bucket},
+            )
+        self.assertEqual(
+            {row['id']: row['count'] for row in facet_counts({})['price_bucket']},
+            {bucket: list(buckets.values()).count(bucket) for bucket in range(5)},
+        )
+        cheap = filter_catalog_queryset(Product.objects.all(), {'min_price': 250000, 'max_price': 350000})
+        self.assertIn(sale, cheap)
+
+
+class FavoriteIdsTests(TestCase):
+    def test_batch_lookup(self):
+        user = User.objects.create_user('fan', 'fan@example.com', 'secret')
+        brand = Brand.objects.create(title='Brand')
+        category = Category.objects.create(title='Category', description='')
+        products = [Product.objects.create(name=f'P{i}', brand=brand, category=category, price=1) for i in range(4)]
+        for product in products[1:3]:
+            Favorite.objects.create(user=user, product=product)
+        client = APIClient()
+        client.force_authenticate(user)
+        ids = ','.join(str(product.id) for product in products[:2])
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(f'/api/favorites/ids/?ids={ids}', HTTP_HOST='localhost')
+        self.assertEqual(response.json(), {'favorites': [products[1].id]})
+        self.assertEqual(len(queries), 1)
+        response = client.post('/api/favorites/ids/', {'ids': [product.id for product in products]},
+                               format='json', HTTP_HOST='localhost')
+        self.assertEqual(response.json(), {'favorites': [products[1].id, products[2].id]})
+        self.assertEqual(client.get('/api/favorites/ids/?ids=x', HTTP_HOST='localhost').status_code, 400)
+        self.assertEqual(APIClient().get('/api/favorites/ids/', HTTP_HOST='localhost').status_code, 401)
+
+
+def embeddings_cache(count=60, dim=16, seed=0):
+    """``EmbeddingIndex.from_cache`` input with random vectors.
+
+    Every third product also has two variant images and every fifth has no
+    main image, so products 5, 10, ... without variants are not searchable
+    by image at all.
+    """
+    rng = np.random.default_rng(seed)
+    cache = {}
+    for product_id in range(1, count + 1):
+        variants = list(rng.normal(size=(2, dim))) if product_id % 3 == 0 else []
+        cache[f'product_{product_id}'] = {
+            'product_id': product_id,
+            'image_embedding': None if product_id % 5 == 0 else rng.normal(size=dim),
+            'variant_ids': [product_id * 10 + number for number in range(len(variants))],
+            'variant_embeddings': variants,
+            'text_embedding': rng.normal(size=dim),
+            'product_text': f'Product {product_id}',
+            'fingerprint': f'{product_id:040d}',
+        }
+    return cache
+
+
+def brute_force_search(cache, kind, query, limit, product_ids=None):
+    """Reference ranking: one cosine per stored vector, a product scored by its best image"""
+    query = np.asarray(query, dtype=np.float64)
+    scores = {}
+    for data in cache.values():
+        if product_ids is not None and data['product_id'] not in product_ids:
+            continue
+        vectors = [] if data[f'{kind}_embedding'] is None else [data[f'{kind}_embedding']]
+        if kind == 'image':
+            vectors += data['variant_embeddings']
+        if vectors:
+            scores[data['product_id']] = max(
+                float(vector @ query / (np.linalg.norm(vector) * np.linalg.norm(query))) for vector in vectors
+            )
+    ranked = sorted(scores.items(), key=lambda item: -item[1])[:limit]
+    return [product_id for product_id, _ in ranked], [score for _, score in ranked]
+
+
+class EmbeddingIndexSearchTests(SimpleTestCase):
+    """Vectorised search must rank exactly like a per-product cosine loop"""
+
+    def setUp(self):
+        self.cache = embeddings_cache()
+        self.index = EmbeddingIndex.from_cache(self.cache)
+        self.queries = np.random.default_rng(1).normal(size=(5, 16))
+
+    def assert_same_ranking(self, kind, mask=None, product_ids=None):
+        for query in self.queries:
+            found_ids, found_scores = self.index.search(kind, query, 10, mask=mask)
+            expected_ids, expected_scores = brute_force_search(self.cache, kind, query, 10, product_ids)
+            self.assertEqual(found_ids.tolist(), expected_ids)
+            np.testing.assert_allclose(found_scores, expected_scores, atol=1e-5)
+
+    def test_text_and_image_search(self):
+        self.assert_same_ranking('text')
+        # An image score is the best of the main image and the variant images
+        self.assert_same_ranking('image')
+        self.assertEqual(len(self.index.search('image', self.queries[0], 100)[0]), 52)
+
+    def test_mask_limits_the_scored_rows(self):
+        even = self.index.product_ids % 2 == 0
+        self.assert_same_ranking('image', mask=even, product_ids=set(range(2, 61, 2)))
+
+    def test_matching_variant(self):
+        variant = self.cache['product_6']['variant_embeddings'][1]
+        self.assertEqual(self.index.search('image', variant, 1)[0].tolist(), [6])
+        self.assertEqual(self.index.matching_variants(variant, [6, 7]), [61, None])
+
+
+class EmbeddingIndexFileTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'embeddings.idx')
+        self.index = EmbeddingIndex.from_cache(embeddings_cache())
+
+    def test_save_and_load_round_trip(self):
+        self.assertEqual(self.index.save(self.path, 'clip', 'text')['version'], 1)
+        loaded = EmbeddingIndex.load(self.path)
+        self.assertIsInstance(loaded.image_vectors, np.memmap)
+        self.assertEqual(loaded.header['count'], 60)
+        for name, array in self.index.arrays().items():
+            np.testing.assert_array_equal(loaded.arrays()[name], array, err_msg=name)
+        self.assertEqual(loaded.product_text(2), 'product 3')
+        query = self.index.dense('image', [0])[0]
+        self.assertEqual(loaded.search('image', query, 5)[0].tolist(), self.index.search('image', query, 5)[0].tolist())
+        # Rewriting the file bumps its version
+        self.assertEqual(self.index.save(self.path, 'clip', 'text')['version'], 2)
+
+    def test_loader_reopens_only_changed_files(self):
+        loader = IndexLoader(self.path, 'clip', 'text')
+        self.assertEqual(len(loader.get()), 0)
+        self.index.save(self.path, 'clip', 'text')
+        first = loader.get()
+        self.assertEqual((len(first), loader.version), (60, 1))
+        self.assertIs(loader.get(), first)
+        self.index.save(self.path, 'clip', 'text')
+        self.assertEqual(loader.get().header['version'], 2)
+        # A file built with other models is ignored and the last good index kept
+        self.index.save(self.path, 'other-clip', 'text')
+        with self.assertLogs('api.embedding_index', 'WARNING'):
+            self.assertEqual(loader.get().header['version'], 2)
+
+
+class SearchCacheTests(SimpleTestCase):
+    def test_lru_eviction_and_ttl(self):
+        cache = LRUCache(max_entries=2, ttl=60)
+        with mock.patch('api.search_cache.time.monotonic', return_value=1000.0) as clock:
+            cache.set('a', 1)
+            cache.set('b', 2)
+            self.assertEqual(cache.get('a'), 1)
+            # 'b' is now the least recently used entry
+            cache.set('c', 3)
+            self.assertIsNone(cache.get('b'))
+            clock.return_value = 1061.0
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 2)
+
+    def test_query_cache_is_shared_between_workers(self):
+        first = QueryCache('tests:query-cache', backend='default')
+        first.set(('áo khoác', 'v1'), [3, 1, 2])
+        second = QueryCache('tests:query-cache', backend='default')
+        self.assertEqual(second.get(('áo khoác', 'v1')), [3, 1, 2])
+        self.assertIsNone(second.get(('áo khoác', 'v2')))
+        self.assertEqual((second.stats()['shared_hits'], second.stats()['misses']), (1, 1))
+        # Without a shared backend each process only sees its own entries
+        self.assertIsNone(QueryCache('tests:query-cache', backend='').get(('áo khoác', 'v1')))
+
+
+def photo(seed, size=96):
+    """Smooth random RGB image, standing in for a product photo"""
+    pixels = np.random.default_rng(seed).integers(0, 256, size=(6, 6, 3), dtype=np.uint8)
+    return Image.fromarray(pixels).resize((size, size), Image.BICUBIC)
+
+
+class ImageHashCacheTests(SimpleTestCase):
+    def test_reencoded_copy_hashes_close(self):
+        original = photo(0)
+        buffer = io.BytesIO()
+        original.resize((200, 200)).save(buffer, format='JPEG', quality=70)
+        copy = Image.open(io.BytesIO(buffer.getvalue()))
+        self.assertLessEqual(hamming_distances(dhash(original), [dhash(copy)])[0], 4)
+        self.assertGreater(hamming_distances(dhash(original), [dhash(photo(1))])[0], 4)
+
+    def test_lookup_returns_near_matches(self):
+        cache = ImageHashCache(max_entries=8, ttl=60, max_distance=4)
+        cache.set((5, 0b1011), 'embedding')
+        self.assertEqual(cache.lookup((5, 0b1011)), ((5, 0b1011), 'embedding'))
+        self.assertEqual(cache.lookup((5, 0b0011)), ((5, 0b1011), 'embedding'))
+        self.assertEqual(cache.lookup((5, 0b1111 << 8)), ((5, 0b1111 << 8), None))
+        self.assertEqual(cache.lookup((6, 0b1011)), ((6, 0b1011), None))
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+    def test_colourways_do_not_share_an_entry(self):
+        pattern = np.asarray(photo(0).convert('L'), dtype=np.uint8)
+        red, blue = (np.zeros(pattern.shape + (3,), dtype=np.uint8) for _ in range(2))
+        red[..., 0] = pattern
+        blue[..., 2] = pattern
+        red, blue = Image.fromarray(red), Image.fromarray(blue)
+        # Same print, so brightness alone cannot tell them apart
+        self.assertLessEqual(hamming_distances(dhash(red), [dhash(blue)])[0], 4)
+
+        cache = ImageHashCache(max_entries=8, ttl=60, max_distance=4)
+        cache.set(image_signature(red), 'red embedding')
+        self.assertEqual(cache.lookup(image_signature(red))[1], 'red embedding')
+        self.assertIsNone(cache.lookup(image_signature(blue))[1])
+
+
+class IVFIndexTests(SimpleTestCase):
+    def clustered_index(self, count=1000, dim=32, clusters=25):
+        rng = np.random.default_rng(2)
+        centers = rng.normal(size=(clusters, dim))
+        vectors = normalize_rows(centers[rng.integers(0, clusters, count)] + 0.3 * rng.normal(size=(count, dim)))
+        return EmbeddingIndex(np.arange(1, count + 1), vectors, vectors)
+
+    def test_recall_against_exact_search(self):
+        index = self.clustered_index()
+        ann = IVFIndex.build(index.vectors('text'), index.text_mask)
+        self.assertEqual(ann.nlist, 31)
+        self.assertEqual(len(ann.list_rows), 1000)
+        report = recall_report(index, 'text', ann, nprobe_values=(2, ann.nlist), queries=50)
+        self.assertGreaterEqual(report[0]['recall@10'], 0.9)
+        # Probing every list is exact search
+        self.assertEqual(report[1]['recall@10'], 1.0)
+
+    def test_save_and_load(self):
+        index = self.clustered_index(count=200)
+        ann = IVFIndex.build(index.vectors('image'), index.image_mask, nlist=6)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'image.ivf')
+            ann.save(path, {'index_version': 3, 'embedding': 'image'})
+            loaded = IVFIndex.load(path)
+            self.assertEqual(loaded.header['index_version'], 3)
+            query = index.vectors('image')[0]
+            np.testing.assert_array_equal(
+                loaded.candidate_rows(index, 'image', query, nprobe=2),
+                ann.candidate_rows(index, 'image', query, nprobe=2),
+            )
+
+    def test_variant_images_are_bucketed(self):
+        index = EmbeddingIndex.from_cache(embeddings_cache())
+        ann = IVFIndex.build(
+            index.vectors('image'), index.image_mask, nlist=6,
+            extra_vectors=index.variant_vectors, extra_rows=index.variant_owner_rows(),
+        )
+        self.assertEqual(len(ann.list_rows), int(index.image_mask.sum()) + len(index.variant_ids))
+        # A variant image sits under its product, so the variant's own list leads back to it
+        variant = index.dense('variant', [1])[0]
+        self.assertIn(2, ann.candidate_rows(index, 'image', variant, nprobe=1))
+
+
+class SearchFusionTests(SimpleTestCase):
+    branches = [([7, 3, 5], [0.9, 0.5, 0.1]), ([3, 8], [0.8, 0.4])]
+
+    def test_weighted_sum(self):
+        product_ids, scores = FUSION_METHODS['weighted'](self.branches, [0.6, 0.4])
+        # A product missing from a branch gets nothing from it
+        self.assertEqual(product_ids.tolist(), [3, 7, 8, 5])
+        np.testing.assert_allclose(scores, [0.6 * 0.5 + 0.4 * 0.8, 0.54, 0.16, 0.06])
+
+    def test_reciprocal_rank(self):
+        product_ids, scores = FUSION_METHODS['rrf']([([3, 7], [0.2, 0.1]), ([3, 8], [50.0, 1.0])], [1.0, 1.0])
+        self.assertEqual(product_ids.tolist()[0], 3)
+        # First in every branch scores 1.0, whatever the raw score scales
+        self.assertAlmostEqual(scores[0], 1.0)
+        self.assertAlmostEqual(scores[1], scores[2])
+
+
+class LexicalIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = LexicalIndex()
+        self.index.add(1, {'name': 'Áo khoác nam', 'description': 'Chống nước'})
+        self.index.add(2, {'name': 'Quần jean', 'description': 'Dễ phối với áo khoác'})
+        self.index.add(3, {'name': 'Ảo ảnh', 'brand': 'Khoa'})
+
+    def test_name_hits_rank_above_description_hits(self):
+        self.assertEqual(self.index.search('áo khoác')[0].tolist(), [1, 2])
+
+    def test_unaccented_queries_match_accented_text(self):
+        self.assertEqual(set(self.index.search('ao')[0].tolist()), {1, 2, 3})
+        # Accents typed by the user are matched as written
+        self.assertEqual(set(self.index.search('áo')[0].tolist()), {1, 2})
+        self.assertEqual(self.index.matching_ids(['kho'], prefix=True), {1, 2, 3})
+
+    def test_updates_keep_vocabulary_sorted(self):
+        version = self.index.version
+        self.assertFalse(self.index.add(2, {'name': 'Quần jean', 'description': 'Dễ phối với áo khoác'}))
+        self.assertEqual(self.index.version, version)
+        self.index.expand('~')
+        self.index.add(2, {'name': 'Váy hoa'})
+        self.index.remove(3)
+        self.index.add(4, {'name': 'Áo len', 'category': 'Áo'})
+        fresh = LexicalIndex()
+        fresh.add(1, {'name': 'Áo khoác nam', 'description': 'Chống nước'})
+        fresh.add(2, {'name': 'Váy hoa'})
+        fresh.add(4, {'name': 'Áo len', 'category': 'Áo'})
+        self.assertEqual(self.index.expand(''), fresh.expand(''))
+        self.assertNotIn('~jean', self.index.expand('~'))
+        self.assertEqual(self.index.search('len')[0].tolist(), [4])
+
+
+class LexicalIndexSyncTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(title='Brand')
+        category = Category.objects.create(title='Category', description='')
+        cls.product = Product.objects.create(name='Áo thun', brand=brand, category=category, countInStock=5)
+
+    def setUp(self):
+        reset_lexical_index()
+        self.addCleanup(reset_lexical_index)
+        patcher = mock.patch.object(lexical_index._lexical_version, 'check_interval', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stock_saves_skip_reindexing(self):
+        index = get_lexical_index()
+        version = index.version
+        self.product.countInStock = 4
+        self.product.save(update_fields=['countInStock'])
+        self.product.save()
+        self.assertEqual(index.version, version)
+        self.product.name = 'Áo polo'
+        self.product.save()
+        self.assertEqual(index.version, version + 1)
+        # Its own writes do not make a worker rebuild
+        self.assertIs(get_lexical_index(), index)
+        self.assertEqual(index.search('polo')[0].tolist(), [self.product.id])
+
+    def test_changes_from_other_workers_trigger_a_rebuild(self):
+        index = get_lexical_index()
+        # Another worker renames the product: the row changes and the shared counter moves
+        Product.objects.filter(id=self.product.id).update(name='Váy maxi')
+        SharedVersion('lexical-index:version').bump(applied_locally=False)
+        rebuilt = get_lexical_index()
+        self.assertIsNot(rebuilt, index)
+        self.assertEqual(rebuilt.search('vay')[0].tolist(), [self.product.id])
+        self.assertIs(get_lexical_index(), rebuilt)
+
+
+class KeywordMatcherTests(SimpleTestCase):
+    def messages(self):
+        keywords = sorted(keyword_matcher.groups)
+        rng = np.random.default_rng(3)
+        yield from keywords
+        yield 'tôi muốn tìm áo khoác màu đen size M của nike, giá dưới 500k'
+        yield 'không có gì ở đây cả'
+        yield ''
+        for _ in range(50):
+            picked = [str(keyword) for keyword in rng.choice(keywords, size=4)]
+            # Keywords run together make overlapping and nested occurrences
+            yield ' xx '.join(picked) + ''.join(picked[:2])
+
+    def test_automaton_matches_substring_scan(self):
+        for message in self.messages():
+            self.assertEqual(keyword_matcher._match(message).keywords, keyword_matcher.naive_match(message).keywords, message)
+
+    def test_hits_by_lexicon_and_label(self):
+        matcher = KeywordMatcher({'color': {'red': ['đỏ', 'red'], 'blue': ['xanh']}, 'size': {'xl': ['xl', 'red']}})
+        hits = matcher.match('áo đỏ size xl, redesign')
+        self.assertEqual(hits.labels('color'), ['red'])
+        self.assertEqual(hits.count('color', 'red'), 2)
+        # One keyword may serve several lexicons
+        self.assertTrue(hits.has('size', 'xl'))
+        self.assertFalse(hits.has('color', 'blue'))
+        self.assertEqual(hits.first('size'), 'xl')
+        self.assertEqual(set(LEXICONS), set(keyword_matcher.labels))
+
+
+class InferenceExecutorTests(SimpleTestCase):
+    def test_rejects_when_full_and_times_out(self):
+        executor = InferenceExecutor(max_workers=1, max_queue=0, timeout=5, retry_after=3)
+        self.addCleanup(executor._executor.shutdown)
+        started, release = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+            return 'done'
+
+        holder = threading.Thread(target=lambda: executor.run(block))
+        holder.start()
+        started.wait(5)
+        with self.assertRaises(InferenceRejected) as rejected:
+            executor.run(lambda: 'never')
+        self.assertEqual(rejected.exception.retry_after, 3)
+        self.assertEqual(executor.stats()['running'], 1)
+        release.set()
+        holder.join(5)
+
+        self.assertEqual(executor.run(lambda x: x * 2, 21), 42)
+        release.clear()
+        with self.assertRaises(InferenceTimeout):
+            executor.run(release.wait, 5, timeout=0.05)
+        release.set()
+        stats = executor.stats()
+        self.assertEqual((stats['rejected'], stats['timed_out']), (1, 1))
+
+
+class InferenceUnavailableViewTests(TestCase):
+    def test_saturated_pool_returns_503_with_retry_after(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('searcher', 'searcher@example.com', 'secret'))
+        executor = mock.Mock()
+        executor.run.side_effect = InferenceRejected('AI search is busy, please retry shortly', 7)
+        with mock.patch.multiple('api.views', AI_SEARCH_AVAILABLE=True, ai_search_service=mock.Mock(),
+                                 inference_executor=executor):
+            response = client.post('/api/ai-search/text/', {'text': 'áo khoác'}, format='json', HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '7')
+        self.assertEqual(response.json()['retry_after'], 7)
+
+
+class SearchBenchmarkTests(SimpleTestCase):
+    def test_mocked_benchmark_runs_on_a_tiny_catalog(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            rows = list(run_benchmark([300], workdir, queries=3, limit=5, ann=True, nprobe=2,
+                                      storages=('float32', 'int8')))
+        self.assertEqual(len(rows), 2 * 2 * 3)
+        self.assertEqual({(row['storage'], row['searcher']) for row in rows},
+                         {('float32', 'exact'), ('float32', 'ivf'), ('int8', 'exact'), ('int8', 'ivf')})
+        for row in rows:
+            self.assertGreater(row['qps'], 0)
+            self.assertLessEqual(row['p50_ms'], row['p99_ms'])
+
+
+class CompactStorageTests(SimpleTestCase):
+    def setUp(self):
+        self.index = EmbeddingIndex.from_cache(embeddings_cache(count=300, dim=64))
+        self.queries = np.random.default_rng(4).normal(size=(10, 64))
+
+    def test_compact_scores_track_float32(self):
+        for storage, tolerance in (('float16', 2e-3), ('int8', 2e-2)):
+            compact = self.index.with_storage(storage)
+            self.assertEqual(compact.storage, storage)
+            for kind in ('image', 'text'):
+                for query in self.queries:
+                    np.testing.assert_allclose(
+                        compact.similarities(kind, query), self.index.similarities(kind, query), atol=tolerance,
+                    )
+                    if storage == 'float16':
+                        # Half-precision error is far below the gap to the runner-up
+                        self.assertEqual(compact.search(kind, query, 1)[0][0], self.index.search(kind, query, 1)[0][0])
+
+    def test_recall_and_round_trip(self):
+        report = {(row['kind'], row['storage']): row for row in storage_report(self.index, queries=50)}
+        self.assertEqual(report['image', 'float16']['recall@10'], 1.0)
+        self.assertGreaterEqual(report['text', 'int8']['recall@10'], 0.95)
+        self.assertGreater(report['text', 'int8']['compression'], 3.5)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'embeddings.idx')
+            int8 = self.index.with_storage('int8')
+            int8.save(path, 'clip', 'text')
+            loaded = EmbeddingIndex.load(path)
+            self.assertEqual(loaded.header['storage'], 'int8')
+            for kind in ('image', 'text'):
+                found = loaded.search(kind, self.queries[0], 10)
+                expected = int8.search(kind, self.queries[0], 10)
+                self.assertEqual(found[0].tolist(), expected[0].tolist())
+                np.testing.assert_allclose(found[1], expected[1], rtol=1e-6)
+
+
+class CatalogFilterIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = EmbeddingIndex.from_cache(embeddings_cache())
+        # Product 61 has attributes but no embeddings; 60 has embeddings but no attributes
+        self.attributes = [
+            (product_id, product_id % 3, product_id % 2, np.nan if product_id % 7 == 0 else product_id * 30_000.0,
+             product_id % 4 != 0)
+            for product_id in list(range(1, 60)) + [61]
+        ]
+        self.filters = CatalogFilterIndex(self.attributes)
+
+    def expected(self, test):
+        matching = {row[0] for row in self.attributes if test(*row)}
+        return np.isin(self.index.product_ids, list(matching))
+
+    def test_masks_match_row_filters(self):
+        np.testing.assert_array_equal(
+            self.filters.mask(self.index, category=[0, 2], in_stock=True),
+            self.expected(lambda _, category, brand, price, in_stock: category in (0, 2) and in_stock),
+        )
+        np.testing.assert_array_equal(
+            self.filters.mask(self.index, brand=1, price_bucket=3, max_price=1_200_000),
+            self.expected(lambda _, category, brand, price, in_stock: brand == 1 and 1_000_000 <= price <= 1_200_000),
+        )
+        self.assertIsNone(self.filters.mask(self.index))
+
+    def test_updates_patch_cached_masks(self):
+        before = self.filters.mask(self.index, category=1)
+        self.assertTrue(before[0])
+        self.assertTrue(self.filters.set(1, 2, 1, 30_000.0, True))
+        self.assertFalse(self.filters.set(1, 2, 1, 30_000.0, True))
+        self.assertFalse(self.filters.mask(self.index, category=1)[0])
+        self.assertTrue(self.filters.mask(self.index, category=2)[0])
+        self.assertTrue(self.filters.remove(2))
+        self.assertFalse(self.filters.mask(self.index, category=2)[1])
+        self.assertEqual(self.filters.stats()['products'], 59)
+
+
+class CatalogFilterSyncTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.brand = Brand.objects.create(title='Brand')
+        cls.category = Category.objects.create(title='Category', description='')
+        cls.plain = Product.objects.create(name='Plain', brand=cls.brand, category=cls.category,
+                                           price=150000, countInStock=5)
+        cls.with_variants = Product.objects.create(name='Variants', brand=cls.brand, category=cls.category,
+                                                   price=300000, has_variants=True)
+        cls.variant = ProductVariant.objects.create(
+            product=cls.with_variants, color=Color.objects.create(name='Đỏ', hex_code='#ff0000'),
+            size=Size.objects.create(name='M', order=0), price=250000, stock_quantity=1,
+        )
+
+    def setUp(self):
+        set_catalog_filters(None)
+        self.addCleanup(set_catalog_filters, None)
+        patcher = mock.patch.object(catalog_filters._catalog_version, 'check_interval', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def columns(self, product):
+        filters = get_catalog_filters()
+        position = int(np.searchsorted(filters.product_ids, product.id))
+        return {name: column[position] for name, column in filters.columns.items()}
+
+    def test_only_relevant_saves_refresh(self):
+        filters = get_catalog_filters()
+        version = filters.version
+        with CaptureQueriesContext(connection) as queries:
+            self.plain.total_sold = 3
+            self.plain.save(update_fields=['total_sold'])
+            self.plain.countInStock = 4
+            self.plain.save(update_fields=['countInStock'])
+        # Just the two UPDATEs; a product without variants is read off the instance
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(filters.version, version)
+
+        self.plain.countInStock = 0
+        self.plain.save(update_fields=['countInStock'])
+        self.assertFalse(self.columns(self.plain)['in_stock'])
+        self.variant.stock_quantity = 0
+        self.variant.save(update_fields=['stock_quantity'])
+        self.assertFalse(self.columns(self.with_variants)['in_stock'])
+        self.assertEqual(self.columns(self.with_variants)['price'], 250000)
+        self.assertIs(get_catalog_filters(), filters)
+
+    def test_changes_from_other_workers_trigger_a_rebuild(self):
+        filters = get_catalog_filters()
+        Product.objects.filter(id=self.plain.id).update(price=2_500_000)
+        SharedVersion('catalog-filters:version').bump(applied_locally=False)
+        self.assertIsNot(get_catalog_filters(), filters)
+        self.assertEqual(self.columns(self.plain)['price'], 2_500_000)
+
+
+def mocked_search_service(test):
+    """``AISearchService`` over a temporary ``AI_CACHE_DIR``, with mock models in place of CLIP and MiniLM"""
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    with override_settings(AI_CACHE_DIR=directory.name):
+        service = AISearchService()
+    test.addCleanup(service.branch_executor.shutdown)
+    MockEmbeddingModels().install(service)
+    reset_lexical_index()
+    test.addCleanup(reset_lexical_index)
+    set_catalog_filters(None)
+    test.addCleanup(set_catalog_filters, None)
+    return service
+
+
+class FilteredResultCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(title='Brand')
+        category = Category.objects.create(title='Category', description='')
+        cls.jacket = Product.objects.create(name='Áo khoác gió', brand=brand, category=category,
+                                            price=450000, countInStock=3)
+        cls.other = Product.objects.create(name='Áo khoác jean', brand=brand, category=category,
+                                           price=550000, countInStock=2)
+
+    def test_stock_change_retires_cached_filtered_ranking(self):
+        service = mocked_search_service(self)
+        service.precompute_product_embeddings()
+        product_ids, _ = service.rank_text('áo khoác', 10, {'in_stock': True})
+        self.assertIn(self.jacket.id, product_ids)
+
+        self.jacket.countInStock = 0
+        self.jacket.save(update_fields=['countInStock'])
+        product_ids, _ = service.rank_text('áo khoác', 10, {'in_stock': True})
+        self.assertNotIn(self.jacket.id, product_ids)
+        self.assertIn(self.other.id, product_ids)
+
+
+class MockedSearchServiceTestCase(TestCase):
+    """``mocked_search_service`` over a temporary ``MEDIA_ROOT`` that tests can write product photos to"""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media_root = media.name
+        media_override = override_settings(MEDIA_ROOT=media.name)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        self.service = mocked_search_service(self)
+
+    def save_photo(self, name, seed):
+        photo(seed).save(os.path.join(self.media_root, name))
+        return name
+
+
+class TextRerankTests(MockedSearchServiceTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(title='Brand')
+        category = Category.objects.create(title='Category', description='')
+        cls.shirt = Product.objects.create(name='Áo thun trắng', description='Cotton basic', image='',
+                                           brand=brand, category=category, price=150000)
+        cls.jeans = Product.objects.create(name='Quần jean xanh', image='', brand=brand, category=category,
+                                           price=450000)
+        cls.dress = Product.objects.create(name='Váy hoa', image='', brand=brand, category=category, price=350000)
+
+    def setUp(self):
+        super().setUp()
+        self.service.precompute_product_embeddings()
+
+    def test_product_text_is_stored_in_the_index(self):
+        index = self.service.load_index()
+        _, rows = index.rows_for([self.shirt.id])
+        self.assertEqual(index.product_text(rows[0]), 'áo thun trắng cotton basic')
+        self.assertEqual(index.product_ids[index.text_contains('quần')].tolist(), [self.jeans.id])
+
+    def test_text_search_reranks_without_reading_products(self):
+        get_lexical_index()
+        # Category and keyword bonuses come from the index; only the final in_bulk hits the database
+        with self.assertNumQueries(1):
+            results = self.service.search_by_text('áo thun', 5)
+        self.assertEqual([result['product'] for result in results], [self.shirt])
+
+
+class EmbeddingRefreshTests(MockedSearchServiceTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.brand = Brand.objects.create(title='Brand')
+        cls.category = Category.objects.create(title='Category', description='')
+
+    def create_product(self, name, image=''):
+        return Product.objects.create(name=name, image=image, brand=self.brand, category=self.category, price=100000)
+
+    def test_only_changed_products_are_reembedded(self):
+        shirt = self.create_product('Áo thun', image=self.save_photo('shirt.png', 0))
+        jeans = self.create_product('Quần jean')
+        stats = self.service.precompute_product_embeddings()
+        self.assertEqual((stats['added'], stats['updated'], stats['unchanged']), (2, 0, 0))
+        version = self.service.load_index().header['version']
+
+        # Nothing changed: the index file is left alone
+        stats = self.service.precompute_product_embeddings()
+        self.assertEqual((stats['added'], stats['updated'], stats['unchanged']), (0, 0, 2))
+        self.assertEqual(self.service.load_index().header['version'], version)
+
+        # A new description or a replaced photo changes the fingerprint
+        jeans.description = 'Xanh đậm'
+        jeans.save()
+        self.save_photo('shirt.png', 1)
+        os.utime(os.path.join(self.media_root, 'shirt.png'), ns=(1, 1))
+        with mock.patch.object(self.service, 'get_text_embeddings', wraps=self.service.get_text_embeddings) as embed:
+            stats = self.service.precompute_product_embeddings()
+        self.assertEqual((stats['updated'], stats['unchanged']), (2, 0))
+        self.assertEqual(embed.call_args[0][0], ['Áo thun ', 'Quần jean Xanh đậm'])
+        index = self.service.load_index()
+        self.assertGreater(index.header['version'], version)
+        _, rows = index.rows_for([shirt.id])
+        np.testing.assert_allclose(
+            index.dense('image', rows)[0], MockEmbeddingModels().image(photo(1)), rtol=1e-5, atol=1e-6,
+        )
+
+    def test_deleted_products_are_dropped(self):
+        kept = self.create_product('Áo thun')
+        deleted = self.create_product('Quần jean')
+        self.service.precompute_product_embeddings()
+        deleted.delete()
+        stats = self.service.precompute_product_embeddings()
+        self.assertEqual((stats['removed'], stats['unchanged']), (1, 1))
+        self.assertEqual(self.service.load_index().product_ids.tolist(), [kept.id])
+
+    def test_full_refresh_reembeds_everything(self):
+        self.create_product('Áo thun')
+        self.service.precompute_product_embeddings()
+        stats = self.service.precompute_product_embeddings(full=True)
+        self.assertEqual((stats['added'], stats['unchanged']), (1, 0))
+
+
+class EmbeddingBatchingTests(MockedSearchServiceTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(title='Brand')
+        category = Category.objects.create(title='Category', description='')
+        cls.products = [
+            Product.objects.create(name=f'Áo thun {number}', image=f'product-{number}.png', brand=brand,
+                                   category=category, price=100000)
+            for number in range(5)
+        ]
+
+    def setUp(self):
+        super().setUp()
+        for number in range(5):
+            self.save_photo(f'product-{number}.png', number)
+
+    def test_products_are_embedded_in_batches(self):
+        images = mock.patch.object(self.service, 'get_image_embeddings', wraps=self.service.get_image_embeddings)
+        texts = mock.patch.object(self.service, 'get_text_embeddings', wraps=self.service.get_text_embeddings)
+        with images as embed_images, texts as embed_texts:
+            stats = self.service.precompute_product_embeddings(batch_size=2)
+        self.assertEqual(stats['added'], 5)
+        self.assertEqual([len(call[0][0]) for call in embed_images.call_args_list], [2, 2, 1])
+        self.assertEqual([len(call[0][0]) for call in embed_texts.call_args_list], [2, 2, 1])
+
+    def test_worker_pool_decodes_images(self):
+        stats = self.service.precompute_product_embeddings(batch_size=2, workers=2)
+        self.assertEqual((stats['added'], stats['failed']), (5, 0))
+        index = self.service.load_index()
+        _, rows = index.rows_for([self.products[3].id])
+        np.testing.assert_allclose(
+            index.dense('image', rows)[0], MockEmbeddingModels().image(photo(3)), rtol=1e-5, atol=1e-6,
+        )
+
+    def test_interrupted_run_resumes_from_checkpoint(self):
+        checkpoint_file = os.path.join(self.media_root, 'checkpoint.idx')
+        embed = self.service.get_text_embeddings
+        calls = []
+
+        def interrupt_second_batch(texts, batch_size=32):
+            calls.append(texts)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return embed(texts, batch_size)
+
+        with mock.patch('api.ai_search.CHECKPOINT_INTERVAL', 0):
+            with mock.patch.object(self.service, 'get_text_embeddings', side_effect=interrupt_second_batch):
+                with self.assertRaises(KeyboardInterrupt):
+                    self.service.precompute_product_embeddings(batch_size=2, checkpoint_file=checkpoint_file)
+        self.assertTrue(os.path.exists(checkpoint_file))
+
+        calls.clear()
+        with mock.patch.object(self.service, 'get_text_embeddings', side_effect=interrupt_second_batch):
+            stats = self.service.precompute_product_embeddings(batch_size=3, checkpoint_file=checkpoint_file)
+        # The first batch came back from the checkpoint
+        self.assertEqual((stats['unchanged'], stats['added']), (2, 3))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(self.service.load_index()), 5)
+        self.assertFalse(os.path.exists(checkpoint_file))
+
+
+class ModelLoadingTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with override_settings(AI_CACHE_DIR=directory.name):
+            self.service = AISearchService()
+        self.addCleanup(self.service.branch_executor.shutdown)
+
+        self.text_model = mock.Mock()
+        self.text_model.encode.side_effect = lambda text, **kwargs: np.ones(384, dtype=np.float32)
+
+        def load(name):
+            time.sleep(0.05)
+            return self.text_model
+
+        self.sentence_transformers = mock.Mock(spec=['SentenceTransformer'])
+        self.sentence_transformers.SentenceTransformer.side_effect = load
+        patcher = mock.patch.dict('sys.modules', {'sentence_transformers': self.sentence_transformers})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_text_search_loads_only_the_text_model(self):
+        self.assertEqual(self.service.get_text_embedding('áo thun').shape, (384,))
+        status = self.service.model_status()
+        self.assertEqual((status['text_loaded'], status['clip_loaded']), (True, False))
+        self.assertEqual(list(status['load_seconds']), ['text'])
+
+    def test_concurrent_callers_share_one_load(self):
+        threads = [threading.Thread(target=self.service.load_text_model) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.sentence_transformers.SentenceTransformer.call_count, 1)
+        self.assertIs(self.service.text_model, self.text_model)
+
+    def test_warm_up_loads_the_requested_models(self):
+        timings = self.service.warm_up(models=('text',))
+        self.assertEqual(set(timings), {'index', 'text'})
+        # One throwaway inference, so the first request does not pay for it
+        self.text_model.encode.assert_called_once()
+        self.assertIsNone(self.service.clip_model)
+
+    def test_warm_up_hook_skips_without_model_packages(self):
+        with mock.patch('api.ai_search.model_dependencies_available', return_value=False):
+            with mock.patch('api.ai_search.ai_search_service') as service:
+                self.assertIsNone(warm_up_ai_search(['text']))
+        service.warm_up.assert_not_called()
+
+
+class SearchCardViewTests(MockedSearchServiceTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('searcher', 'searcher@example.com', 'secret')
+        brand = Brand.objects.create(title='Brand')
+        category = Category.objects.create(title='Category', description='')
+        cls.shirts = [
+            Product.objects.create(name=f'Áo thun {number}', image='', brand=brand, category=category,
+                                   price=150000, countInStock=number)
+            for number in range(3)
+        ]
+        cls.jacket = Product.objects.create(name='Áo khoác', image='', brand=brand, category=category,
+                                            price=500000, has_variants=True)
+        size = Size.objects.create(name='M', order=0)
+        for name, price, stock in (('Đen', 320000, 0), ('Be', 350000, 2)):
+            ProductVariant.objects.create(product=cls.jacket, color=Color.objects.create(name=name, hex_code='#000000'),
+                                          size=size, price=price, stock_quantity=stock)
+
+    def setUp(self):
+        super().setUp()
+        self.service.precompute_product_embeddings()
+        get_lexical_index()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, **data):
+        executor = mock.Mock()
+        executor.run.side_effect = lambda function, *args, **kwargs: function(*args, **kwargs)
+        with mock.patch.multiple('api.views', AI_SEARCH_AVAILABLE=True, ai_search_service=self.service,
+                                 inference_executor=executor):
+            return self.client.post('/api/ai-search/text/', {'text': 'áo', 'limit': 5, **data}, format='json',
+                                    HTTP_HOST='localhost')
+
+    def test_cards_are_loaded_in_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.search()
+        cards = {card['id']: card for card in response.json()['products']}
+        self.assertEqual(set(cards), {product.id for product in self.shirts + [self.jacket]})
+        jacket = cards[self.jacket.id]
+        self.assertEqual(set(jacket), {'id', 'name', 'image', 'price', 'min_price', 'rating', 'numReviews',
+                                       'in_stock', 'score', 'compatibility_percent', 'matched_variant'})
+        self.assertEqual(float(jacket['min_price']), 320000)
+        self.assertTrue(jacket['in_stock'])
+        self.assertFalse(cards[self.shirts[0].id]['in_stock'])
+        self.assertIsInstance(jacket['score'], float)
+
+    def test_full_returns_the_detail_payload(self):
+        products = self.search(full=True).json()['products']
+        jacket = next(product for product in products if product['id'] == self.jacket.id)
+        self.assertEqual(len(jacket['variants']), 2)
+        self.assertIn('compatibility_percent', jacket)
+
+
+class VariantImageSearchTests(MockedSearchServiceTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(title='Brand')
+        category = Category.objects.create(title='Category', description='')
+        red, blue = (Color.objects.create(name=name, hex_code='#000000') for name in ('Đỏ', 'Xanh'))
+        sizes = [Size.objects.create(name=name, order=order) for order, name in enumerate(('M', 'L', 'XL'))]
+        cls.jacket = Product.objects.create(name='Áo khoác', image='jacket.png', brand=brand, category=category,
+                                            price=500000, has_variants=True)
+        cls.other = Product.objects.create(name='Áo thun', image='shirt.png', brand=brand, category=category,
+                                           price=150000)
+
+        def variant(color, size, image):
+            return ProductVariant.objects.create(product=cls.jacket, color=color, size=size, price=500000,
+                                                 stock_quantity=1, image=image)
+
+        # Sizes of one colour share a photo; one variant reuses the main photo, one has none
+        cls.red_m = variant(red, sizes[0], 'red.png')
+        cls.red_l = variant(red, sizes[1], 'red.png')
+        cls.blue = variant(blue, sizes[0], 'blue.png')
+        variant(blue, sizes[1], 'jacket.png')
+        variant(blue, sizes[2], '')
+
+    def setUp(self):
+        super().setUp()
+        for name, seed in (('jacket.png', 0), ('red.png', 1), ('blue.png', 2), ('shirt.png', 3)):
+            self.save_photo(name, seed)
+        self.service.precompute_product_embeddings()
+
+    def test_distinct_variant_images_are_indexed_once(self):
+        index = self.service.load_index()
+        self.assertEqual(index.variant_ids.tolist(), [self.red_m.id, self.blue.id])
+        self.assertEqual(index.variant_owner_rows().tolist(), index.rows_for([self.jacket.id])[1].tolist() * 2)
+
+    def test_image_search_reports_the_matching_variant(self):
+        results = self.service.search_by_image(photo(2), limit=2)
+        self.assertEqual([result['product'] for result in results], [self.jacket, self.other])
+        self.assertEqual(results[0]['variant_id'], self.blue.id)
+        self.assertIsNone(results[1]['variant_id'])
+
+        results = self.service.search_by_image(photo(0), limit=1)
+        self.assertEqual(results[0]['product'], self.jacket)
+        self.assertIsNone(results[0]['variant_id'])
+
+
+class SimilarProductsTests(MockedSearchServiceTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('browser', 'browser@example.com', 'secret')
+        category = Category.objects.create(title='Category', description='')
+        cls.brands = [Brand.objects.create(title=title) for title in ('First', 'Second')]
+        cls.products = [
+            Product.objects.create(name=f'Áo thun {number}', image=f'product-{number}.png',
+                                   brand=cls.brands[number % 2], category=category, price=150000, countInStock=1)
+            for number in range(6)
+        ]
+
+    def setUp(self):
+        super().setUp()
+        for number in range(6):
+            self.save_photo(f'product-{number}.png', number)
+        self.service.precompute_product_embeddings()
+
+    def similar_ids(self, product, **kwargs):
+        return [result['product'].id for result in self.service.similar_products(product.id, **kwargs)]
+
+    def test_product_is_not_similar_to_itself(self):
+        for kind in ('combined', 'image', 'text'):
+            similar = self.similar_ids(self.products[0], limit=10, kind=kind)
+            self.assertEqual(sorted(similar), [product.id for product in self.products[1:]], msg=kind)
+
+    def test_filters_narrow_the_candidates(self):
+        similar = self.similar_ids(self.products[0], limit=10, filters={'brand': self.brands[1].id})
+        self.assertEqual(sorted(similar), [product.id for product in self.products[1::2]])
+
+    def test_view_falls_back_for_unindexed_and_404s_for_missing_products(self):
+        unindexed = Product.objects.create(name='Áo mới', image='', brand=self.brands[0],
+                                           category=self.products[0].category, price=150000)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with mock.patch.multiple('api.views', AI_SEARCH_AVAILABLE=True, ai_search_service=self.service):
+            response = client.get(f'/api/ai-search/similar/{self.products[0].id}/', HTTP_HOST='localhost')
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('fallback', response.json())
+            response = client.get(f'/api/ai-search/similar/{unindexed.id}/', HTTP_HOST='localhost')
+            self.assertTrue(response.json()['fallback'])
+            response = client.get('/api/ai-search/similar/999999/', HTTP_HOST='localhost')
+            self.assertEqual(response.status_code, 404)
+
+
+class SearchEvaluationTests(MockedSearchServiceTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(title='Brand')
+        category = Category.objects.create(title='Category', description='')
+        cls.products = [
+            Product.objects.create(name=f'Áo thun {number}', image=f'product-{number}.png', brand=brand,
+                                   category=category, price=150000)
+            for number in range(4)
+        ]
+
+    def write_queries(self, *entries):
+        path = os.path.join(self.media_root, 'queries.jsonl')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(json.dumps(entry) for entry in entries) + '\n')
+        return path
+
+    def test_metrics(self):
+        self.assertEqual(recall_at_k([1, 2, 3, 4], [2, 9], 3), 0.5)
+        self.assertEqual(recall_at_k([1, 2, 3, 4], [4], 3), 0.0)
+        self.assertEqual(ndcg_at_k([5, 6], {5: 1.0, 6: 1.0}, 10), 1.0)
+        # The one relevant product at rank 2 instead of rank 1
+        self.assertAlmostEqual(ndcg_at_k([7, 5], {5: 1.0}, 10), 1 / np.log2(3))
+        self.assertEqual(ndcg_at_k([7, 8], {5: 2.0}, 2), 0.0)
+
+    def test_load_queries(self):
+        self.save_photo('query.png', 0)
+        queries = load_queries(self.write_queries(
+            {'query': 'Áo thun', 'relevant': [1, 2], 'grades': {'2': 2}},
+            {'image': 'query.png', 'relevant': [3], 'filters': {'in_stock': True}},
+            {'query': 'áo', 'image': 'query.png', 'relevant': ['4']},
+        ))
+        self.assertEqual([entry['kind'] for entry in queries], ['text', 'image', 'combined'])
+        self.assertEqual(queries[0]['grades'], {1: 1.0, 2: 2.0})
+        self.assertEqual(queries[1]['image'].size, (96, 96))
+        self.assertEqual(queries[1]['filters'], {'in_stock': True})
+        self.assertEqual(queries[2]['relevant'], [4])
+
+        path = self.write_queries({'query': 'áo', 'relevant': [1]}, {'kind': 'image', 'relevant': [1]})
+        with self.assertRaisesMessage(ValueError, 'queries.jsonl:2'):
+            load_queries(path)
+
+    def test_evaluate_replays_queries_per_configuration(self):
+        for number in range(4):
+            self.save_photo(f'product-{number}.png', number)
+        self.service.precompute_product_embeddings()
+        path = self.write_queries(*(
+            {'image': f'product-{number}.png', 'relevant': [product.id]}
+            for number, product in enumerate(self.products)
+        ))
+        caches = (self.service.text_results_cache, self.service.image_embedding_cache)
+        configs = [{'name': 'baseline'}, {'name': 'rrf', 'fusion': 'rrf'}]
+        results = list(evaluate(self.service, load_queries(path), configs, k=1))
+        self.assertEqual([result['config'] for result in results], ['baseline', 'rrf'])
+        self.assertEqual(results[0]['recall@1'], 1.0)
+        self.assertEqual(results[0]['by_kind']['image']['queries'], 4)
+        self.assertEqual((self.service.text_results_cache, self.service.image_embedding_cache), caches)
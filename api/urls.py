@@ -13,7 +13,7 @@ from api.views import (
     AdminPayboxWalletListView, AdminPayboxTransactionListView,
     RejectRefundRequestView, DeleteRefundRequestView, RefundRequestView,
     AdminRefundRequestListView, ApproveRefundRequestView,
-    FavoriteView, check_favorite, check_purchase, health_check, setup_production, debug_users, debug_env, test_upload, debug_websocket, debug_server, debug_ai
+    FavoriteView, check_favorite, favorite_ids, check_purchase, health_check, setup_production, debug_users, debug_env, test_upload, debug_websocket, debug_server, debug_ai
 )
 from chat.views import chat_history
 
@@ -62,11 +62,15 @@ urlpatterns = [*router.urls,
 
     path('chat/messages/<str:room_name>/', chat_history),
     path('favorites/', FavoriteView.as_view(), name='favorites'),
+    path('favorites/ids/', favorite_ids, name='favorite-ids'),
     path('products/<int:pk>/favorite/', check_favorite, name='check-favorite'),
     path('products/<str:pk>/check-purchase/', check_purchase, name='check-purchase'),
+    path('catalog/', views.catalog, name='catalog'),
     path('ai-search/image/', views.ai_search_by_image, name='ai_search_image'),
     path('ai-search/text/', views.ai_search_by_text, name='ai_search_text'),
     path('ai-search/combined/', views.ai_search_combined, name='ai_search_combined'),
+    path('ai-search/similar/<int:pk>/', views.ai_search_similar, name='ai_search_similar'),
+    path('ai-search/status/', views.ai_search_status, name='ai_search_status'),
     path('health/', health_check, name='health-check'),
     path('setup/', setup_production, name='setup-production'),
     path('debug-users/', debug_users, name='debug-users'),
@@ -15,6 +15,7 @@ from rest_framework.response import Response
 from rest_framework import status, viewsets, permissions
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 from api.models import Brand, Category, Order, OrderItem, Product, Review, ShippingAddress, PayboxWallet, PayboxTransaction, RefundRequest, Favorite, Color, Size, ProductVariant
+from api.pagination import CatalogCursorPagination, ProductCursorPagination
 from api.permissions import IsAdminUserOrReadOnly
 from api.serializers import BrandSerializer, CategorySerializer, OrderSerializer, ProductSerializer, ReviewSerializer, PayboxWalletSerializer, PayboxTransactionSerializer, ColorSerializer, SizeSerializer, ProductVariantSerializer
 from django.db import transaction
@@ -24,16 +25,24 @@ import stripe
 
 # Conditional import for AI search
 try:
-    from .ai_search import ai_search_service
-    AI_SEARCH_AVAILABLE = True
+    from .ai_search import SIMILAR_KINDS, ai_search_service, model_dependencies_available
+    AI_SEARCH_AVAILABLE = model_dependencies_available()
 except ImportError:
     ai_search_service = None
+    SIMILAR_KINDS = ()
     AI_SEARCH_AVAILABLE = False
 from rest_framework.decorators import api_view, parser_classes
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
 from rest_framework import status
-from .serializers import ProductSerializer
+from .serializers import (
+    ProductListSerializer, ProductSerializer, ProductSearchCardSerializer,
+    favorite_product_ids, forget_favorite_product_ids, product_detail_queryset, product_list_queryset,
+    search_card_queryset,
+)
+from .inference_executor import InferenceRejected, inference_executor
+from .catalog_facets import facet_counts, filter_catalog_queryset
+from .catalog_filters import PRICE_BUCKETS
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
@@ -142,6 +151,24 @@ class ProductViewSet(ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAdminUserOrReadOnly]
+    pagination_class = ProductCursorPagination
+
+    def uses_list_representation(self):
+        """Lists that opt into pagination or sparse fieldsets get the slim representation"""
+        params = self.request.query_params
+        return self.action == 'list' and (
+            self.paginator.is_requested(self.request) or 'fields' in params or 'expand' in params
+        )
+
+    def get_queryset(self):
+        if self.uses_list_representation():
+            return product_list_queryset(super().get_queryset(), self.request.query_params.get('expand'))
+        return product_detail_queryset(super().get_queryset())
+
+    def get_serializer_class(self):
+        if self.uses_list_representation():
+            return ProductListSerializer
+        return super().get_serializer_class()
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -242,7 +269,7 @@ class ReviewView(APIView):
             current_rating = product.rating or 0
             product.rating = (current_rating * product.numReviews + rating_value) / (product.numReviews + 1)
             product.numReviews += 1
-            product.save()
+            product.save(update_fields=['rating', 'numReviews'])
 
             serializer = ReviewSerializer(review)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -322,7 +349,7 @@ def placeOrder(request):
 
                     # Trừ tồn kho biến thể
                     product_variant.stock_quantity -= x['qty']
-                    product_variant.save()
+                    product_variant.save(update_fields=['stock_quantity'])
 
                 except ProductVariant.DoesNotExist:
                     return Response(
@@ -337,7 +364,7 @@ def placeOrder(request):
                         status=status.HTTP_400_BAD_REQUEST
                     )
                 product.countInStock -= x['qty']
-                product.save()
+                product.save(update_fields=['countInStock'])
 
             # Tạo OrderItem
             item = OrderItem.objects.create(
@@ -398,7 +425,7 @@ def update_order_to_paid(request, pk):
                 for item in order.orderitem_set.all():
                     product = item.product
                     product.total_sold += item.qty
-                    product.save()
+                    product.save(update_fields=['total_sold'])
 
             return Response({'detail': 'Thanh toán thành công, đơn hàng của bạn đã được cập nhật!'}, status=status.HTTP_200_OK)
 
@@ -455,7 +482,7 @@ def update_review(request, pk, review_id):
             else:
                 product.rating = 0
             product.numReviews -= 1
-            product.save()
+            product.save(update_fields=['rating', 'numReviews'])
             
             review.delete()
         return Response({'detail': 'Review deleted'}, status=status.HTTP_204_NO_CONTENT)
@@ -466,7 +493,7 @@ def update_review(request, pk, review_id):
     with transaction.atomic():
         # Cập nhật lại rating của sản phẩm
         product.rating = (product.rating * product.numReviews - review.rating + data['rating']) / product.numReviews
-        product.save()
+        product.save(update_fields=['rating'])
         
         review.rating = data['rating']
         review.comment = data['comment']
@@ -956,9 +983,10 @@ class FavoriteView(APIView):
     
     def get(self, request):
         """Lấy danh sách sản phẩm yêu thích của người dùng"""
-        favorites = Favorite.objects.filter(user=request.user)
-        products = [favorite.product for favorite in favorites]
-        serializer = ProductSerializer(products, many=True)
+        products = product_list_queryset(
+            Product.objects.filter(favorite__user=request.user), request.query_params.get('expand')
+        ).order_by('favorite__id')
+        serializer = ProductListSerializer(products, many=True, context={'request': request})
         return Response(serializer.data)
     
     def post(self, request):
@@ -971,6 +999,7 @@ class FavoriteView(APIView):
         
         # Kiểm tra xem đã tồn tại trong danh sách yêu thích chưa
         favorite, created = Favorite.objects.get_or_create(user=request.user, product=product)
+        forget_favorite_product_ids(request)
         
         if created:
             return Response({'detail': 'Product added to favorites'}, status=status.HTTP_201_CREATED)
@@ -985,6 +1014,7 @@ class FavoriteView(APIView):
         try:
             favorite = Favorite.objects.get(user=request.user, product_id=product_id)
             favorite.delete()
+            forget_favorite_product_ids(request)
             return Response({'detail': 'Product removed from favorites'}, status=status.HTTP_204_NO_CONTENT)
         except Favorite.DoesNotExist:
             return Response({'detail': 'Product not in favorites'}, status=status.HTTP_404_NOT_FOUND)
@@ -999,6 +1029,23 @@ def check_favorite(request, pk):
     return Response({'is_favorite': is_favorite})
 
 
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticated])
+def favorite_ids(request):
+    """Which of ``ids`` (query string or POST body) the user has favourited; all favourites without ``ids``.
+
+    One request for a whole page of product cards instead of ``check_favorite`` per card.
+    """
+    try:
+        product_ids = query_ids(request.data if request.method == 'POST' else request.query_params, 'ids')
+    except ValueError:
+        return Response({'detail': 'ids must be comma-separated product ids'}, status=status.HTTP_400_BAD_REQUEST)
+    favorites = favorite_product_ids(request)
+    if product_ids is not None:
+        favorites = favorites.intersection(product_ids)
+    return Response({'favorites': sorted(favorites)})
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def check_purchase(request, pk):
@@ -1014,19 +1061,101 @@ def check_purchase(request, pk):
     
     return Response({'has_purchased': has_purchased})
 
+def wants_full_products(request):
+    """AI search returns compact cards unless the client asks for ``full`` products"""
+    full = request.data.get('full', request.query_params.get('full', ''))
+    return str(full).lower() in ('1', 'true', 'yes')
+
+
+def query_ids(params, name):
+    """Ids in ``params[name]``: one id, a comma-separated string or a JSON list; None when absent"""
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    values = value if isinstance(value, (list, tuple)) else str(value).split(',')
+    return [int(item) for item in values if str(item).strip()]
+
+
+def search_filters(params):
+    """Catalog filters of an AI search request; raises ``ValueError`` on malformed values.
+
+    ``category``, ``brand`` and ``price_bucket`` accept one id, a
+    comma-separated string or a JSON list; ``in_stock`` a boolean;
+    ``min_price``/``max_price`` numbers.
+    """
+    def number(name):
+        value = params.get(name)
+        return float(value) if value not in (None, '') else None
+    
+    in_stock = params.get('in_stock')
+    filters = {
+        'category': query_ids(params, 'category'),
+        'brand': query_ids(params, 'brand'),
+        'price_bucket': query_ids(params, 'price_bucket'),
+        'in_stock': str(in_stock).lower() in ('1', 'true', 'yes') if in_stock not in (None, '') else None,
+        'min_price': number('min_price'),
+        'max_price': number('max_price'),
+    }
+    if any(not 0 <= bucket < len(PRICE_BUCKETS) for bucket in filters['price_bucket'] or []):
+        raise ValueError(f'price_bucket must be between 0 and {len(PRICE_BUCKETS) - 1}')
+    return filters
+
+
+def ai_search_queryset(full):
+    if full:
+        return product_detail_queryset()
+    return search_card_queryset()
+
+
+def inference_unavailable(error):
+    """503 telling the client when to retry, for a saturated or timed-out inference pool"""
+    response = Response(
+        {'error': str(error), 'retry_after': error.retry_after},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
+    response['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def serialize_search_results(results, full=False):
+    """Serialize ``[{'product', 'similarity', 'compatibility_percent'}, ...]`` in one pass"""
+    products = []
+    for result in results:
+        product = result['product']
+        similarity = result.get('similarity')
+        product.search_score = round(similarity, 4) if similarity is not None else None
+        product.compatibility_percent = result['compatibility_percent']
+        product.matched_variant_id = result.get('variant_id')
+        products.append(product)
+    
+    if not full:
+        return ProductSearchCardSerializer(products, many=True).data
+    
+    response_data = ProductSerializer(products, many=True).data
+    for product_data, product in zip(response_data, products):
+        product_data['score'] = product.search_score
+        product_data['compatibility_percent'] = product.compatibility_percent
+        product_data['matched_variant'] = product.matched_variant_id
+    return response_data
+
+
 @api_view(['POST'])
 @parser_classes([MultiPartParser, FormParser])
 def ai_search_by_image(request):
     """AI search by image with fallback"""
+    try:
+        filters = search_filters(request.data)
+    except ValueError as e:
+        return Response({'error': f'Invalid filter: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+    
     if not AI_SEARCH_AVAILABLE:
         # Fallback: return random products
-        from django.db.models import Q
-        products = Product.objects.all()[:6]
-        response_data = []
-        for i, product in enumerate(products):
-            product_data = ProductSerializer(product).data
-            product_data['compatibility_percent'] = 85 - (i * 5)  # Fake compatibility
-            response_data.append(product_data)
+        full = wants_full_products(request)
+        products = filter_catalog_queryset(ai_search_queryset(full), filters)[:6]
+        response_data = serialize_search_results([
+            {'product': product, 'compatibility_percent': 85 - (i * 5)}  # Fake compatibility
+            for i, product in enumerate(products)
+        ], full)
 
         return Response({
             'products': response_data,
@@ -1042,25 +1171,31 @@ def ai_search_by_image(request):
         image = request.FILES['image']
         limit = int(request.data.get('limit', 5))
         
-        results = ai_search_service.search_by_image(image, limit=limit)
+        full = wants_full_products(request)
+        results = inference_executor.run(
+            ai_search_service.search_by_image, image, limit=limit, queryset=ai_search_queryset(full), filters=filters
+        )
         
-        response_data = []
-        for result in results:
-            product_data = ProductSerializer(result['product']).data
-            product_data['compatibility_percent'] = result['compatibility_percent']
-            response_data.append(product_data)
+        response_data = serialize_search_results(results, full)
         
         return Response({
             'products': response_data,
             'count': len(response_data)
         })
         
+    except InferenceRejected as e:
+        return inference_unavailable(e)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['POST'])
 def ai_search_by_text(request):
     """AI search by text description with fallback"""
+    try:
+        filters = search_filters(request.data)
+    except ValueError as e:
+        return Response({'error': f'Invalid filter: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+    
     if not AI_SEARCH_AVAILABLE:
         # Fallback: simple text search
         text = request.data.get('text', '').strip()
@@ -1068,15 +1203,15 @@ def ai_search_by_text(request):
             return Response({'error': 'No text provided'}, status=status.HTTP_400_BAD_REQUEST)
 
         from django.db.models import Q
-        products = Product.objects.filter(
+        full = wants_full_products(request)
+        products = filter_catalog_queryset(ai_search_queryset(full), filters).filter(
             Q(name__icontains=text) | Q(description__icontains=text)
         )[:6]
 
-        response_data = []
-        for i, product in enumerate(products):
-            product_data = ProductSerializer(product).data
-            product_data['compatibility_percent'] = 90 - (i * 3)  # Fake compatibility
-            response_data.append(product_data)
+        response_data = serialize_search_results([
+            {'product': product, 'compatibility_percent': 90 - (i * 3)}  # Fake compatibility
+            for i, product in enumerate(products)
+        ], full)
 
         return Response({
             'products': response_data,
@@ -1092,19 +1227,20 @@ def ai_search_by_text(request):
         
         limit = int(request.data.get('limit', 5))
         
-        results = ai_search_service.search_by_text(text, limit=limit)
+        full = wants_full_products(request)
+        results = inference_executor.run(
+            ai_search_service.search_by_text, text, limit=limit, queryset=ai_search_queryset(full), filters=filters
+        )
         
-        response_data = []
-        for result in results:
-            product_data = ProductSerializer(result['product']).data
-            product_data['compatibility_percent'] = result['compatibility_percent']
-            response_data.append(product_data)
+        response_data = serialize_search_results(results, full)
         
         return Response({
             'products': response_data,
             'count': len(response_data)
         })
         
+    except InferenceRejected as e:
+        return inference_unavailable(e)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -1112,25 +1248,30 @@ def ai_search_by_text(request):
 @parser_classes([MultiPartParser, FormParser])
 def ai_search_combined(request):
     """Combined AI search with fallback"""
+    try:
+        filters = search_filters(request.data)
+    except ValueError as e:
+        return Response({'error': f'Invalid filter: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+    
     if not AI_SEARCH_AVAILABLE:
         # Fallback: use text search if available, otherwise random products
         text = request.data.get('text', '').strip()
 
+        full = wants_full_products(request)
         if text:
             # Use text-based search
             from django.db.models import Q
-            products = Product.objects.filter(
+            products = filter_catalog_queryset(ai_search_queryset(full), filters).filter(
                 Q(name__icontains=text) | Q(description__icontains=text)
             )[:6]
         else:
             # Random products
-            products = Product.objects.all()[:6]
+            products = filter_catalog_queryset(ai_search_queryset(full), filters)[:6]
 
-        response_data = []
-        for i, product in enumerate(products):
-            product_data = ProductSerializer(product).data
-            product_data['compatibility_percent'] = 88 - (i * 4)  # Fake compatibility
-            response_data.append(product_data)
+        response_data = serialize_search_results([
+            {'product': product, 'compatibility_percent': 88 - (i * 4)}  # Fake compatibility
+            for i, product in enumerate(products)
+        ], full)
 
         return Response({
             'products': response_data,
@@ -1147,72 +1288,107 @@ def ai_search_combined(request):
         if not image and not text:
             return Response({'error': 'Provide either image or text'}, status=status.HTTP_400_BAD_REQUEST)
         
-        image_results = []
-        text_results = []
-        
-        if image:
-            image_results = ai_search_service.search_by_image(image, limit=limit*2)
-        
-        if text:
-            text_results = ai_search_service.search_by_text(text, limit=limit*2)
+        fusion = request.data.get('fusion', 'weighted')
+        if fusion not in ('weighted', 'rrf'):
+            return Response({'error': 'fusion must be "weighted" or "rrf"'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Combine results with weighted scores
-        combined_results = {}
-        
-        # Add image results
-        for result in image_results:
-            product_id = result['product'].id
-            combined_results[product_id] = {
-                'product': result['product'],
-                'image_score': result['similarity'],
-                'text_score': 0,
-                'combined_score': result['similarity'] * 0.6  # Weight image 60%
-            }
-        
-        # Add text results
-        for result in text_results:
-            product_id = result['product'].id
-            if product_id in combined_results:
-                combined_results[product_id]['text_score'] = result['similarity']
-                combined_results[product_id]['combined_score'] = (
-                    combined_results[product_id]['image_score'] * 0.6 + 
-                    result['similarity'] * 0.4
-                )
-            else:
-                combined_results[product_id] = {
-                    'product': result['product'],
-                    'image_score': 0,
-                    'text_score': result['similarity'],
-                    'combined_score': result['similarity'] * 0.4  # Weight text 40%
-                }
+        # Image and text branches run concurrently; products are only loaded
+        # for the fused top results
+        full = wants_full_products(request)
+        results = inference_executor.run(
+            ai_search_service.search_combined,
+            image=image, text=text, limit=limit, fusion=fusion, queryset=ai_search_queryset(full), filters=filters,
+        )
         
-        # Sort by combined score
-        sorted_results = sorted(
-            combined_results.values(), 
-            key=lambda x: x['combined_score'], 
-            reverse=True
-        )[:limit]
-        
-        response_data = []
-        for result in sorted_results:
-            product_data = ProductSerializer(result['product']).data
-            compatibility_percent = min(100, max(0, int(result['combined_score'] * 100)))
-            
-            # Debug log
-            print(f"Product {result['product'].name}: score={result['combined_score']}, percent={compatibility_percent}")
-            
-            product_data['compatibility_percent'] = compatibility_percent
-            response_data.append(product_data)
+        response_data = serialize_search_results(results, full)
         
         return Response({
             'products': response_data,
             'count': len(response_data)
         })
         
+    except InferenceRejected as e:
+        return inference_unavailable(e)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['GET'])
+def ai_search_similar(request, pk):
+    """"More like this": products closest to product ``pk``'s stored embeddings, without inference"""
+    params = request.query_params
+    try:
+        limit = min(50, max(1, int(params.get('limit', 8))))
+        filters = search_filters(params)
+    except ValueError as e:
+        return Response({'error': f'Invalid limit or filter: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    full = wants_full_products(request)
+    results = None
+    if AI_SEARCH_AVAILABLE:
+        kind = params.get('kind', 'combined')
+        if kind not in SIMILAR_KINDS:
+            return Response({'error': f'Unknown kind: {kind}'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            results = ai_search_service.similar_products(
+                pk, limit=limit, kind=kind, filters=filters, queryset=ai_search_queryset(full)
+            )
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    if results is None:
+        # No index entry (or no AI search): fall back to the product's category
+        product = get_object_or_404(Product, id=pk)
+        products = filter_catalog_queryset(ai_search_queryset(full), filters).exclude(id=pk)
+        if not filters['category']:
+            products = products.filter(category_id=product.category_id)
+        response_data = serialize_search_results([
+            {'product': similar, 'compatibility_percent': None}
+            for similar in products.order_by('-rating', '-id')[:limit]
+        ], full)
+        return Response({'products': response_data, 'count': len(response_data), 'fallback': True})
+    
+    response_data = serialize_search_results(results, full)
+    return Response({'products': response_data, 'count': len(response_data)})
+
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def catalog(request):
+    """Filtered, keyset-paginated product cards with facet counts for the catalog sidebar.
+
+    Filters are those of ``search_filters`` plus ``color`` and ``size`` ids;
+    ``ordering``, ``page_size`` and ``cursor`` work as on ``/api/products/``.
+    """
+    params = request.query_params
+    try:
+        filters = search_filters(params)
+        filters['color'] = query_ids(params, 'color')
+        filters['size'] = query_ids(params, 'size')
+    except ValueError as e:
+        return Response({'error': f'Invalid filter: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    paginator = CatalogCursorPagination()
+    products = paginator.paginate_queryset(filter_catalog_queryset(search_card_queryset(), filters), request)
+    return Response({
+        'count': filter_catalog_queryset(Product.objects.all(), filters).count(),
+        'next': paginator.get_next_link(),
+        'previous': paginator.get_previous_link(),
+        'results': ProductSearchCardSerializer(products, many=True).data,
+        'facets': facet_counts(filters),
+    })
+
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def ai_search_status(request):
+    """Queue depth and inference timings of the AI search executor"""
+    return Response({
+        'ai_search_available': AI_SEARCH_AVAILABLE,
+        'inference': inference_executor.stats(),
+    })
+
+
 @csrf_exempt
 @require_http_methods(["GET"])
 def health_check(request):
@@ -1576,6 +1752,10 @@ def debug_ai(request):
             'ai_search_available': AI_SEARCH_AVAILABLE,
             'ai_search_service': ai_search_service is not None,
         }
+        if ai_search_service is not None:
+            ai_status['query_cache'] = ai_search_service.cache_stats()
+            ai_status['models'] = ai_search_service.model_status()
+            ai_status['inference'] = inference_executor.stats()
 
         # Try to import AI modules
         ai_modules = {}
@@ -0,0 +1,35 @@
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up_ai_search(models=None):
+    """Preload AI search models and the embedding index in this process.
+
+    Called from the ASGI/WSGI entry points so a worker has its models in
+    memory before it accepts traffic. ``models`` defaults to the
+    ``AI_SEARCH_WARMUP`` setting; nothing happens when it is empty or the AI
+    dependencies are not installed.
+    """
+    models = getattr(settings, 'AI_SEARCH_WARMUP', []) if models is None else models
+    if not models:
+        return None
+
+    try:
+        from .ai_search import ai_search_service, model_dependencies_available
+    except ImportError as e:
+        logger.info(f"Skipping AI search warm-up, dependencies unavailable: {e}")
+        return None
+    if not model_dependencies_available():
+        logger.info("Skipping AI search warm-up, model dependencies are not installed")
+        return None
+
+    try:
+        return ai_search_service.warm_up(models=models)
+    except Exception as e:
+        # A failed warm-up must not keep the server from starting; requests
+        # will retry the lazy load
+        logger.error(f"AI search warm-up failed: {e}")
+        return None
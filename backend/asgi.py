@@ -8,6 +8,7 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings_render')
 django.setup()
 
 import chat.routing
+from api.warmup import warm_up_ai_search
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),  # thêm dòng này để xử lý HTTP
@@ -17,3 +18,6 @@ application = ProtocolTypeRouter({
         )
     ),
 })
+
+# Load AI search models before the worker starts taking traffic
+warm_up_ai_search()
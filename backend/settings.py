@@ -264,6 +264,10 @@ SIMPLE_JWT = {
 }
 
 
+# Models to preload when an ASGI/WSGI worker starts, e.g. "clip,text" or
+# "text"; empty means models load lazily on the first request that needs them
+AI_SEARCH_WARMUP = [model.strip() for model in os.getenv('AI_SEARCH_WARMUP', '').split(',') if model.strip()]
+
 STRIPE_API_KEY = os.getenv('STRIPE_API_KEY')
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
 
@@ -182,6 +182,72 @@ AI_CACHE_DIR = os.path.join(BASE_DIR, 'ai_cache')
 if not os.path.exists(AI_CACHE_DIR):
     os.makedirs(AI_CACHE_DIR)
 
+# Query embedding / ranked result cache for AI text search, shared by all
+# workers through the Redis cache
+AI_SEARCH_QUERY_CACHE = {
+    'MAX_ENTRIES': 1024,
+    'TTL': 3600,
+    'BACKEND': 'default',
+    'CACHE_RESULTS': True,
+}
+
+# Perceptual-hash cache of uploaded image embeddings; uploads with the same
+# coarse colour and a dHash within MAX_DISTANCE bits of a cached one skip the
+# CLIP forward pass
+AI_SEARCH_IMAGE_CACHE = {
+    'MAX_ENTRIES': 512,
+    'TTL': 3600,
+    'MAX_DISTANCE': 4,
+}
+
+# Approximate nearest-neighbour (IVF) search, used once the catalog has at
+# least MIN_PRODUCTS embeddings and `precompute_embeddings --build-ann` has
+# been run for the current index version
+AI_SEARCH_ANN = {
+    'ENABLED': True,
+    'MIN_PRODUCTS': 5000,
+    'NPROBE': 8,
+}
+
+# Dedicated pool for CLIP / sentence-transformer inference. Requests beyond
+# WORKERS running + MAX_QUEUE waiting get an immediate 503 with Retry-After,
+# and a request waits at most TIMEOUT seconds for its result
+AI_SEARCH_INFERENCE = {
+    'WORKERS': 2,
+    'MAX_QUEUE': 8,
+    'TIMEOUT': 10,
+    'RETRY_AFTER': 2,
+}
+
+# Storage of the embedding matrices in the on-disk index: 'float32', 'float16'
+# (half the size) or 'int8' (a quarter, one scale per vector). Compare recall
+# first with `manage.py precompute_embeddings --storage-report`
+AI_SEARCH_INDEX_STORAGE = 'float32'
+
+# Ranking weights of AI search (see api.ai_search.DEFAULT_SCORING); tune them
+# against a labelled query set with `manage.py evaluate_ai_search`
+AI_SEARCH_SCORING = {
+    'IMAGE_WEIGHT': 0.6,
+    'TEXT_WEIGHT': 0.4,
+    'LEXICAL_WEIGHT': 0.2,
+    'CATEGORY_WEIGHT': 0.1,
+}
+
+# In-process search indexes (lexical index, catalog filter bitmaps) follow
+# product changes made by other workers through a counter in this cache,
+# checked at most every CHECK_INTERVAL seconds
+SEARCH_INDEX_SYNC = {
+    'BACKEND': 'default',
+    'CHECK_INTERVAL': 5,
+}
+
+# Keyset pagination of /api/products/ (api.pagination.ProductCursorPagination);
+# applies when a request passes cursor, page_size or ordering
+PRODUCT_PAGINATION = {
+    'PAGE_SIZE': 24,
+    'MAX_PAGE_SIZE': 100,
+}
+
 # Session configuration
 SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
 SESSION_CACHE_ALIAS = 'default'
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_wsgi_application()
+
+# Load AI search models before the worker starts taking traffic
+from api.warmup import warm_up_ai_search  # noqa: E402
+warm_up_ai_search()